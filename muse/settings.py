@@ -160,6 +160,12 @@ TEMPLATE_DEBUG = True
 
 DOC_TEMPLATE_DIR = os.path.join(MUSE_ROOT_DIR, 'common/doctemplates/')
 
+# local caches of the samples, such as image sizes, readable by this user only
+SAMPLE_CACHE_DIR = os.environ.get(
+    'MUSE_SAMPLE_CACHE_DIR',
+    os.path.join(MUSE_ROOT_DIR, 'cache'),
+)
+
 STATIC_ROOT = os.path.abspath(os.path.join(MUSE_ROOT_DIR, 'staticfiles'))
 STATICFILES_DIRS = (
     os.path.join(MUSE_ROOT_DIR, 'common', 'static'),
@@ -0,0 +1,293 @@
+# Copyright (c) 2016-present, Facebook, Inc. All rights reserved.
+#
+# You are hereby granted a non-exclusive, worldwide, royalty-free license to
+# use, copy, modify, and distribute this software in source code or binary
+# form for use in connection with the web services and APIs provided by
+# Facebook.
+#
+# As with any software that integrates with the Facebook platform, your use of
+# this software is subject to the Facebook Developer Principles and Policies
+# [http://developers.facebook.com/policy/]. This copyright notice shall be
+# included in all copies or substantial portions of the software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+# Ad Creation Flows
+
+## Creating the objects of an ad with as few round trips as possible
+
+***
+
+Creating an ad takes several objects, each depending on the previous ones:
+an image, a campaign, an ad set in the campaign, a creative using the image
+and an ad using the ad set and creative. Created one after the other, they
+cost one round trip each.
+
+An `AdFlow` takes all the objects of a flow at once, with the ids they
+depend on given as batch request result references, e.g.
+`flow.ref('campaign')` for `{result=campaign:$.id}`. It then creates them in
+rounds:
+
+* the objects that cannot be created in a batch request, such as image
+  uploads, and the steps added with `add_call` run on their own threads, at
+  the same time as
+* one batch request with every other object whose dependencies are either
+  created or in the same batch, which resolves the references itself.
+
+References to objects created in a previous round are replaced by their
+values. A campaign, ad set, creative and ad with an image take 2 rounds
+instead of 5 sequential calls, the image being uploaded alongside the
+campaign and ad set. The time each step took is kept in `timings`.
+
+Steps of a batch request that got no response are sent again in the next
+round, along with the ones depending on them.
+
+## References:
+
+* [Batch requests][1]
+
+[1]: https://developers.facebook.com/docs/graph-api/making-multiple-requests
+"""
+from facebookads.api import FacebookAdsApi
+import collections
+import re
+import time
+from utils import BoundedExecutor
+
+
+class AdFlow:
+    """
+    The objects of an ad creation flow and their dependencies.
+
+    For example
+
+    flow = AdFlow()
+    flow.add('image', image, batch=False)
+    flow.add('campaign', campaign, {'status': Campaign.Status.paused})
+    adset[AdSet.Field.campaign_id] = flow.ref('campaign')
+    flow.add('adset', adset)
+    objects = flow.execute()
+    """
+
+    # maximum number of requests in a Graph API batch request
+    BATCH_SIZE_LIMIT = 50
+
+    # `{result=<step name>:$.<field>}`
+    REFERENCE = re.compile(r'\{result=(\w+):\$\.(\w+)\}')
+
+    # number of times a step without response is sent again
+    MAX_RETRIES = 2
+
+    # worker threads shared by every flow, to create the objects of a round
+    # at the same time
+    executor = BoundedExecutor(max_workers=8, name='ad_flow')
+
+    def __init__(self):
+        self.steps = collections.OrderedDict()
+        self.timings = {}
+
+    def ref(self, name, field='id'):
+        """
+        Return a reference to `field` of the object created by step `name`.
+        """
+        return '{result=%s:$.%s}' % (name, field)
+
+    def add(self, name, obj, params=None, batch=True):
+        """
+        Add a step creating `obj` with `remote_create`. References in the
+        fields of `obj` or in `params` must be to steps already added.
+        Objects created with `batch=False` are not sent in batch requests,
+        e.g. images uploaded from a file.
+        """
+        if name in self.steps:
+            raise ValueError('Duplicate step %s' % name)
+        params = params or {}
+        dependencies = set()
+        self.find_references(obj, dependencies)
+        self.find_references(params, dependencies)
+        for dependency in dependencies:
+            if dependency not in self.steps:
+                raise ValueError(
+                    'Step %s depends on unknown step %s' % (name, dependency)
+                )
+        self.steps[name] = {
+            'obj': obj,
+            'params': params,
+            'batch': batch,
+            'dependencies': dependencies,
+            'attempts': 0,
+        }
+        return obj
+
+    def add_call(self, name, func):
+        """
+        Add a step calling `func` rather than creating an object, such as
+        uploading an image through `AdImageUploader`. The dict `func`
+        returns is the result the other steps refer to.
+        """
+        if name in self.steps:
+            raise ValueError('Duplicate step %s' % name)
+        self.steps[name] = {
+            'call': func,
+            'obj': None,
+            'params': {},
+            'batch': False,
+            'dependencies': set(),
+            'attempts': 0,
+        }
+
+    def find_references(self, value, names):
+        if isinstance(value, basestring):
+            for match in self.REFERENCE.finditer(value):
+                names.add(match.group(1))
+        elif isinstance(value, (list, tuple)):
+            for item in value:
+                self.find_references(item, names)
+        elif isinstance(value, collections.Mapping):
+            for item in value.values():
+                self.find_references(item, names)
+
+    def resolve(self, value, done):
+        """
+        Replace, in place where possible, the references of `value` to the
+        steps of `done` by their values.
+        """
+        if isinstance(value, basestring):
+            def replace(match):
+                if match.group(1) not in done:
+                    return match.group(0)
+                return str(self.steps[match.group(1)]['obj'][match.group(2)])
+            return self.REFERENCE.sub(replace, value)
+        elif isinstance(value, list):
+            return [self.resolve(item, done) for item in value]
+        elif isinstance(value, tuple):
+            return tuple(self.resolve(item, done) for item in value)
+        elif isinstance(value, collections.MutableMapping):
+            for key in list(value.keys()):
+                value[key] = self.resolve(value[key], done)
+        return value
+
+    def execute(self, api=None):
+        """
+        Create the objects of all the steps and return them in a dict by
+        step name. Raises the first error of a round, once all its requests
+        are done, and a `RuntimeError` naming the steps which got no
+        response `MAX_RETRIES` times in a row.
+        """
+        if not api:
+            # keep a copy of the Ads API session as we're going to be using
+            # it across new threads
+            api = FacebookAdsApi.get_default_api()
+
+        start_time = time.time()
+        done = set()
+        while len(done) < len(self.steps):
+            tasks = self.get_round(done)
+            if not tasks:
+                raise ValueError('Circular dependencies between steps')
+
+            errors = []
+
+            def run(task):
+                task_start = time.time()
+                names = task if isinstance(task, list) else [task]
+                for name in names:
+                    step = self.steps[name]
+                    step['attempts'] += 1
+                    self.resolve(step['obj'], done)
+                    step['params'] = self.resolve(step['params'], done)
+                if isinstance(task, list):
+                    names = self.execute_batch(api, task, errors)
+                elif 'call' in self.steps[task]:
+                    self.steps[task]['obj'] = self.steps[task]['call']()
+                else:
+                    self.steps[task]['obj'].remote_create(
+                        params=self.steps[task]['params'],
+                    )
+                for name in names:
+                    self.timings[name] = time.time() - task_start
+                return names
+
+            for names in self.executor.map_unordered(run, tasks):
+                done.update(names)
+            if errors:
+                raise errors[0]
+
+            failed = [
+                name for name, step in self.steps.iteritems()
+                if name not in done and step['attempts'] > self.MAX_RETRIES
+            ]
+            if failed:
+                raise RuntimeError(
+                    'No response for steps %s' % ', '.join(failed)
+                )
+
+        self.timings['total'] = time.time() - start_time
+        return dict(
+            (name, step['obj']) for name, step in self.steps.iteritems()
+        )
+
+    def get_round(self, done):
+        """
+        Return the tasks of the next round: the names of the ready steps
+        which are not batched, and a list of the steps of the batch request,
+        in the order they were added.
+        """
+        tasks = []
+        batch = []
+        for name, step in self.steps.iteritems():
+            if name in done:
+                continue
+            if step['batch']:
+                ready = all(
+                    dependency in done or dependency in batch
+                    for dependency in step['dependencies']
+                )
+                if ready and len(batch) < self.BATCH_SIZE_LIMIT:
+                    batch.append(name)
+            elif step['dependencies'] <= done:
+                tasks.append(name)
+        if batch:
+            tasks.append(batch)
+        return tasks
+
+    def execute_batch(self, api, names, errors):
+        """
+        Create the objects of the steps with one batch request, append the
+        errors to `errors` and return the names of the steps which got a
+        response. Requests are named after their step, so that the
+        following ones can refer to their results.
+        """
+        api_batch = api.new_batch()
+        responded = []
+
+        def callback_success(name):
+            def callback(response):
+                responded.append(name)
+            return callback
+
+        def callback_failure(name):
+            def callback(response):
+                responded.append(name)
+                errors.append(response.error())
+            return callback
+
+        for name in names:
+            call = self.steps[name]['obj'].remote_create(
+                batch=api_batch,
+                success=callback_success(name),
+                failure=callback_failure(name),
+                params=self.steps[name]['params'],
+            )
+            # the results of named requests are only returned when asked to
+            call['name'] = name
+            call['omit_response_on_success'] = False
+        api_batch.execute()
+        return responded
@@ -34,6 +34,11 @@ be 1 x 2 x 2 x 3 = 12 creatives in the result ad set. Instead of making 12
 separate requests, the sample uses the batch API to send one request with all
 12 creatives.
 
+For bigger grids, e.g. 5 titles x 5 bodies x 4 urls x 10 images = 1000 ads,
+the combinations are generated lazily and sent in batches of 50 ads, several
+batches at a time. An ad that fails does not stop the others, and a dry run
+counts and validates the combinations without any API call.
+
 ## References:
 
 * Marketing API Guide: [Chapter 3 - Ad creative, placement, and previews][1]
@@ -43,15 +48,21 @@ separate requests, the sample uses the batch API to send one request with all
 [2]: https://developers.facebook.com/docs/marketing-api/batch-requests
 """
 from facebookads.objects import (
-    AdAccount,
     Campaign,
     AdSet,
     Ad,
-    AdImage,
     AdCreative,
 )
+from facebookads.api import FacebookAdsApi
+from facebookads.exceptions import FacebookRequestError
 import itertools
-from utils import generate_batches
+import logging
+import os
+from ad_flow import AdFlow
+from adimage_cache import default_uploader
+from utils import BoundedExecutor, generate_batches
+
+logger = logging.getLogger(__name__)
 
 
 class AdCreationSample:
@@ -59,8 +70,18 @@ class AdCreationSample:
     This class provides a function named create_multiple_link_clicks_ads
     that takes in multiple creative elements (e.g. images, text, links) and
     creates ads using all combinations of those elements.
+
+    `launch_link_clicks_ads` does the same for large numbers of
+    combinations, and reports the ads that failed.
     """
 
+    # maximum number of requests in a Graph API batch request
+    BATCH_SIZE_LIMIT = 50
+
+    # worker threads shared by every instance, which caps the number of
+    # batch requests in flight across all callers
+    executor = BoundedExecutor(max_workers=8, name='adcreation')
+
     def create_multiple_link_clicks_ads(
         self,
 
@@ -117,13 +138,77 @@ class AdCreationSample:
         * `start_time` when the campaign should start
         * `end_time` when the campaign should end
 
-
+        The steps are run by `launch_link_clicks_ads`. Ads which could not be
+        created are logged, and not returned.
         """
-        my_account = AdAccount(fbid=accountid)
+        result = self.launch_link_clicks_ads(
+            accountid,
+            pageid,
+            name,
+            titles,
+            bodies,
+            urls,
+            image_paths,
+            targeting,
+            optimization_goal,
+            billing_event,
+            bid_amount,
+            daily_budget,
+            lifetime_budget,
+            start_time,
+            end_time,
+        )
+        for combination, error in result['failures']:
+            logger.warning("Failed to create ad %s: %s", combination, error)
+
+        return [result['campaign'], result['adset'], result['ads']]
+
+    def launch_link_clicks_ads(
+        self,
+
+        accountid,
+        pageid,
+
+        name,
 
+        titles,
+        bodies,
+        urls,
+        image_paths,
+
+        targeting,
+
+        optimization_goal,
+        billing_event,
+        bid_amount,
+        daily_budget=None,
+        lifetime_budget=None,
+
+        start_time=None,
+        end_time=None,
+
+        batch_size=BATCH_SIZE_LIMIT,
+        dry_run=False,
+        api=None,
+    ):
         """
-          Take different title body url and image paths, create a batch of
-          ads based on the permutation of these elements
+        Create an ad for every combination of creative elements, with the
+        params of `create_multiple_link_clicks_ads`.
+
+        The images are uploaded while the campaign and ad set are created.
+        The combinations are then read lazily from `itertools.product` and
+        sent in batch requests of `batch_size` ads, several at a time on the
+        shared `executor`. Combinations with an image file which does not
+        exist, or invalid text or url, see `validate_combination`, are not
+        sent, and an ad which fails does not stop the others, even if its
+        whole batch request fails. Missing images are not uploaded.
+
+        Returns a dict with the `campaign`, the `adset`, the created `ads`,
+        the `failures` as `(combination, error message)` tuples and the
+        number of `combinations`.
+
+        With `dry_run`, nothing is created: only `combinations` and
+        `failures` are returned, for the invalid combinations.
         """
         # Check for bad specs
         if daily_budget is None:
@@ -136,6 +221,60 @@ class AdCreationSample:
                     'If lifetime_budget is defined, end_time must be defined.'
                 )
 
+        result = {
+            'campaign': None,
+            'adset': None,
+            'ads': [],
+            'failures': [],
+            'combinations': 0,
+        }
+
+        # check each image once, rather than once per combination
+        image_errors = {}
+        for image_path in image_paths:
+            if not os.path.isfile(image_path):
+                image_errors[image_path] = 'Missing image %s' % image_path
+        upload_paths = [
+            image_path for image_path in image_paths
+            if image_path not in image_errors
+        ]
+
+        def iter_combinations(image_hashes):
+            """
+            Step 4: Using itertools.product get combinations of creative
+            elements, lazily.
+            """
+            for combination in itertools.product(
+                titles,
+                bodies,
+                urls,
+                image_paths,
+            ):
+                result['combinations'] += 1
+                title, body, url, image_path = combination
+                error = self.validate_combination(title, body, url) or \
+                    image_errors.get(image_path)
+                if error:
+                    result['failures'].append(
+                        ((title, body, url, image_path), error),
+                    )
+                else:
+                    yield title, body, url, image_hashes[image_path]
+
+        if dry_run:
+            for combination in iter_combinations(
+                dict(zip(upload_paths, upload_paths)),
+            ):
+                pass
+            return result
+
+        if not api:
+            # keep a copy of the Ads API session as we're going to be using
+            # it across new threads
+            api = FacebookAdsApi.get_default_api()
+
+        flow = AdFlow()
+
         """
         Step 1: Create new campaign with WEBSITE_CLICKS objective
         See
@@ -147,7 +286,7 @@ class AdCreationSample:
         campaign[Campaign.Field.objective] = \
             Campaign.Objective.link_clicks
 
-        campaign.remote_create(params={
+        flow.add('campaign', campaign, {
             'status': Campaign.Status.paused,
         })
 
@@ -160,7 +299,7 @@ class AdCreationSample:
         """
         # Create ad set
         ad_set = AdSet(parent_id=accountid)
-        ad_set[AdSet.Field.campaign_id] = campaign.get_id_assured()
+        ad_set[AdSet.Field.campaign_id] = flow.ref('campaign')
         ad_set[AdSet.Field.name] = name + ' AdSet'
         ad_set[AdSet.Field.optimization_goal] = optimization_goal
         ad_set[AdSet.Field.billing_event] = billing_event
@@ -175,7 +314,7 @@ class AdCreationSample:
             ad_set[AdSet.Field.start_time] = start_time
 
         ad_set[AdSet.Field.targeting] = targeting
-        ad_set.remote_create()
+        flow.add('adset', ad_set)
 
         """
         Step 3: Upload images and get image hashes for use in ad creative.
@@ -183,28 +322,19 @@ class AdCreationSample:
         [Ad Image](https://developers.facebook.com/docs/marketing-api/reference/ad-image#Creating)
         for further details on the API used here.
         """
-        # Upload the images first one by one
-        image_hashes = []
-        for image_path in image_paths:
-            img = AdImage(parent_id=accountid)
-            img[AdImage.Field.filename] = image_path
-            img.remote_create()
-            image_hashes.append(img.get_hash())
-
-        ADGROUP_BATCH_CREATE_LIMIT = 10
-        ads_created = []
-
-        def callback_failure(response):
-            raise response.error()
+        # Upload the images at the same time, except those already uploaded
+        flow.add_call('images', lambda: {
+            'hashes': default_uploader.upload_ad_images(
+                accountid,
+                upload_paths,
+                api,
+            ),
+        })
+        objects = flow.execute(api)
+        result['campaign'] = campaign
+        result['adset'] = ad_set
 
-        """
-        Step 4: Using itertools.product get combinations of creative
-        elements.
-        """
-        for creative_info_batch in generate_batches(
-            itertools.product(titles, bodies, urls, image_hashes),
-            ADGROUP_BATCH_CREATE_LIMIT
-        ):
+        def create_ads(creative_info_batch):
             """
             Step 5: Create an API batch so we can create all
             ad creatives with one HTTP request.
@@ -212,9 +342,17 @@ class AdCreationSample:
             [Batch Requests](https://developers.facebook.com/docs/graph-api/making-multiple-requests#simple)
             for further details on batching API calls.
             """
-            api_batch = my_account.get_api_assured().new_batch()
+            api_batch = api.new_batch()
+            ads = []
+            errors = {}
+
+            def callback_failure(index):
+                def callback(response):
+                    errors[index] = response.error().api_error_message()
+                return callback
 
-            for title, body, url, image_hash in creative_info_batch:
+            for index, creative_info in enumerate(creative_info_batch):
+                title, body, url, image_hash = creative_info
                 # Create the ad
                 """
                 Step 6: For each combination of creative elements,
@@ -224,7 +362,7 @@ class AdCreationSample:
                 [AdGroup](https://developers.facebook.com/docs/marketing-api/adgroup/)
                 for further details on creating Ads.
                 """
-                ad = Ad(parent_id=accountid)
+                ad = Ad(parent_id=accountid, api=api)
                 ad[Ad.Field.name] = name + ' Ad'
                 ad[Ad.Field.adset_id] = ad_set.get_id_assured()
                 ad[Ad.Field.creative] = {
@@ -239,14 +377,60 @@ class AdCreationSample:
                     },
                 }
 
-                ad.remote_create(batch=api_batch, failure=callback_failure)
-                ads_created.append(ad)
+                ad.remote_create(
+                    batch=api_batch,
+                    failure=callback_failure(index),
+                )
+                ads.append(ad)
             """
             Step 7: Execute the batched API calls
             See
             [Batch Requests](https://developers.facebook.com/docs/graph-api/making-multiple-requests#simple)
             for further details on batching API calls.
             """
-            api_batch.execute()
+            message = 'No response'
+            try:
+                api_batch.execute()
+            except (FacebookRequestError, IOError, ValueError) as e:
+                # network errors, server errors or a response that is not
+                # JSON fail the ads of this batch only
+                logger.warning("Ad creation batch failed: %s", e)
+                message = str(e)
+
+            created = []
+            failures = []
+            for index, ad in enumerate(ads):
+                if index in errors or Ad.Field.id not in ad:
+                    failures.append((
+                        creative_info_batch[index],
+                        errors.get(index, message),
+                    ))
+                else:
+                    created.append(ad)
+            return created, failures
+
+        for created, failures in self.executor.map_unordered(
+            create_ads,
+            generate_batches(
+                iter_combinations(
+                    dict(zip(upload_paths, objects['images']['hashes'])),
+                ),
+                batch_size,
+            ),
+        ):
+            result['ads'].extend(created)
+            result['failures'].extend(failures)
+
+        return result
 
-        return [campaign, ad_set, ads_created]
+    def validate_combination(self, title, body, url):
+        """
+        Return why a combination of text and url can not make an ad, or
+        None if it can. Images are checked once, by
+        `launch_link_clicks_ads`.
+        """
+        if not title or not body:
+            return 'Empty title or body'
+        if not url.startswith(('http://', 'https://')):
+            return 'Invalid url %s' % url
+        return None
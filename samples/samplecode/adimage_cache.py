@@ -0,0 +1,225 @@
+# Copyright (c) 2016-present, Facebook, Inc. All rights reserved.
+#
+# You are hereby granted a non-exclusive, worldwide, royalty-free license to
+# use, copy, modify, and distribute this software in source code or binary
+# form for use in connection with the web services and APIs provided by
+# Facebook.
+#
+# As with any software that integrates with the Facebook platform, your use of
+# this software is subject to the Facebook Developer Principles and Policies
+# [http://developers.facebook.com/policy/]. This copyright notice shall be
+# included in all copies or substantial portions of the software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+# Ad Image Cache
+
+## Uploading each ad image once per ad account
+
+***
+
+The ad creation samples upload their images with `AdImage.remote_create()`,
+one at a time, every time they run. An image uploaded to an ad account can
+be used by any creative of that account through its hash, so uploading the
+same file again is wasted time.
+
+`AdImageUploader` remembers, in a SQLite file, the hash Facebook returned
+for the MD5 of the content of each image uploaded to each account. Files
+with the same content, whatever their name, are only uploaded once, and the
+images which are not in the cache are uploaded at the same time on a
+bounded pool of threads. Running a launch again with the same images uploads
+nothing.
+
+## References:
+
+* [Ad Image][1]
+
+[1]: https://developers.facebook.com/docs/marketing-api/reference/ad-image
+"""
+from facebookads.api import FacebookAdsApi
+from facebookads.objects import AdImage
+import getpass
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from utils import BoundedExecutor
+
+
+class AdImageCache:
+    """
+        Ad image hashes kept in a SQLite file, keyed by ad account and MD5
+        of the image content. Entries older than `ttl` seconds are ignored,
+        in case the image was deleted from the account.
+    """
+
+    def __init__(self, path, ttl=30 * 24 * 3600):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS ad_images ('
+            'account_id TEXT, content_hash TEXT, image_hash TEXT, '
+            'uploaded_at REAL, PRIMARY KEY (account_id, content_hash))'
+        )
+        self.connection.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, account_id, content_hash):
+        """
+            Return the image hash of the content, or None if it was not
+            uploaded to the account.
+        """
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT image_hash FROM ad_images '
+                'WHERE account_id = ? AND content_hash = ? '
+                'AND uploaded_at > ?',
+                (account_id, content_hash, time.time() - self.ttl),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return row[0]
+
+    def put(self, account_id, content_hash, image_hash):
+        with self.lock:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO ad_images VALUES (?, ?, ?, ?)',
+                (account_id, content_hash, image_hash, time.time()),
+            )
+            self.connection.commit()
+
+    def invalidate(self, account_id):
+        """
+            Forget the images of an account, e.g. after deleting them.
+        """
+        with self.lock:
+            self.connection.execute(
+                'DELETE FROM ad_images WHERE account_id = ?',
+                (account_id, ),
+            )
+            self.connection.commit()
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+class AdImageUploader:
+    """
+        Upload ad images through an `AdImageCache` at `cache_path`, opened
+        on first use.
+
+        For example
+
+        hashes = uploader.upload_ad_images(account_id, image_paths)
+    """
+
+    # one file per user, so that the cache of another user of the machine
+    # is never read; the samples site sets its own path with
+    # `set_cache_path`
+    DEFAULT_CACHE_PATH = os.path.join(
+        tempfile.gettempdir(),
+        'adimage_cache_{0}.db'.format(getpass.getuser()),
+    )
+
+    # worker threads shared by every instance, which caps the number of
+    # uploads in flight across all callers
+    executor = BoundedExecutor(max_workers=8, name='adimage_upload')
+
+    def __init__(self, cache_path=DEFAULT_CACHE_PATH):
+        self.cache_path = cache_path
+        self.cache = None
+        self.lock = threading.Lock()
+
+    def set_cache_path(self, cache_path):
+        """
+            Use the cache at `cache_path` from now on, closing the one in
+            use if any.
+        """
+        with self.lock:
+            if self.cache is not None:
+                self.cache.close()
+                self.cache = None
+            self.cache_path = cache_path
+
+    def get_cache(self):
+        with self.lock:
+            if self.cache is None:
+                cache_dir = os.path.dirname(self.cache_path)
+                if cache_dir and not os.path.isdir(cache_dir):
+                    os.makedirs(cache_dir, 0700)
+                self.cache = AdImageCache(self.cache_path)
+            return self.cache
+
+    def upload_ad_image(self, account_id, image_path, api=None):
+        """
+            Return the hash of the image in the account, uploading it
+            unless the same content already was.
+        """
+        return self.upload_ad_images(account_id, [image_path], api)[0]
+
+    def upload_ad_images(self, account_id, image_paths, api=None):
+        """
+            Return the hashes of the images in the account, in the order of
+            `image_paths`. The images whose content is not in the cache are
+            uploaded at the same time, once per distinct content.
+        """
+        if not api:
+            # keep a copy of the Ads API session as we're going to be using
+            # it across new threads
+            api = FacebookAdsApi.get_default_api()
+
+        cache = self.get_cache()
+        content_hashes = [
+            self.get_content_hash(image_path) for image_path in image_paths
+        ]
+
+        image_hashes = {}
+        misses = {}
+        for image_path, content_hash in zip(image_paths, content_hashes):
+            if content_hash in image_hashes or content_hash in misses:
+                continue
+            image_hash = cache.get(account_id, content_hash)
+            if image_hash:
+                image_hashes[content_hash] = image_hash
+            else:
+                misses[content_hash] = image_path
+
+        def upload(miss):
+            content_hash, image_path = miss
+            image = AdImage(parent_id=account_id, api=api)
+            image[AdImage.Field.filename] = image_path
+            image.remote_create()
+            cache.put(account_id, content_hash, image[AdImage.Field.hash])
+            return content_hash, image[AdImage.Field.hash]
+
+        image_hashes.update(
+            self.executor.map_unordered(upload, misses.items())
+        )
+        return [image_hashes[content_hash] for content_hash in content_hashes]
+
+    def get_content_hash(self, image_path):
+        md5 = hashlib.md5()
+        with open(image_path, 'rb') as image_file:
+            for chunk in iter(lambda: image_file.read(1 << 20), ''):
+                md5.update(chunk)
+        return md5.hexdigest()
+
+
+# shared by the samples
+default_uploader = AdImageUploader()
@@ -26,25 +26,166 @@
 ***
 
 This sample is to use the new Insights edge to pull insights and to
-simulate inserting into DB.
+simulate inserting into DB. `save_ads_insight` shows how to actually bulk
+load them with the sinks of `db_sink`.
+
+For backfills over long date ranges, `AdsReportingJobManager` runs the same
+report as async report runs, several at a time, and streams the rows of
+each one as soon as it finishes.
 
 ## References:
 * [Ads Insights doc][1]
+* [Asynchronous Jobs][2]
 
 [1]: https://developers.facebook.com/docs/marketing-api/insights-api
+[2]: https://developers.facebook.com/docs/marketing-api/insights-api/async
 """
+import logging
+import time
+from facebookads.api import FacebookAdsApi
+from facebookads.exceptions import FacebookRequestError
 from facebookads.objects import (
     AdAccount,
 )
+from utils import buffer_iterable_async
+
+logger = logging.getLogger(__name__)
 
 
 class AdsReportingSample:
     """
     This class provides 3 funciton (`get_ads_insight`,
     `get_insights_value`, `get_values`) to pull the insights
-    from the Insight edge with Facebook Marketing API
+    from the Insight edge with Facebook Marketing API.
+
+    For large accounts, `stream_ads_insight` walks every page of the
+    Insights edge and yields row tuples instead of building a list.
     """
 
+    # insight fields that are requested from the Insights edge
+    INSIGHT_FIELDS = [
+        'campaign_name',
+        'adset_name',
+        'adset_id',
+        'impressions',
+        'website_clicks',
+        'app_store_clicks',
+        'deeplink_clicks',
+        'spend',
+        'reach',
+        'actions',
+        'action_values'
+    ]
+
+    # action types that we want to get from insight
+    # format is (action_type_returned_from_api, db_column_name)
+    ACTION_TYPE_COLUMNS = (
+        ('link_click', 'website_clicks'),
+        ('offsite_conversion.checkout', 'checkouts'),
+        ('offsite_conversion.add_to_cart', 'adds_to_cart'),
+        ('offsite_conversion.key_page_view', 'key_web_page_views'),
+        ('offsite_conversion.lead', 'leads'),
+        ('offsite_conversion.other', 'other_website_conversions'),
+        ('offsite_conversion.registration', 'registrations'),
+        ('app_custom_event.fb_mobile_purchase', 'mobile_purchase'),
+        ('app_custom_event.fb_mobile_add_to_cart', 'mobile_add_to_cart'),
+        ('mobile_app_install', 'mobile_app_install'),
+        ('app_custom_event.fb_mobile_activate_app', 'mobile_activate_app'),
+    )
+
+    # action values that we want to get from insight
+    # format is (action_value_returned_from_api, db_column_name)
+    ACTION_VALUE_COLUMNS = (
+        ('offsite_conversion', 'website_action_value'),
+        ('app_custom_event.fb_mobile_purchase', 'mobile_purchase_value'),
+    )
+
+    # general columns that we want to get from insight
+    # format is (field_returned_from_api, db_column_name)
+    GENERAL_COLUMNS = (
+        ('impression_device', 'impression_device'),
+        ('placement', 'placement'),
+        ('action_device', 'action_device'),
+        ('campaign_name', 'campaign'),
+        ('adset_name', 'adset'),
+        ('adset_id', 'adset_id'),
+        ('impressions', 'impressions'),
+        ('website_clicks', 'website_clicks'),
+        ('app_store_clicks', 'app_store_clicks'),
+        ('deeplink_clicks', 'deeplink_clicks'),
+        ('spend', 'spend'),
+        ('reach', 'reach'),
+    )
+
+    # columns that identify an insight row when it is saved to a database
+    INSIGHT_KEY_COLUMNS = (
+        'start_date',
+        'adset_id',
+        'impression_device',
+        'placement',
+    )
+
+    def __init__(self, attribution_window='28d_click'):
+        """
+        Params:
+
+        * `attribution_window` is the action attribution window used for
+          the `actions` and `action_values` columns, e.g. `28d_click` or
+          `1d_view`
+        """
+        self.attribution_window = attribution_window
+        self.row_projectors = {}
+
+    def get_row_projector(self, general_columns=None):
+        """
+        Return an `InsightsRowProjector` for this sample's columns and
+        attribution window. Projectors are built once per set of general
+        columns and reused for every row.
+
+        Params:
+
+        * `general_columns` is an optional subset of `GENERAL_COLUMNS`
+        """
+        general_columns = tuple(general_columns or self.GENERAL_COLUMNS)
+        projector = self.row_projectors.get(general_columns)
+        if projector is None:
+            projector = InsightsRowProjector(
+                general_columns,
+                self.ACTION_TYPE_COLUMNS,
+                self.ACTION_VALUE_COLUMNS,
+                self.attribution_window,
+            )
+            self.row_projectors[general_columns] = projector
+        return projector
+
+    def get_insights_params(
+        self,
+        report_date,
+        limit=-1
+    ):
+        """
+        Build the Insights edge params for a single day report broken down
+        by impression device and placement
+
+        Params:
+
+        * `report_date` is the date for the insight report
+        * `limit` is the page size, or -1 to use the API default
+        """
+        params = {
+            'time_range': {
+                'since': report_date,
+                'until': report_date
+            },
+            'action_attribution_windows': [self.attribution_window],
+            'breakdowns': ['impression_device', 'placement'],
+            'level': 'adset',
+        }
+        if limit > 0:
+            params['limit'] = limit
+
+        return params
+
     def get_ads_insight(
         self,
         account_id,
@@ -64,35 +205,227 @@ class AdsReportingSample:
         """
         ad_account = AdAccount(fbid=account_id)
         limit = 10
-        fields = [
-            'campaign_name',
-            'adset_name',
-            'adset_id',
-            'impressions',
-            'website_clicks',
-            'app_store_clicks',
-            'deeplink_clicks',
-            'spend',
-            'reach',
-            'actions',
-            'action_values'
-        ]
-        params = {
-            'time_range': {
-                'since': report_date,
-                'until': report_date
-            },
-            'action_attribution_windows': ['28d_click'],
-            'breakdowns': ['impression_device', 'placement'],
-            'level': 'adset',
-            'limit': limit if limit > 0 else None
-        }
+        fields = self.INSIGHT_FIELDS
+        params = self.get_insights_params(report_date, limit)
 
         insights = ad_account.get_insights(fields, params)
         insights_value = self.get_insights_value(insights, report_date, limit)
 
         return insights_value
 
+    def stream_ads_insight(
+        self,
+        account_id,
+        report_date,
+        page_size=500,
+        prefetch_pages=2,
+        api=None
+    ):
+        """
+        Generator version of `get_ads_insight` that walks every page of the
+        Insights edge instead of stopping at the first 10 records.
+
+        The first item yielded is a tuple of column names; every following
+        item is a tuple of values in the same column order. Only
+        `prefetch_pages` pages are held in memory at any time: the next
+        page is fetched on a worker thread while the current one is being
+        consumed.
+
+        Params:
+
+        * `account_id` is your Facebook AdAccount id
+        * `report_date` is the date for the insight report
+        * `page_size` is the number of records requested per page
+        * `prefetch_pages` is how many pages may be fetched ahead of the
+          consumer. Use 0 to fetch pages on the calling thread.
+        * `api` is an optional FacebookAdsApi session, defaults to the
+          default api
+        """
+        if not api:
+            # keep a copy of the Ads API session as the pages may be
+            # fetched on a worker thread
+            api = FacebookAdsApi.get_default_api()
+
+        pages = self.get_insights_pages(
+            account_id,
+            report_date,
+            page_size,
+            api=api,
+        )
+        if prefetch_pages > 0:
+            pages = buffer_iterable_async(pages, buffer_size=prefetch_pages)
+
+        return self.get_insights_rows(pages, report_date)
+
+    def save_ads_insight(
+        self,
+        account_id,
+        report_date,
+        sink,
+        page_size=500
+    ):
+        """
+        Stream every insight of `stream_ads_insight` into a database sink
+        from `db_sink`, upserting on `INSIGHT_KEY_COLUMNS`. Returns the
+        number of rows written.
+
+        Params:
+
+        * `account_id` is your Facebook AdAccount id
+        * `report_date` is the date for the insight report
+        * `sink` is a `RowSink` built with `get_insights_sink`
+        * `page_size` is the number of records requested per page
+        """
+        rows = self.stream_ads_insight(
+            account_id,
+            report_date,
+            page_size=page_size,
+        )
+        header = next(rows, None)
+        if header is not None and header != sink.columns:
+            raise ValueError('The sink columns do not match the report')
+
+        return sink.write(rows)
+
+    def get_insights_sink(self, sink_class, connection, table='ads_insights'):
+        """
+        Build a `db_sink` sink for the rows of this sample and create its
+        table if needed
+
+        Params:
+
+        * `sink_class` is `SQLiteSink` or `PostgresSink`
+        * `connection` is an open connection of the matching database
+        * `table` is the name of the target table
+        """
+        sink = sink_class(
+            connection,
+            table,
+            self.get_row_projector().columns,
+            self.INSIGHT_KEY_COLUMNS,
+        )
+        sink.create_table()
+        return sink
+
+    def get_ads_insight_frame(
+        self,
+        account_id,
+        report_date,
+        page_size=500,
+        prefetch_pages=2
+    ):
+        """
+        Pull every insight of `stream_ads_insight` into an
+        `InsightsFrame`, a column oriented table that supports vectorized
+        roll-ups by campaign, ad set, device and placement. Requires numpy.
+
+        Params:
+
+        * `account_id` is your Facebook AdAccount id
+        * `report_date` is the date for the insight report
+        * `page_size` is the number of records requested per page
+        * `prefetch_pages` is how many pages may be fetched ahead
+        """
+        from insights_frame import InsightsFrame
+
+        return InsightsFrame.from_rows(self.stream_ads_insight(
+            account_id,
+            report_date,
+            page_size=page_size,
+            prefetch_pages=prefetch_pages,
+        ))
+
+    def get_insights_rows(
+        self,
+        pages,
+        report_date
+    ):
+        """
+        Generator that turns pages of insight records into a header tuple
+        of column names followed by one tuple of values per record
+
+        Params:
+
+        * `pages` is an iterable of lists of insight records
+        * `report_date` is the date for the insight report
+        """
+        projector = self.get_row_projector()
+        project = projector.project
+
+        header = True
+        for page in pages:
+            if header:
+                yield projector.columns
+                header = False
+            for insight in page:
+                yield project(insight, report_date)
+
+    def get_insights_pages(
+        self,
+        account_id,
+        report_date,
+        page_size=500,
+        api=None
+    ):
+        """
+        Generator that yields the raw insight records of the Insights edge
+        one page at a time, following the `paging.next` cursor until the
+        last page
+
+        Params:
+
+        * `account_id` is your Facebook AdAccount id
+        * `report_date` is the date for the insight report
+        * `page_size` is the number of records requested per page
+        * `api` is an optional FacebookAdsApi session, defaults to the
+          default api
+        """
+        if not api:
+            api = FacebookAdsApi.get_default_api()
+
+        path = (account_id, 'insights', )
+        params = self.get_insights_params(report_date, page_size)
+        params['fields'] = ','.join(self.INSIGHT_FIELDS)
+
+        return self.get_pages(path, params, api=api)
+
+    def get_pages(
+        self,
+        path,
+        params,
+        api=None
+    ):
+        """
+        Generator that yields the `data` of an edge one page at a time,
+        following the `paging.next` cursor until the last page
+
+        Params:
+
+        * `path` is the Graph API path of the edge
+        * `params` is the params of the first request
+        * `api` is an optional FacebookAdsApi session, defaults to the
+          default api
+        """
+        if not api:
+            api = FacebookAdsApi.get_default_api()
+
+        while path:
+            response = api.call(
+                FacebookAdsApi.HTTP_METHOD_GET,
+                path,
+                params,
+            ).json()
+
+            # only emit non-empty pages
+            if response['data']:
+                yield response['data']
+
+            if 'paging' in response and 'next' in response['paging']:
+                path = response['paging']['next']
+                params = {}
+            else:
+                break
+
     def get_insights_value(
         self,
         insights,
@@ -128,7 +461,9 @@ class AdsReportingSample:
         report_date
     ):
         """
-        Get the values from an insight object
+        Get the values from an insight object as a dict keyed by column
+        name. `get_row_projector` returns the same values as tuples, which
+        is much cheaper for large reports.
 
         Params:
 
@@ -138,43 +473,10 @@ class AdsReportingSample:
         For more information see the [Insights doc](
         https://developers.facebook.com/docs/marketing-api/insights)
         """
-        # action types that we want to get from insight
-        # format is action_type_returned_from_api: db_column_name
-        action_type_columns = {
-            'link_click': 'website_clicks',
-            'offsite_conversion.checkout': 'checkouts',
-            'offsite_conversion.add_to_cart': 'adds_to_cart',
-            'offsite_conversion.key_page_view': 'key_web_page_views',
-            'offsite_conversion.lead': 'leads',
-            'offsite_conversion.other': 'other_website_conversions',
-            'offsite_conversion.registration': 'registrations',
-            'app_custom_event.fb_mobile_purchase': 'mobile_purchase',
-            'app_custom_event.fb_mobile_add_to_cart': 'mobile_add_to_cart',
-            'mobile_app_install': 'mobile_app_install',
-            'app_custom_event.fb_mobile_activate_app': 'mobile_activate_app',
-        }
-
-        # action values that we want to get from insight
-        # format is action_value_returned_from_api: db_column_name
-        action_value_columns = {
-            'offsite_conversion': 'website_action_value',
-            'app_custom_event.fb_mobile_purchase': 'mobile_purchase_value',
-        }
-
-        # general columns that we want to get from insight
-        general_columns = {
-            'impression_device': 'impression_device',
-            'action_device': 'action_device',
-            'campaign_name': 'campaign',
-            'adset_name': 'adset',
-            'adset_id': 'adset_id',
-            'impressions': 'impressions',
-            'website_clicks': 'website_clicks',
-            'app_store_clicks': 'app_store_clicks',
-            'deeplink_clicks': 'deeplink_clicks',
-            'spend': 'spend',
-            'reach': 'reach'
-        }
+        action_type_columns = dict(self.ACTION_TYPE_COLUMNS)
+        action_value_columns = dict(self.ACTION_VALUE_COLUMNS)
+        general_columns = dict(self.GENERAL_COLUMNS)
+        window = self.attribution_window
 
         key_value = {'start_date': report_date, 'end_date': report_date}
         d1 = dict.fromkeys(action_type_columns.values())
@@ -195,17 +497,450 @@ class AdsReportingSample:
             actions = insight['actions']
             for action in actions:
                 t = action['action_type']
-                if t in action_type_columns and '28d_click' in action:
+                if t in action_type_columns and window in action:
                     key_value[action_type_columns[t]] = \
-                        str(action['28d_click'])
+                        str(action[window])
 
         # get values for action values
         if 'action_values' in insight:
             action_values = insight['action_values']
             for action_value in action_values:
                 t = action_value['action_type']
-                if t in action_value_columns and '28d_click' in action_value:
+                if t in action_value_columns and window in action_value:
                     key_value[action_value_columns[t]] = \
-                        str(action_value['28d_click'])
+                        str(action_value[window])
 
         return key_value
+
+
+class InsightsRowProjector:
+    """
+    Turns insight records into fixed-order tuples of column values.
+
+    The column order and the lookup tables from action type to column
+    index are computed once when the projector is built, so projecting a
+    row is a single pass over the record with no per-row dict merging.
+    Values are the same as the ones returned by
+    `AdsReportingSample.get_values`.
+    """
+
+    def __init__(
+        self,
+        general_columns,
+        action_type_columns,
+        action_value_columns,
+        attribution_window='28d_click'
+    ):
+        """
+        Params:
+
+        * `general_columns`, `action_type_columns` and
+          `action_value_columns` are sequences of
+          `(name_returned_from_api, db_column_name)` pairs
+        * `attribution_window` is the key read from every action
+        """
+        self.attribution_window = attribution_window
+
+        # columns that appear in several mappings (e.g. `website_clicks`)
+        # share one index, like the keys of `get_values` do
+        columns = ['start_date', 'end_date']
+
+        def column_index(column):
+            if column not in columns:
+                columns.append(column)
+            return columns.index(column)
+
+        self.general_indexes = tuple(
+            (field, column_index(column))
+            for field, column in general_columns
+        )
+        self.action_type_indexes = dict(
+            (action_type, column_index(column))
+            for action_type, column in action_type_columns
+        )
+        self.action_value_indexes = dict(
+            (action_type, column_index(column))
+            for action_type, column in action_value_columns
+        )
+        self.columns = tuple(columns)
+        self.empty_row = [None] * len(columns)
+
+    def project(self, insight, report_date):
+        """
+        Return the column values of an insight record as a tuple in the
+        order of `columns`
+
+        Params:
+
+        * `insight` is a single insights object or record
+        * `report_date` is the date for the insight report
+        """
+        row = self.empty_row[:]
+        row[0] = row[1] = report_date
+
+        for field, index in self.general_indexes:
+            if field in insight:
+                value = insight[field]
+                if not isinstance(value, basestring):
+                    value = str(value)
+                if "'" in value:
+                    value = value.replace("'", r"\'")
+                row[index] = value
+
+        window = self.attribution_window
+        for key, indexes in (
+            ('actions', self.action_type_indexes),
+            ('action_values', self.action_value_indexes),
+        ):
+            if key in insight:
+                for action in insight[key]:
+                    index = indexes.get(action['action_type'])
+                    if index is not None and window in action:
+                        row[index] = str(action[window])
+
+        return tuple(row)
+
+
+class InsightsReportJob:
+    """
+    State of a single async Insights report run submitted by
+    `AdsReportingJobManager`.
+    """
+
+    def __init__(self, account_id, report_date):
+        self.account_id = account_id
+        self.report_date = report_date
+        self.report_run_id = None
+        self.status = None
+        self.percent_completion = 0
+        self.polls = 0
+        self.poll_interval = None
+        self.next_poll_time = None
+        self.submitted_time = None
+        self.completed_time = None
+        self.fetched_time = None
+        self.num_rows = 0
+        # why submitting or polling the report run failed
+        self.error = None
+
+    def is_done(self):
+        return self.status in AdsReportingJobManager.DONE_STATUSES
+
+    def is_completed(self):
+        return self.status == AdsReportingJobManager.STATUS_COMPLETED
+
+    def get_latency(self):
+        """
+        Seconds between submitting the report run and the API reporting it
+        as done, or None while it is still running
+        """
+        if self.completed_time is None or self.submitted_time is None:
+            return None
+        return self.completed_time - self.submitted_time
+
+    def get_throughput(self):
+        """
+        Rows per second streamed from the finished report run, or None
+        until its results have been read
+        """
+        if self.fetched_time is None:
+            return None
+        elapsed = self.fetched_time - self.completed_time
+        return self.num_rows / elapsed if elapsed > 0 else None
+
+
+class AdsReportingJobManager:
+    """
+    Runs `AdsReportingSample` reports as async Insights report runs, one
+    per account and day, so that a backfill over a long date range does
+    not have to wait on one blocking request per day.
+
+    Up to `max_jobs` report runs are in flight at once. They are polled
+    from a single scheduler loop with an exponential backoff, and the
+    rows of every run are streamed out as soon as it finishes.
+
+    For more information see the [Asynchronous Jobs doc](
+    https://developers.facebook.com/docs/marketing-api/insights-api/async)
+    """
+
+    STATUS_COMPLETED = 'Job Completed'
+    STATUS_FAILED = 'Job Failed'
+    STATUS_SKIPPED = 'Job Skipped'
+    DONE_STATUSES = (STATUS_COMPLETED, STATUS_FAILED, STATUS_SKIPPED)
+
+    def __init__(
+        self,
+        sample=None,
+        max_jobs=5,
+        poll_interval=1.0,
+        max_poll_interval=30.0,
+        backoff=2.0,
+        page_size=500,
+        api=None
+    ):
+        """
+        Params:
+
+        * `sample` is the `AdsReportingSample` used to build the report
+          params and rows, defaults to a new one
+        * `max_jobs` is the number of report runs in flight at once
+        * `poll_interval` is the delay in seconds before the first poll of
+          a report run
+        * `max_poll_interval` caps the delay between two polls of the same
+          report run
+        * `backoff` is the factor applied to the delay after each poll
+          that finds the report run still running
+        * `page_size` is the number of records requested per result page
+        * `api` is an optional FacebookAdsApi session, defaults to the
+          default api
+        """
+        self.sample = sample or AdsReportingSample()
+        self.max_jobs = max_jobs
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.backoff = backoff
+        self.page_size = page_size
+        self.api = api
+        self.jobs = []
+        self.start_time = None
+
+    def run(
+        self,
+        account_ids,
+        report_dates
+    ):
+        """
+        Generator that submits one report run per account and day and
+        yields a `(job, rows)` pair for every report run as soon as it is
+        done, in completion order.
+
+        `rows` streams the header tuple and the row tuples of the report
+        in the same format as `AdsReportingSample.stream_ads_insight`. It
+        should be consumed before asking for the next pair. For failed or
+        skipped report runs `rows` is empty and `job.status` tells why. A
+        report run that could not be submitted or polled is failed, with
+        the error in `job.error`, and the others keep going.
+
+        Params:
+
+        * `account_ids` is a list of Facebook AdAccount ids
+        * `report_dates` is a list of dates for the insight reports
+        """
+        if not self.api:
+            self.api = FacebookAdsApi.get_default_api()
+
+        self.start_time = time.time()
+        pending = [
+            InsightsReportJob(account_id, report_date)
+            for account_id in account_ids
+            for report_date in report_dates
+        ]
+        pending.reverse()
+        running = []
+
+        while pending or running:
+            while pending and len(running) < self.max_jobs:
+                job = pending.pop()
+                self.jobs.append(job)
+                if self.call_job(job, self.submit):
+                    running.append(job)
+                else:
+                    job.completed_time = time.time()
+                    yield job, iter(())
+
+            if not running:
+                continue
+
+            # poll the report run that is due first
+            job = min(running, key=lambda j: j.next_poll_time)
+            delay = job.next_poll_time - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            self.call_job(job, self.poll)
+
+            if not job.is_done():
+                job.poll_interval = min(
+                    job.poll_interval * self.backoff,
+                    self.max_poll_interval,
+                )
+                job.next_poll_time = time.time() + job.poll_interval
+                continue
+
+            running.remove(job)
+            job.completed_time = time.time()
+            logger.info(
+                "Report run %s for %s on %s is done (%s) after %.1fs",
+                job.report_run_id, job.account_id, job.report_date,
+                job.status, job.get_latency(),
+            )
+
+            if job.is_completed():
+                yield job, self.get_job_rows(job)
+            else:
+                yield job, iter(())
+
+    def call_job(self, job, method):
+        """
+        Call `submit` or `poll` on `job` and return whether it succeeded,
+        marking the job as failed otherwise
+        """
+        try:
+            method(job)
+            return True
+        except (FacebookRequestError, IOError, ValueError, KeyError) as e:
+            # API errors, network errors or an unexpected response
+            logger.warning(
+                "Report run for %s on %s failed: %s",
+                job.account_id, job.report_date, e,
+            )
+            job.status = self.STATUS_FAILED
+            job.error = e
+            return False
+
+    def submit(self, job):
+        """
+        Start an async report run for the account and day of `job`
+        """
+        params = self.sample.get_insights_params(job.report_date)
+        params['fields'] = ','.join(self.sample.INSIGHT_FIELDS)
+        response = self.api.call(
+            FacebookAdsApi.HTTP_METHOD_POST,
+            (job.account_id, 'insights', ),
+            params,
+        ).json()
+
+        job.report_run_id = response['report_run_id']
+        job.submitted_time = time.time()
+        job.poll_interval = self.poll_interval
+        job.next_poll_time = job.submitted_time + job.poll_interval
+
+    def poll(self, job):
+        """
+        Refresh the status of the report run of `job`
+        """
+        response = self.api.call(
+            FacebookAdsApi.HTTP_METHOD_GET,
+            (job.report_run_id, ),
+            {'fields': 'async_status,async_percent_completion'},
+        ).json()
+
+        job.polls += 1
+        job.status = response.get('async_status')
+        job.percent_completion = response.get('async_percent_completion', 0)
+
+    def get_job_rows(self, job):
+        """
+        Generator that streams the rows of a completed report run and
+        records how many were read, not counting the header, and how long
+        it took
+        """
+        pages = self.sample.get_pages(
+            (job.report_run_id, 'insights', ),
+            {'limit': self.page_size},
+            api=self.api,
+        )
+        rows = self.sample.get_insights_rows(pages, job.report_date)
+        for row in rows:
+            # the header
+            yield row
+            break
+        for row in rows:
+            job.num_rows += 1
+            yield row
+        job.fetched_time = time.time()
+
+    def get_stats(self):
+        """
+        Return a dict summarizing the report runs submitted so far: the
+        number of jobs and rows, the average and max job latency in
+        seconds and the overall jobs and rows per second
+        """
+        done = [job for job in self.jobs if job.completed_time is not None]
+        latencies = [
+            job.get_latency() for job in done
+            if job.get_latency() is not None
+        ]
+        num_rows = sum(job.num_rows for job in self.jobs)
+        elapsed = time.time() - self.start_time if self.start_time else 0
+
+        return {
+            'jobs': len(self.jobs),
+            'jobs_done': len(done),
+            'jobs_failed': len([j for j in done if not j.is_completed()]),
+            'rows': num_rows,
+            'elapsed': elapsed,
+            'avg_latency': (
+                sum(latencies) / len(latencies) if latencies else None
+            ),
+            'max_latency': max(latencies) if latencies else None,
+            'jobs_per_sec': len(done) / elapsed if elapsed > 0 else None,
+            'rows_per_sec': num_rows / elapsed if elapsed > 0 else None,
+        }
+
+
+if __name__ == '__main__':
+    import argparse
+    import random
+
+    parser = argparse.ArgumentParser(
+        description='Micro-benchmark of turning insight records into rows '
+                    'with AdsReportingSample.get_values (dict per row) and '
+                    'with InsightsRowProjector (tuple per row), over '
+                    'synthetic records. No API calls are made.',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        '-n', type=int, default=200000, dest='num_rows',
+        help='number of synthetic insight records',
+    )
+    parser.add_argument(
+        '-w', default='28d_click', dest='attribution_window',
+        help='action attribution window',
+    )
+    args = parser.parse_args()
+
+    sample = AdsReportingSample(args.attribution_window)
+    action_types = [t for t, _ in sample.ACTION_TYPE_COLUMNS] + ['like']
+
+    def synthetic_insight(i):
+        actions = [
+            {'action_type': t, args.attribution_window: str(i % 97)}
+            for t in random.sample(action_types, 4)
+        ]
+        return {
+            'campaign_name': "Campaign's %d" % (i % 50),
+            'adset_name': 'AdSet %d' % (i % 500),
+            'adset_id': str(6000000000000 + i % 500),
+            'impression_device': random.choice(['iphone', 'desktop']),
+            'placement': random.choice(['mobile_feed', 'right_hand']),
+            'impressions': str(i % 10000),
+            'spend': '%.2f' % (i % 1000 / 7.0),
+            'reach': str(i % 5000),
+            'actions': actions,
+            'action_values': [
+                {'action_type': 'offsite_conversion',
+                 args.attribution_window: '12.5'},
+            ],
+        }
+
+    insights = [synthetic_insight(i) for i in xrange(args.num_rows)]
+    report_date = '2016-01-01'
+
+    def get_values_rows():
+        for insight in insights:
+            key_value = sample.get_values(insight, report_date)
+            tuple(key_value.values())
+
+    def projector_rows():
+        project = sample.get_row_projector().project
+        for insight in insights:
+            project(insight, report_date)
+
+    for name, run in (
+        ('get_values', get_values_rows),
+        ('InsightsRowProjector', projector_rows),
+    ):
+        start = time.time()
+        run()
+        elapsed = time.time() - start
+        print '%-22s %10.0f rows/sec' % (name, args.num_rows / elapsed)
@@ -27,14 +27,20 @@ Network enabled on them but don't have it enabled yet. Also explained is a
 function to help enable Audience Network given a list of ad set ids.
 """
 
+from facebookads.api import FacebookAdsApi
+from facebookads.exceptions import FacebookRequestError
 from facebookads.objects import (
     AdAccount,
     Campaign,
     AdSet,
     TargetingSpecsField,
 )
-from facebookads.exceptions import FacebookError
-import copy
+import json
+import logging
+import time
+from utils import BoundedExecutor, generate_batches
+
+logger = logging.getLogger(__name__)
 
 
 class AudienceNetworkOptinSample:
@@ -43,6 +49,23 @@ class AudienceNetworkOptinSample:
     don't have audience network (an) enabled on them and also help enable
     the audience network on a given list of ad set ids.
     """
+    # Ref: https://developers.facebook.com/docs/
+    #               marketing-api/audience-network/v2.5
+    DESIRED_CAMPAIGN_OBJECTIVES = set([
+        'MOBILE_APP_INSTALLS',
+        'MOBILE_APP_ENGAGEMENT',
+        'LINK_CLICKS',
+        'CONVERSIONS',
+        'PRODUCT_CATALOG_SALES',
+    ])
+
+    # maximum number of requests in a Graph API batch request
+    BATCH_SIZE_LIMIT = 50
+
+    # worker threads shared by every instance, which caps the number of
+    # batch requests in flight across all callers
+    executor = BoundedExecutor(max_workers=4, name='an_optin')
+
     def retrieve_eligible_adsets_for_an(
         self,
         accountid,
@@ -64,8 +87,63 @@ class AudienceNetworkOptinSample:
             an empty list.
 
         """
-        # use accountid to retrieve all active adsets
+        return list(self.iter_eligible_adsets_for_an(accountid, includepaused))
+
+    def iter_eligible_adsets_for_an(
+        self,
+        accountid,
+        includepaused=False,
+        page_size=500,
+    ):
+        """
+        Generator version of `retrieve_eligible_adsets_for_an`, which yields
+        the eligible ad sets as the pages of ad sets are read.
+
+        The campaigns of the desired objectives and statuses are read first,
+        filtered on the server with one paged call, and kept in a dict by
+        id, so ad sets are checked without reading their campaign. Only ad
+        sets of the desired statuses are requested. Ad sets whose campaign
+        is not in the dict, such as campaigns created while reading, are
+        left for the next run.
+
+        Args:
+            accountid: The ad account id (should be of the form act_<act_id>)
+            includepaused: see `retrieve_eligible_adsets_for_an`.
+            page_size: number of ad sets or campaigns per page.
+        """
         account = AdAccount(accountid)
+
+        desired_campaign_status = ['ACTIVE']
+        # the ad sets of a paused campaign are CAMPAIGN_PAUSED
+        campaign_status = ['ACTIVE']
+
+        # mostly useful in testing when you don't have active campaigns
+        if includepaused is True:
+            desired_campaign_status.extend(['PAUSED', 'CAMPAIGN_PAUSED'])
+            campaign_status.append('PAUSED')
+
+        campaignfields = [
+            Campaign.Field.id,
+            Campaign.Field.name,
+            Campaign.Field.effective_status,
+            Campaign.Field.objective,
+        ]
+        campaigns = dict(
+            (campaign[Campaign.Field.id], campaign)
+            for campaign in account.get_campaigns(
+                fields=campaignfields,
+                params={
+                    'effective_status': campaign_status,
+                    'filtering': [{
+                        'field': Campaign.Field.objective,
+                        'operator': 'IN',
+                        'value': sorted(self.DESIRED_CAMPAIGN_OBJECTIVES),
+                    }],
+                    'limit': page_size,
+                },
+            )
+        )
+
         adsetfields = [
             AdSet.Field.id,
             AdSet.Field.name,
@@ -73,87 +151,66 @@ class AudienceNetworkOptinSample:
             AdSet.Field.targeting,
             AdSet.Field.effective_status,
         ]
-        adsets = list(account.get_ad_sets(fields=adsetfields))
-
-        # Filter ad sets received by desired status and placement types.
-        # Further filter by campaign objectives listed in the criteria below.
-        #
-        # Ref: https://developers.facebook.com/docs/
-        #               marketing-api/audience-network/v2.5
-
-        desired_campaign_status = set(['ACTIVE'])
+        # filter ad sets by status on the server
+        adsets = account.get_ad_sets(
+            fields=adsetfields,
+            params={
+                'effective_status': desired_campaign_status,
+                'limit': page_size,
+            },
+        )
 
-        # mostly useful in testing when you don't have active campaigns
-        if includepaused is True:
-            desired_campaign_status.update({'PAUSED', 'CAMPAIGN_PAUSED'})
+        for adset in adsets:
+            if adset[AdSet.Field.effective_status] not in \
+                    desired_campaign_status:
+                continue
+            if not self.is_an_candidate(adset):
+                continue
 
-        desired_campaign_objectives = set([
-            'MOBILE_APP_INSTALLS',
-            'MOBILE_APP_ENGAGEMENT',
-            'LINK_CLICKS',
-            'CONVERSIONS',
-            'PRODUCT_CATALOG_SALES',
-        ])
+            # only the campaigns of the desired objectives were read
+            if adset[AdSet.Field.campaign_id] in campaigns:
+                yield adset
 
-        # Hold the result set
-        eligible_adsets = []
+    def is_an_candidate(self, adset):
+        """
+        Whether the placements of an ad set allow audience network, which is
+        not enabled yet.
+        """
+        targeting = adset[AdSet.Field.targeting]
 
-        for adset in adsets:
-            if adset[AdSet.Field.effective_status] in desired_campaign_status:
-
-                """
-                'devide_platforms', 'publisher_platforms' and
-                'facebook_positions' could be absent for the default of 'ALL'
-                """
-                device_platforms = None
-                if TargetingSpecsField.device_platforms in \
-                        adset[AdSet.Field.targeting]:
-                    device_platforms = set(
-                        adset[AdSet.Field.targeting][
-                            TargetingSpecsField.device_platforms]
-                    )
-
-                publisher_platforms = None
-                if TargetingSpecsField.publisher_platforms in \
-                        adset[AdSet.Field.targeting]:
-                    publisher_platforms = set(
-                        adset[AdSet.Field.targeting][
-                            TargetingSpecsField.publisher_platforms]
-                    )
-
-                facebook_positions = None
-                if TargetingSpecsField.facebook_positions in \
-                        adset[AdSet.Field.targeting]:
-                    facebook_positions = set(
-                        adset[AdSet.Field.targeting][
-                            TargetingSpecsField.facebook_positions]
-                    )
-
-                if ((facebook_positions is None or
-                        'feed' in facebook_positions) and
-                    (device_platforms is None or
-                        'mobile' in device_platforms)):
-
-                    if (publisher_platforms is None or
-                            'audience_network' in publisher_platforms):
-                        # audience network already enabled, so just pass
-                        continue
-                    else:
-                        campaign = Campaign(adset[AdSet.Field.campaign_id])
-                        campaignfields = [
-                            Campaign.Field.id,
-                            Campaign.Field.name,
-                            Campaign.Field.effective_status,
-                            Campaign.Field.objective,
-                        ]
-                        campaign = campaign.remote_read(fields=campaignfields)
-                        if (
-                            campaign[Campaign.Field.objective] in
-                            desired_campaign_objectives
-                        ):
-                            eligible_adsets.append(adset)
-
-        return eligible_adsets
+        """
+        'devide_platforms', 'publisher_platforms' and
+        'facebook_positions' could be absent for the default of 'ALL'
+        """
+        device_platforms = None
+        if TargetingSpecsField.device_platforms in targeting:
+            device_platforms = set(
+                targeting[TargetingSpecsField.device_platforms]
+            )
+
+        publisher_platforms = None
+        if TargetingSpecsField.publisher_platforms in targeting:
+            publisher_platforms = set(
+                targeting[TargetingSpecsField.publisher_platforms]
+            )
+
+        facebook_positions = None
+        if TargetingSpecsField.facebook_positions in targeting:
+            facebook_positions = set(
+                targeting[TargetingSpecsField.facebook_positions]
+            )
+
+        if ((facebook_positions is None or
+                'feed' in facebook_positions) and
+            (device_platforms is None or
+                'mobile' in device_platforms)):
+
+            # audience network already enabled, so it is not a candidate
+            return not (
+                publisher_platforms is None or
+                'audience_network' in publisher_platforms
+            )
+        return False
 
     def enable_an_on_adsets(
         self,
@@ -184,40 +241,171 @@ class AudienceNetworkOptinSample:
                 ...
             ]
         """
-        results = []
-
         # check if adsets is a list
         if type(adsetids) is not list:
-            return results
+            return []
+
+        results, stats = self.enable_an_on_adsets_bulk(adsetids)
+        return results
 
-        # go over the list of adset ids
+    def enable_an_on_adsets_bulk(
+        self,
+        adsetids,
+        batch_size=BATCH_SIZE_LIMIT,
+        max_retries=2,
+        api=None
+    ):
+        """
+        Bulk version of `enable_an_on_adsets` for many ad sets.
+
+        The ad set ids are packed into chunks of `batch_size`. For every
+        chunk, one batch request reads the targeting of the ad sets and,
+        once `audience_network` is added to their publisher platforms in
+        memory, one batch request writes them back. Chunks are processed
+        concurrently on the shared `executor`. Ad sets that fail with a
+        transient error, or get no response, are retried up to
+        `max_retries` times with an exponential backoff; ad sets which
+        already have audience network are not updated again. A batch
+        request failing as a whole, e.g. on a network error, only retries
+        the ad sets of its chunk.
+
+        Returns a tuple of
+        * the list of 'ad set id' vs. 'status' mappings, in the order of
+          `adsetids`, as returned by `enable_an_on_adsets`
+        * a dict with the number of `adsets`, the HTTP batch `requests`
+          sent, the `elapsed` seconds and the `adsets_per_sec` throughput
+        """
+        if not api:
+            # keep a copy of the Ads API session as we're going to be using
+            # it across new threads
+            api = FacebookAdsApi.get_default_api()
+
+        start_time = time.time()
+        results = {}
+        requests = 0
+        pending = list(set(adsetids))
+        for attempt in range(max_retries + 1):
+            retry = []
+            for failed, batch_requests in self.executor.map_unordered(
+                lambda batch: self.execute_enable_batch(api, batch, results),
+                generate_batches(pending, batch_size),
+            ):
+                # counted on the consumer thread only
+                retry.extend(failed)
+                requests += batch_requests
+
+            if not retry or attempt == max_retries:
+                break
+            logger.info("Retrying %s failed ad set updates", len(retry))
+            pending = retry
+            time.sleep(2 ** attempt)
+
+        elapsed = time.time() - start_time
+        stats = {
+            'adsets': len(results),
+            'requests': requests,
+            'elapsed': elapsed,
+            'adsets_per_sec':
+                len(results) / elapsed if elapsed > 0 else None,
+        }
+        return [{adsetid: results[adsetid]} for adsetid in adsetids], stats
+
+    def execute_enable_batch(
+        self,
+        api,
+        adsetids,
+        results
+    ):
+        """
+        Read the targeting of the ad sets of `adsetids` with one batch
+        request and enable audience network on them with another one.
+        Record the status of every ad set in `results` and return the ad
+        set ids worth retrying and the number of batch requests sent.
+        """
+        retry = []
+        targetings = {}
+
+        def callback_read(adsetid):
+            def callback(response):
+                targeting = response.json().get(AdSet.Field.targeting)
+                if targeting is None:
+                    results[adsetid] = {
+                        'status': 0,
+                        'message': 'No targeting in the ad set',
+                    }
+                else:
+                    targetings[adsetid] = targeting
+            return callback
+
+        def callback_success(adsetid):
+            def callback(response):
+                results[adsetid] = {'status': 1}
+            return callback
+
+        def callback_failure(adsetid):
+            def callback(response):
+                error = response.error()
+                results[adsetid] = {
+                    'status': 0,
+                    'message': error.api_error_message(),
+                }
+                if error.api_transient_error():
+                    retry.append(adsetid)
+            return callback
+
+        # read the targeting specs
+        api_batch = api.new_batch()
         for adsetid in adsetids:
-                try:
-                    # read ad set info
-                    adset = AdSet(fbid=adsetid)
-                    adsetobj = adset.remote_read(fields=[AdSet.Field.targeting])
-
-                    # edit targeting spec info for placements
-                    targetinginfo = copy.deepcopy(adsetobj[
-                        AdSet.Field.targeting
-                    ])
-                    targetinginfo[TargetingSpecsField.publisher_platforms]. \
-                        append('audience_network')
-
-                    # update ad set info
-                    adset.update({
-                        AdSet.Field.targeting: targetinginfo
-                    })
-                    adset.remote_update()
-
-                    # update result list along with status
-                    results.append({adsetid: {'status': 1}})
-
-                except FacebookError as e:
-
-                    # update result list along with status & message
-                    results.append({
-                        adsetid: {'status': 0, 'message': e.message}
-                    })
+            results.pop(adsetid, None)
+            api_batch.add(
+                FacebookAdsApi.HTTP_METHOD_GET,
+                (adsetid, ),
+                params={'fields': AdSet.Field.targeting},
+                success=callback_read(adsetid),
+                failure=callback_failure(adsetid),
+            )
+        message = 'No response'
+        try:
+            api_batch.execute()
+        except (FacebookRequestError, IOError, ValueError) as e:
+            # network errors, server errors or a response that is not JSON
+            logger.warning("Ad set read batch failed: %s", e)
+            message = str(e)
+        requests = 1
+
+        # add audience network to the placements
+        api_batch = api.new_batch()
+        updates = 0
+        for adsetid, targetinginfo in targetings.items():
+            platforms = targetinginfo.get(
+                TargetingSpecsField.publisher_platforms,
+            )
+            # no publisher platforms is the default of all of them
+            if platforms is None or 'audience_network' in platforms:
+                results[adsetid] = {'status': 1}
+                continue
+            platforms.append('audience_network')
+
+            api_batch.add(
+                FacebookAdsApi.HTTP_METHOD_POST,
+                (adsetid, ),
+                params={AdSet.Field.targeting: json.dumps(targetinginfo)},
+                success=callback_success(adsetid),
+                failure=callback_failure(adsetid),
+            )
+            updates += 1
+        if updates:
+            try:
+                api_batch.execute()
+            except (FacebookRequestError, IOError, ValueError) as e:
+                logger.warning("Ad set update batch failed: %s", e)
+                message = str(e)
+            requests += 1
+
+        # ad sets of a batch that failed as a whole have no result
+        for adsetid in adsetids:
+            if adsetid not in results:
+                results[adsetid] = {'status': 0, 'message': message}
+                retry.append(adsetid)
 
-        return results
+        return retry, requests
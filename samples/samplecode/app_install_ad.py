@@ -42,6 +42,8 @@ from facebookads.objects import (
     Ad
 )
 from facebookads.specs import ObjectStorySpec, LinkData
+from ad_flow import AdFlow
+from adimage_cache import default_uploader
 
 
 class AppInstallAdSample:
@@ -100,64 +102,68 @@ class AppInstallAdSample:
 
         [1]: https://developers.facebook.com/docs/marketing-api/adset
         [2]: https://developers.facebook.com/docs/marketing-api/targeting-specs
-        """
-        image_hash = self.upload_ad_image(account_id, image_path)
 
-        campaign_id = self.create_campaign(
+        The steps are created by an `AdFlow`: the image is uploaded while
+        the campaign and ad set are created in one batch request, then the
+        creative and ad are created in another. The time each step took is
+        returned in `timings`.
+        """
+        flow = AdFlow()
+        flow.add_call('image', lambda: {
+            AdImage.Field.hash: self.upload_ad_image(account_id, image_path),
+        })
+        flow.add('campaign', *self.build_campaign(
             account_id,
             '%s Campaign' % base_name
-        )
-
-        adset_id = self.create_ad_set(
+        ))
+        flow.add('adset', *self.build_ad_set(
             account_id,
             '%s AdSet' % base_name,
             daily_budget,
-            campaign_id,
+            flow.ref('campaign'),
             optimization_goal,
             billing_event,
             bid_amount,
             targeting,
             app_id,
             app_store_link,
-        )
-
-        creative_id = self.create_creative(
+        ))
+        flow.add('creative', *self.build_creative(
             account_id,
             '%s Creative' % base_name,
-            image_hash,
+            flow.ref('image', AdImage.Field.hash),
             message,
             page_id,
             app_name,
             app_store_link,
             deferred_app_link,
-        )
-
-        ad_id = self.create_ad(
+        ))
+        flow.add('ad', *self.build_ad(
             account_id,
             '%s Ad' % base_name,
-            adset_id,
-            creative_id,
+            flow.ref('adset'),
+            flow.ref('creative'),
             app_id,
-        )
+        ))
+        objects = flow.execute()
 
         return {
-            'image_hash': image_hash,
-            'campaign_id': campaign_id,
-            'adset_id': adset_id,
-            'creative_id': creative_id,
-            'ad_id': ad_id,
+            'image_hash': objects['image'][AdImage.Field.hash],
+            'campaign_id': objects['campaign'][Campaign.Field.id],
+            'adset_id': objects['adset'][AdSet.Field.id],
+            'creative_id': objects['creative'][AdCreative.Field.id],
+            'ad_id': objects['ad'][Ad.Field.id],
+            'timings': flow.timings,
         }
 
     def upload_ad_image(self, account_id, image_path):
         """
         Step 1: upload an ad image. See
         [Ad Image](https://developers.facebook.com/docs/marketing-api/adimage)
-        for further details on the API used here.
+        for further details on the API used here. Images already uploaded
+        to the account are not uploaded again, see `AdImageUploader`.
         """
-        image = AdImage(parent_id=account_id)
-        image[AdImage.Field.filename] = image_path
-        image.remote_create()
-        return image[AdImage.Field.hash]
+        return default_uploader.upload_ad_image(account_id, image_path)
 
     def create_campaign(self, account_id, name):
         """
@@ -165,15 +171,19 @@ class AppInstallAdSample:
         the API used here.
         [1]: https://developers.facebook.com/docs/marketing-api/adcampaign
         """
+        campaign, params = self.build_campaign(account_id, name)
+        campaign.remote_create(params=params)
+        return campaign[Campaign.Field.id]
+
+    def build_campaign(self, account_id, name):
         campaign = Campaign(parent_id=account_id)
         campaign[Campaign.Field.name] = name
         campaign[Campaign.Field.objective] = (
             Campaign.Objective.mobile_app_installs
         )
-        campaign.remote_create(params={
+        return campaign, {
             'status': Campaign.Status.paused
-        })
-        return campaign[Campaign.Field.id]
+        }
 
     def create_ad_set(self, account_id, name, daily_budget, campaign_id,
                       optimization_goal, billing_event, bid_amount,
@@ -183,6 +193,24 @@ class AppInstallAdSample:
         for further details on the API used here.
         [1]: https://developers.facebook.com/docs/marketing-api/adset
         """
+        adset, pdata = self.build_ad_set(
+            account_id,
+            name,
+            daily_budget,
+            campaign_id,
+            optimization_goal,
+            billing_event,
+            bid_amount,
+            targeting,
+            app_id,
+            app_store_link,
+        )
+        adset.remote_create(params=pdata)
+        return adset[AdSet.Field.id]
+
+    def build_ad_set(self, account_id, name, daily_budget, campaign_id,
+                     optimization_goal, billing_event, bid_amount,
+                     targeting, app_id, app_store_link):
         pdata = {
             AdSet.Field.name: name,
             AdSet.Field.optimization_goal: optimization_goal,
@@ -198,8 +226,7 @@ class AppInstallAdSample:
         }
         pdata['status'] = AdSet.Status.paused
         adset = AdSet(parent_id=account_id)
-        adset.remote_create(params=pdata)
-        return adset[AdSet.Field.id]
+        return adset, pdata
 
     def create_creative(self, account_id, name, image_hash, message, page_id,
                         app_name, app_store_link, deferred_app_link):
@@ -209,6 +236,21 @@ class AppInstallAdSample:
         API used here.
         [1]: https://developers.facebook.com/docs/marketing-api/adcreative
         """
+        creative, params = self.build_creative(
+            account_id,
+            name,
+            image_hash,
+            message,
+            page_id,
+            app_name,
+            app_store_link,
+            deferred_app_link,
+        )
+        creative.remote_create(params=params)
+        return creative[AdCreative.Field.id]
+
+    def build_creative(self, account_id, name, image_hash, message, page_id,
+                       app_name, app_store_link, deferred_app_link):
         link_data = LinkData()
         link_data[LinkData.Field.link] = app_store_link
         link_data[LinkData.Field.message] = message
@@ -230,9 +272,7 @@ class AppInstallAdSample:
         creative = AdCreative(parent_id=account_id)
         creative[AdCreative.Field.name] = name
         creative[AdCreative.Field.object_story_spec] = object_story_spec
-        creative.remote_create()
-
-        return creative[AdCreative.Field.id]
+        return creative, {}
 
     def create_ad(self, account_id, name, adset_id, creative_id, app_id):
         """
@@ -241,6 +281,17 @@ class AppInstallAdSample:
         [Ad Group](https://developers.facebook.com/docs/marketing-api/adgroup)
         for further details on the API used here.
         """
+        adgroup, params = self.build_ad(
+            account_id,
+            name,
+            adset_id,
+            creative_id,
+            app_id,
+        )
+        adgroup.remote_create(params=params)
+        return adgroup[Ad.Field.id]
+
+    def build_ad(self, account_id, name, adset_id, creative_id, app_id):
         adgroup = Ad(parent_id=account_id)
         adgroup[Ad.Field.name] = name
         adgroup[Ad.Field.adset_id] = adset_id
@@ -254,7 +305,6 @@ class AppInstallAdSample:
 
         adgroup[Ad.Field.tracking_specs] = tracking_specs
 
-        adgroup.remote_create(params={
+        return adgroup, {
             'status': Ad.Status.paused
-        })
-        return adgroup[Ad.Field.id]
+        }
@@ -45,6 +45,8 @@ from facebookads.objects import (
     Ad
 )
 from facebookads.specs import ObjectStorySpec, LinkData
+from ad_flow import AdFlow
+from adimage_cache import default_uploader
 
 
 class AppEngagementSample:
@@ -98,60 +100,63 @@ class AppEngagementSample:
           See [Targeting Specs](https://developers.facebook.com/docs/marketing-api/targeting-specs)
           for details.
 
+        The steps are created by an `AdFlow`: the image is uploaded while
+        the campaign and ad set are created in one batch request, then the
+        creative and ad are created in another. The time each step took is
+        returned in `timings`.
         """
-        imagehash = self.upload_ad_image(accountid, imagefilepath)
-
-        campaignid = self.create_campaign(
+        flow = AdFlow()
+        flow.add_call('image', lambda: {
+            AdImage.Field.hash: self.upload_ad_image(accountid, imagefilepath),
+        })
+        flow.add('campaign', *self.build_campaign(
             accountid,
             '%s Campaign' % basename
-        )
-
-        adsetid = self.create_ad_set(
+        ))
+        flow.add('adset', *self.build_ad_set(
             accountid,
             '%s AdSet' % basename,
             dailybudget,
-            campaignid,
+            flow.ref('campaign'),
             optimization_goal,
             billing_event,
             bid_amount,
             targeting,
             appinfo
-        )
-
-        creativeid = self.create_creative(
+        ))
+        flow.add('creative', *self.build_creative(
             accountid,
             '%s Creative' % basename,
-            imagehash,
+            flow.ref('image', AdImage.Field.hash),
             message,
             appinfo
-        )
-
-        adid = self.create_ad(
+        ))
+        flow.add('ad', *self.build_ad(
             accountid,
             '%s Ad' % basename,
-            adsetid,
-            creativeid,
+            flow.ref('adset'),
+            flow.ref('creative'),
             appinfo
-        )
+        ))
+        objects = flow.execute()
 
         return {
-            'imagehash': imagehash,
-            'campaignid': campaignid,
-            'adsetid': adsetid,
-            'creativeid': creativeid,
-            'adid': adid
+            'imagehash': objects['image'][AdImage.Field.hash],
+            'campaignid': objects['campaign'][Campaign.Field.id],
+            'adsetid': objects['adset'][AdSet.Field.id],
+            'creativeid': objects['creative'][AdCreative.Field.id],
+            'adid': objects['ad'][Ad.Field.id],
+            'timings': flow.timings,
         }
 
     def upload_ad_image(self, accountid, imagefilepath):
         """
         Step 1: upload an ad image. See
         [Ad Image](https://developers.facebook.com/docs/marketing-api/adimage)
-        for further details on the API used here.
+        for further details on the API used here. Images already uploaded
+        to the account are not uploaded again, see `AdImageUploader`.
         """
-        image = AdImage(parent_id=accountid)
-        image[AdImage.Field.filename] = imagefilepath
-        image.remote_create()
-        return image[AdImage.Field.hash]
+        return default_uploader.upload_ad_image(accountid, imagefilepath)
 
     def create_campaign(self, accountid, name):
         """
@@ -159,16 +164,19 @@ class AppEngagementSample:
         [Ad Campaign](https://developers.facebook.com/docs/marketing-api/adcampaign)
         for further details on the API used here.
         """
+        campaign, params = self.build_campaign(accountid, name)
+        campaign.remote_create(params=params)
+        return campaign[Campaign.Field.id]
+
+    def build_campaign(self, accountid, name):
         campaign = Campaign(parent_id=accountid)
         campaign[Campaign.Field.name] = name
         campaign[Campaign.Field.objective] = (
             Campaign.Objective.mobile_app_engagement
         )
-
-        campaign.remote_create(params={
+        return campaign, {
             'status': Campaign.Status.paused
-        })
-        return campaign[Campaign.Field.id]
+        }
 
     def create_ad_set(self, accountid, name, dailybudget, campaignid,
                       optimization_goal, billing_event, bid_amount,
@@ -178,6 +186,23 @@ class AppEngagementSample:
         [Ad Set](https://developers.facebook.com/docs/marketing-api/adset)
         for further details on the API used here.
         """
+        adset, pdata = self.build_ad_set(
+            accountid,
+            name,
+            dailybudget,
+            campaignid,
+            optimization_goal,
+            billing_event,
+            bid_amount,
+            targeting,
+            appinfo
+        )
+        adset.remote_create(params=pdata)
+        return adset[AdSet.Field.id]
+
+    def build_ad_set(self, accountid, name, dailybudget, campaignid,
+                     optimization_goal, billing_event, bid_amount,
+                     targeting, appinfo):
         pdata = {
             AdSet.Field.name: name,
             AdSet.Field.optimization_goal: optimization_goal,
@@ -193,8 +218,7 @@ class AppEngagementSample:
         }
         pdata['status'] = AdSet.Status.paused
         adset = AdSet(parent_id=accountid)
-        adset.remote_create(params=pdata)
-        return adset[AdSet.Field.id]
+        return adset, pdata
 
     def create_creative(self, accountid, name, imagehash, message, appinfo):
         """
@@ -203,6 +227,17 @@ class AppEngagementSample:
         [Ad Creative](https://developers.facebook.com/docs/marketing-api/adcreative)
         for further details on the API used here.
         """
+        creative, params = self.build_creative(
+            accountid,
+            name,
+            imagehash,
+            message,
+            appinfo
+        )
+        creative.remote_create(params=params)
+        return creative[AdCreative.Field.id]
+
+    def build_creative(self, accountid, name, imagehash, message, appinfo):
         link_data = LinkData()
         link_data[LinkData.Field.link] = appinfo['appstore_link']
         link_data[LinkData.Field.message] = message
@@ -223,9 +258,7 @@ class AppEngagementSample:
         creative = AdCreative(parent_id=accountid)
         creative[AdCreative.Field.name] = name
         creative[AdCreative.Field.object_story_spec] = object_story_spec
-        creative.remote_create()
-
-        return creative[AdCreative.Field.id]
+        return creative, {}
 
     def create_ad(self, accountid, name, adsetid, creativeid, appinfo):
         """
@@ -234,6 +267,17 @@ class AppEngagementSample:
         [Ad Group](https://developers.facebook.com/docs/marketing-api/adgroup)
         for further details on the API used here.
         """
+        ad, params = self.build_ad(
+            accountid,
+            name,
+            adsetid,
+            creativeid,
+            appinfo
+        )
+        ad.remote_create(params=params)
+        return ad[Ad.Field.id]
+
+    def build_ad(self, accountid, name, adsetid, creativeid, appinfo):
         ad = Ad(parent_id=accountid)
         ad[Ad.Field.name] = name
         ad[Ad.Field.adset_id] = adsetid
@@ -251,7 +295,6 @@ class AppEngagementSample:
             })
         ad[Ad.Field.tracking_specs] = tracking_specs
 
-        ad.remote_create(params={
+        return ad, {
             'status': Ad.Status.paused
-        })
-        return ad[Ad.Field.id]
+        }
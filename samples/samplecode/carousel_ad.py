@@ -44,10 +44,11 @@ from facebookads.objects import (
     Campaign,
     AdSet,
     Ad,
-    AdImage,
     AdCreative,
 )
 from facebookads.specs import ObjectStorySpec, LinkData, AttachmentData
+from ad_flow import AdFlow
+from adimage_cache import default_uploader
 
 
 class CarouselAdSample:
@@ -83,7 +84,12 @@ class CarouselAdSample:
           b. Create a story attachment using the product's creative elements
         4. Prepare the ad creative
         5. Create the ad using the ad creative
+
+        The objects are created by an `AdFlow`: the images are uploaded at
+        the same time, while the campaign and ad set are created in one
+        batch request, then the ad is created in another.
         """
+        flow = AdFlow()
 
         daily_budget = 10000
 
@@ -98,7 +104,7 @@ class CarouselAdSample:
         campaign[Campaign.Field.objective] = \
             Campaign.Objective.link_clicks
 
-        campaign.remote_create(params={
+        flow.add('campaign', campaign, {
             'status': Campaign.Status.paused
         })
         """
@@ -109,14 +115,14 @@ class CarouselAdSample:
         for further details on the API used here.
         """
         ad_set = AdSet(parent_id=accountid)
-        ad_set[AdSet.Field.campaign_id] = campaign.get_id_assured()
+        ad_set[AdSet.Field.campaign_id] = flow.ref('campaign')
         ad_set[AdSet.Field.name] = name + ' AdSet'
         ad_set[AdSet.Field.optimization_goal] = optimization_goal
         ad_set[AdSet.Field.billing_event] = billing_event
         ad_set[AdSet.Field.bid_amount] = bid_amount
         ad_set[AdSet.Field.daily_budget] = daily_budget
         ad_set[AdSet.Field.targeting] = targeting
-        ad_set.remote_create()
+        flow.add('adset', ad_set)
 
         story_attachments = []
         """
@@ -134,11 +140,17 @@ class CarouselAdSample:
             }
         } if call_to_action_type else None
 
-        for product in products:
-            img = AdImage(parent_id=accountid)
-            img[AdImage.Field.filename] = product['image_path']
-            img.remote_create()
-            image_hash = img.get_hash()
+        flow.add_call('images', lambda: dict(
+            ('hash_%d' % index, image_hash)
+            for index, image_hash in enumerate(
+                default_uploader.upload_ad_images(
+                    accountid,
+                    [product['image_path'] for product in products],
+                )
+            )
+        ))
+        for index, product in enumerate(products):
+            image_hash = flow.ref('images', 'hash_%d' % index)
             attachment = AttachmentData()
             attachment[AttachmentData.Field.link] = product['link']
             attachment[AttachmentData.Field.name] = product['name']
@@ -177,10 +189,11 @@ class CarouselAdSample:
         """
         ad = Ad(parent_id=accountid)
         ad[Ad.Field.name] = name + ' Ad'
-        ad[Ad.Field.adset_id] = ad_set.get_id_assured()
+        ad[Ad.Field.adset_id] = flow.ref('adset')
         ad[Ad.Field.creative] = creative
 
-        ad.remote_create(params={
+        flow.add('ad', ad, {
             'status': Ad.Status.paused
         })
+        flow.execute()
         return (campaign, ad_set, ad)
@@ -41,13 +41,14 @@ install ad in the carousel format.
 [2]: https://developers.facebook.com/docs/marketing-api/mobile-app-ads
 """
 from facebookads.objects import (
-    AdImage,
     Campaign,
     AdSet,
     AdCreative,
     Ad
 )
 from facebookads.specs import ObjectStorySpec, LinkData, AttachmentData
+from ad_flow import AdFlow
+from adimage_cache import default_uploader
 
 
 class CarouselAppAdSample:
@@ -105,27 +106,39 @@ class CarouselAppAdSample:
         [1]: https://developers.facebook.com/docs/marketing-api/adset
         [2]: https://developers.facebook.com/docs/marketing-api/targeting-specs
 
+        The steps are created by an `AdFlow`: the images are uploaded at the
+        same time, while the campaign and ad set are created in one batch
+        request, then the creative and ad are created in another. The time
+        each step took is returned in `timings`.
         """
-        imagehashes = self.s1_upload_ad_images(accountid, imagefilepaths)
-
-        campaignid = self.s2_create_campaign(
+        flow = AdFlow()
+        flow.add_call('images', lambda: dict(
+            ('hash_%d' % index, imagehash)
+            for index, imagehash in enumerate(self.s1_upload_ad_images(
+                accountid,
+                imagefilepaths,
+            ))
+        ))
+        imagehashes = [
+            flow.ref('images', 'hash_%d' % index)
+            for index in range(len(imagefilepaths))
+        ]
+        flow.add('campaign', *self.build_campaign(
             accountid,
             '%s Campaign' % basename
-        )
-
-        adsetid = self.s3_create_ad_set(
+        ))
+        flow.add('adset', *self.build_ad_set(
             accountid,
             '%s AdSet' % basename,
             dailybudget,
-            campaignid,
+            flow.ref('campaign'),
             optimization_goal,
             billing_event,
             bid_amount,
             targeting,
             appinfo
-        )
-
-        creativeid = self.s4_create_creative(
+        ))
+        flow.add('creative', *self.build_creative(
             accountid,
             '%s Creative' % basename,
             imagehashes,
@@ -133,36 +146,33 @@ class CarouselAppAdSample:
             deeplinks,
             message,
             appinfo
-        )
-
-        adid = self.s5_create_ad(
+        ))
+        flow.add('ad', *self.build_ad(
             accountid,
             '%s Ad' % basename,
-            adsetid,
-            creativeid,
+            flow.ref('adset'),
+            flow.ref('creative'),
             appinfo
-        )
+        ))
+        objects = flow.execute()
 
         return {
-            'campaignid': campaignid,
-            'adsetid': adsetid,
-            'creativeid': creativeid,
-            'adid': adid
+            'campaignid': objects['campaign'][Campaign.Field.id],
+            'adsetid': objects['adset'][AdSet.Field.id],
+            'creativeid': objects['creative'][AdCreative.Field.id],
+            'adid': objects['ad'][Ad.Field.id],
+            'timings': flow.timings,
         }
 
     def s1_upload_ad_images(self, accountid, imagefilepaths):
         """
         Step 1: upload an images for the carousel. See
         [Ad Image](https://developers.facebook.com/docs/marketing-api/adimage)
-        for further details on the API used here.
+        for further details on the API used here. The images are uploaded
+        at the same time, except those already uploaded to the account, see
+        `AdImageUploader`.
         """
-        result = []
-        for imagefilepath in imagefilepaths:
-            image = AdImage(parent_id=accountid)
-            image[AdImage.Field.filename] = imagefilepath
-            image.remote_create()
-            result.append(image[AdImage.Field.hash])
-        return result
+        return default_uploader.upload_ad_images(accountid, imagefilepaths)
 
     def s2_create_campaign(self, accountid, name):
         """
@@ -171,16 +181,19 @@ class CarouselAppAdSample:
         https://developers.facebook.com/docs/marketing-api/adcampaign)
         for further details on the API used here.
         """
+        campaign, params = self.build_campaign(accountid, name)
+        campaign.remote_create(params=params)
+        return campaign[Campaign.Field.id]
+
+    def build_campaign(self, accountid, name):
         campaign = Campaign(parent_id=accountid)
         campaign[Campaign.Field.name] = name
         campaign[Campaign.Field.objective] = (
             Campaign.Objective.mobile_app_installs
         )
-
-        campaign.remote_create(params={
+        return campaign, {
             'status': Campaign.Status.paused
-        })
-        return campaign[Campaign.Field.id]
+        }
 
     def s3_create_ad_set(self, accountid, name, dailybudget, campaignid,
                          optimization_goal, billing_event, bid_amount,
@@ -190,7 +203,23 @@ class CarouselAppAdSample:
         [Ad Set](https://developers.facebook.com/docs/marketing-api/adset)
         for further details on the API used here.
         """
+        adset, pdata = self.build_ad_set(
+            accountid,
+            name,
+            dailybudget,
+            campaignid,
+            optimization_goal,
+            billing_event,
+            bid_amount,
+            targeting,
+            appinfo
+        )
+        adset.remote_create(params=pdata)
+        return adset[AdSet.Field.id]
 
+    def build_ad_set(self, accountid, name, dailybudget, campaignid,
+                     optimization_goal, billing_event, bid_amount,
+                     targeting, appinfo):
         pdata = {
             AdSet.Field.name: name,
             AdSet.Field.optimization_goal: optimization_goal,
@@ -206,8 +235,7 @@ class CarouselAppAdSample:
         }
         pdata['status'] = AdSet.Status.paused
         adset = AdSet(parent_id=accountid)
-        adset.remote_create(params=pdata)
-        return adset[AdSet.Field.id]
+        return adset, pdata
 
     def s4_create_creative(
         self,
@@ -226,6 +254,28 @@ class CarouselAppAdSample:
         https://developers.facebook.com/docs/marketing-api/adcreative)
         for further details on the API used here.
         """
+        creative, params = self.build_creative(
+            accountid,
+            name,
+            imagehashes,
+            linktitles,
+            deeplinks,
+            message,
+            appinfo
+        )
+        creative.remote_create(params=params)
+        return creative[AdCreative.Field.id]
+
+    def build_creative(
+        self,
+        accountid,
+        name,
+        imagehashes,
+        linktitles,
+        deeplinks,
+        message,
+        appinfo
+    ):
         attachments = []
         for index, imagehash in enumerate(imagehashes):
             attachment = AttachmentData()
@@ -255,9 +305,7 @@ class CarouselAppAdSample:
         creative = AdCreative(parent_id=accountid)
         creative[AdCreative.Field.name] = name
         creative[AdCreative.Field.object_story_spec] = object_story_spec
-        creative.remote_create()
-
-        return creative[AdCreative.Field.id]
+        return creative, {}
 
     def s5_create_ad(self, accountid, name, adsetid, creativeid, appinfo):
         """
@@ -266,6 +314,17 @@ class CarouselAppAdSample:
         [Ad Group](https://developers.facebook.com/docs/marketing-api/adgroup)
         for further details on the API used here.
         """
+        ad, params = self.build_ad(
+            accountid,
+            name,
+            adsetid,
+            creativeid,
+            appinfo
+        )
+        ad.remote_create(params=params)
+        return ad[Ad.Field.id]
+
+    def build_ad(self, accountid, name, adsetid, creativeid, appinfo):
         ad = Ad(parent_id=accountid)
         ad[Ad.Field.name] = name
         ad[Ad.Field.adset_id] = adsetid
@@ -280,7 +339,6 @@ class CarouselAppAdSample:
 
         ad[Ad.Field.tracking_specs] = tracking_specs
 
-        ad.remote_create(params={
+        return ad, {
             'status': Ad.Status.paused
-        })
-        return ad[Ad.Field.id]
+        }
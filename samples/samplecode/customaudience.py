@@ -38,13 +38,202 @@ campaigns that target new customers and exclude existing ones.
 
 [1]: https://developers.facebook.com/docs/reference/ads-api/custom-audience-api
 """
+from facebookads.api import FacebookAdsApi
+from facebookads.exceptions import FacebookRequestError
 from facebookads.objects import CustomAudience
+import hashlib
+import itertools
+import json
+import logging
+import multiprocessing
+import random
+import sqlite3
+import threading
+import time
+from utils import BoundedExecutor, generate_batches
+
+logger = logging.getLogger(__name__)
+
+
+# bytes to delete from phone numbers, everything but the digits
+NON_DIGITS = ''.join(chr(c) for c in range(256) if not chr(c).isdigit())
+
+# schemas whose identifiers are sent as they are, without hashing
+UNHASHED_SCHEMAS = (
+    CustomAudience.Schema.mobile_advertiser_id,
+    CustomAudience.Schema.uid,
+)
+
+
+def normalize_user(schema, user):
+    """
+      Normalize an identifier the way Facebook does before hashing: trim it,
+      lowercase emails and keep only the digits of phone numbers, without
+      leading zeros.
+    """
+    if isinstance(user, unicode):
+        user = user.encode('utf8')
+    user = user.strip(" \t\r\n\0\x0B")
+    if schema == CustomAudience.Schema.email_hash:
+        user = user.strip('.').lower()
+    elif schema == CustomAudience.Schema.phone_hash:
+        user = user.translate(None, NON_DIGITS).lstrip('0')
+    return user
+
+
+def hash_users(schema, users, pre_hashed=False):
+    """
+      Return the normalized and SHA-256 hashed identifiers of `users`,
+      skipping the empty ones. Mobile advertiser ids and user ids are only
+      trimmed. Identifiers already hashed are trimmed and lowercased, as
+      hex digests, but never normalized for their schema: that would strip
+      the letters and leading zeros of a hashed phone number.
+    """
+    # look the functions up once, this runs for millions of users
+    normalize = normalize_user
+    sha256 = hashlib.sha256
+    hashed = []
+    append = hashed.append
+    if schema in UNHASHED_SCHEMAS:
+        for user in users:
+            user = normalize(schema, user)
+            if user:
+                append(user)
+    elif pre_hashed:
+        for user in users:
+            if isinstance(user, unicode):
+                user = user.encode('utf8')
+            user = user.strip(" \t\r\n\0\x0B").lower()
+            if user:
+                append(user)
+    else:
+        for user in users:
+            user = normalize(schema, user)
+            if user:
+                append(sha256(user).hexdigest())
+    return hashed
+
+
+def hash_users_chunk(args):
+    """
+      `hash_users` taking a tuple of its arguments, to run on a process pool.
+    """
+    return hash_users(*args)
+
+
+class AudienceMembershipStore:
+    """
+      The hashed users of custom audiences, as last sent by
+      `CustomAudienceSample.refresh_audience`, kept in a SQLite file.
+
+      New users are staged in a temporary table. Both tables are indexed by
+      hash, so the additions and removals are found by merging two sorted
+      cursors, on disk.
+    """
+
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        self.connection.text_factory = str
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS audience_members ('
+            'audience_id TEXT, hash TEXT, PRIMARY KEY (audience_id, hash))'
+        )
+        self.connection.commit()
+
+    def stage(self, audience_id, hashes):
+        """
+          Stage the new hashed users of an audience, replacing the
+          previously staged ones. Returns the number of distinct users.
+        """
+        self.connection.execute('DROP TABLE IF EXISTS staged_members')
+        self.connection.execute(
+            'CREATE TEMP TABLE staged_members (hash TEXT PRIMARY KEY)'
+        )
+        for batch in generate_batches(hashes, 10000):
+            self.connection.executemany(
+                'INSERT OR IGNORE INTO staged_members VALUES (?)',
+                ((h, ) for h in batch),
+            )
+        self.connection.commit()
+        return self.connection.execute(
+            'SELECT COUNT(*) FROM staged_members'
+        ).fetchone()[0]
+
+    def iter_merged(self, audience_id):
+        """
+          Yield `(hash, is_member, is_staged)` for the union of the members
+          and the staged users, in hash order.
+        """
+        members = self.connection.cursor().execute(
+            'SELECT hash FROM audience_members WHERE audience_id = ? '
+            'ORDER BY hash',
+            (audience_id, ),
+        )
+        staged = self.connection.cursor().execute(
+            'SELECT hash FROM staged_members ORDER BY hash'
+        )
+        member = next(members, None)
+        new = next(staged, None)
+        while member is not None or new is not None:
+            if new is None or (member is not None and member[0] < new[0]):
+                yield member[0], True, False
+                member = next(members, None)
+            elif member is None or new[0] < member[0]:
+                yield new[0], False, True
+                new = next(staged, None)
+            else:
+                yield member[0], True, True
+                member = next(members, None)
+                new = next(staged, None)
+
+    def iter_added(self, audience_id):
+        for h, is_member, is_staged in self.iter_merged(audience_id):
+            if is_staged and not is_member:
+                yield h
+
+    def iter_removed(self, audience_id):
+        for h, is_member, is_staged in self.iter_merged(audience_id):
+            if is_member and not is_staged:
+                yield h
+
+    def commit_staged(self, audience_id):
+        """
+          Make the staged users the members of the audience.
+        """
+        self.connection.execute(
+            'DELETE FROM audience_members WHERE audience_id = ?',
+            (audience_id, ),
+        )
+        self.connection.execute(
+            'INSERT INTO audience_members '
+            'SELECT ?, hash FROM staged_members',
+            (audience_id, ),
+        )
+        self.connection.execute('DROP TABLE staged_members')
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
 
 
 class CustomAudienceSample:
     """
     The main sample class.
+
+    To upload files of millions of users, `upload_users_streaming` reads
+    them lazily and sends them in batches of the same upload session, a few
+    batches at a time.
     """
+
+    # maximum number of users in one request
+    UPLOAD_BATCH_SIZE = 10000
+
+    # worker threads shared by every instance, which caps the number of
+    # batches being sent across all uploads
+    executor = BoundedExecutor(max_workers=4, name='customaudience')
+
     def create_audience(self, accountid, name, description, optoutlink):
         """
           Creates a new custom audience and returns the id.
@@ -71,3 +260,342 @@ class CustomAudienceSample:
         """
         audience = CustomAudience(audienceid)
         return audience.add_users(schema, users)
+
+    def upload_users_streaming(
+            self,
+            audienceid,
+            users,
+            schema=CustomAudience.Schema.email_hash,
+            batch_size=UPLOAD_BATCH_SIZE,
+            pre_hashed=False,
+            max_retries=3,
+            progress=None,
+            processes=None,
+            method=FacebookAdsApi.HTTP_METHOD_POST,
+            app_ids=None,
+            api=None):
+        """
+          Adds users to an existing audience from an iterable of
+          identifiers, such as the lines of a file, which is read lazily so
+          memory use does not depend on its size.
+
+          Users are normalized, hashed and sent in batches of `batch_size`
+          on the shared `executor`. All the batches belong to one upload
+          session and carry their sequence number; the last one is sent
+          after all the others have been received, to close the session.
+          A batch failing with a transient or network error is sent again,
+          up to `max_retries` times.
+
+          With `method` DELETE, the users are removed from the audience
+          instead, see `remove_users_streaming`.
+
+          The `uid` schema requires the `app_ids` the user ids belong to.
+
+          With `processes`, users are hashed on a pool of that many
+          processes by `iter_hashed_batches` rather than on the threads
+          sending them, for files of tens of millions of users.
+
+          `progress`, if given, is called with the stats after each batch.
+          Returns the stats: the `session_id`, the number of `batches` and
+          `users` sent, the `num_received` and `num_invalid_entries`
+          reported by Facebook, and the `elapsed` seconds.
+        """
+        if schema == CustomAudience.Schema.uid and not app_ids:
+            raise ValueError('The uid schema requires at least one app_id')
+
+        if not api:
+            # keep a copy of the Ads API session as we're going to be using
+            # it across new threads
+            api = FacebookAdsApi.get_default_api()
+
+        session_id = random.randint(1, 2 ** 63 - 1)
+        stats = {
+            'session_id': session_id,
+            'batches': 0,
+            'users': 0,
+            'num_received': 0,
+            'num_invalid_entries': 0,
+        }
+        start_time = time.time()
+
+        def send(batch, last_batch=False):
+            sequence, data = batch
+            if not processes:
+                data = hash_users(schema, data, pre_hashed)
+            response = self.send_users_batch(
+                api,
+                audienceid,
+                schema,
+                data,
+                {
+                    'session_id': session_id,
+                    'batch_seq': sequence,
+                    'last_batch_flag': last_batch,
+                },
+                max_retries,
+                method,
+                app_ids,
+            )
+            return len(data), response
+
+        def update_stats(result):
+            count, response = result
+            stats['batches'] += 1
+            stats['users'] += count
+            stats['num_received'] += response.get('num_received', 0)
+            stats['num_invalid_entries'] += response.get(
+                'num_invalid_entries',
+                0,
+            )
+            stats['elapsed'] = time.time() - start_time
+            if progress:
+                progress(dict(stats))
+
+        held = []
+
+        def iter_but_last():
+            # hold the last batch back until all the others are sent
+            if processes:
+                batches = self.iter_hashed_batches(
+                    users,
+                    schema,
+                    batch_size,
+                    pre_hashed,
+                    processes,
+                )
+            else:
+                batches = generate_batches(users, batch_size)
+            batches = itertools.izip(itertools.count(1), batches)
+            previous = next(batches, None)
+            for batch in batches:
+                yield previous
+                previous = batch
+            if previous:
+                held.append(previous)
+
+        for result in self.executor.map_unordered(send, iter_but_last()):
+            update_stats(result)
+        if held:
+            update_stats(send(held[0], last_batch=True))
+
+        return stats
+
+    def remove_users_streaming(self, audienceid, users, **kwargs):
+        """
+          Removes users from an existing audience, the same way
+          `upload_users_streaming` adds them.
+        """
+        return self.upload_users_streaming(
+            audienceid,
+            users,
+            method=FacebookAdsApi.HTTP_METHOD_DELETE,
+            **kwargs
+        )
+
+    def refresh_audience(
+            self,
+            audienceid,
+            users,
+            store,
+            schema=CustomAudience.Schema.email_hash,
+            pre_hashed=False,
+            processes=None,
+            **kwargs):
+        """
+          Makes the audience hold exactly `users`, sending only the users
+          added or removed since the previous refresh, as recorded in
+          `store`, an `AudienceMembershipStore`. The first refresh of an
+          audience adds all the users.
+
+          `users` are hashed and staged in the store, then the additions
+          and removals are read from a merge of the sorted members and
+          staged users, so none of the lists need to fit in memory. The
+          store is only updated once both have been sent, so a failed
+          refresh is sent again by the next one.
+
+          Other keyword arguments are passed to `upload_users_streaming`.
+          Returns a dict with the stats of the `added` and `removed` users,
+          and the number of `members` of the audience.
+        """
+        if processes:
+            batches = self.iter_hashed_batches(
+                users,
+                schema,
+                pre_hashed=pre_hashed,
+                processes=processes,
+            )
+        else:
+            batches = (
+                hash_users(schema, batch, pre_hashed)
+                for batch in generate_batches(users, self.UPLOAD_BATCH_SIZE)
+            )
+        members = store.stage(audienceid, itertools.chain.from_iterable(
+            batches,
+        ))
+
+        added = self.upload_users_streaming(
+            audienceid,
+            store.iter_added(audienceid),
+            schema,
+            pre_hashed=True,
+            **kwargs
+        )
+        removed = self.remove_users_streaming(
+            audienceid,
+            store.iter_removed(audienceid),
+            schema=schema,
+            pre_hashed=True,
+            **kwargs
+        )
+        store.commit_staged(audienceid)
+
+        return {'added': added, 'removed': removed, 'members': members}
+
+    def iter_hashed_batches(
+            self,
+            users,
+            schema=CustomAudience.Schema.email_hash,
+            batch_size=UPLOAD_BATCH_SIZE,
+            pre_hashed=False,
+            processes=4):
+        """
+          Yield the normalized and hashed users in batches of at most
+          `batch_size`, in the order of `users`.
+
+          Batches are hashed on a pool of `processes` processes. At most two
+          batches per process are in flight, so `users` is read lazily and
+          memory stays flat.
+        """
+        max_chunks = 2 * processes
+        slots = threading.Semaphore(max_chunks)
+        state = dict()
+
+        def chunks():
+            for batch in generate_batches(users, batch_size):
+                slots.acquire()
+                if state.get('closed'):
+                    return
+                yield schema, batch, pre_hashed
+
+        pool = multiprocessing.Pool(processes)
+        try:
+            for hashed in pool.imap(hash_users_chunk, chunks()):
+                slots.release()
+                yield hashed
+        finally:
+            # unblock the chunk feeder so that the pool can shut down
+            state['closed'] = True
+            for i in range(max_chunks + 1):
+                slots.release()
+            pool.terminate()
+            pool.join()
+
+    def send_users_batch(
+            self,
+            api,
+            audienceid,
+            schema,
+            data,
+            session,
+            max_retries,
+            method=FacebookAdsApi.HTTP_METHOD_POST,
+            app_ids=None):
+        """
+          Sends a batch of hashed users of an upload session, retrying
+          transient errors with an exponential backoff, and returns the
+          decoded response.
+
+          Batches are always POSTed, a DELETE being sent as a `method`
+          param: the SDK puts the params of a DELETE in the URL, which is
+          far too long for thousands of hashes.
+        """
+        payload = {'schema': schema, 'data': data}
+        if app_ids:
+            payload['app_ids'] = app_ids
+        params = {
+            'payload': payload,
+            'session': session,
+        }
+        if method != FacebookAdsApi.HTTP_METHOD_POST:
+            params['method'] = method
+        for attempt in range(max_retries + 1):
+            try:
+                response = api.call(
+                    FacebookAdsApi.HTTP_METHOD_POST,
+                    (audienceid, 'users'),
+                    params=params,
+                )
+                return json.loads(response.body())
+            except FacebookRequestError as e:
+                if attempt == max_retries or not (
+                    e.api_transient_error() or e.http_status() >= 500
+                ):
+                    raise
+                logger.warning(
+                    "Retrying batch %s of session %s: %s",
+                    session['batch_seq'],
+                    session['session_id'],
+                    e.api_error_message(),
+                )
+            except IOError as e:
+                if attempt == max_retries:
+                    raise
+                logger.warning(
+                    "Retrying batch %s of session %s: %s",
+                    session['batch_seq'],
+                    session['session_id'],
+                    e,
+                )
+            time.sleep(2 ** attempt)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Benchmark of normalizing and hashing synthetic emails '
+                    'with hash_users on one process and with '
+                    'CustomAudienceSample.iter_hashed_batches on a process '
+                    'pool. No API calls are made.',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        '-n', type=int, default=10000000, dest='num_rows',
+        help='number of synthetic emails',
+    )
+    parser.add_argument(
+        '-p', type=int, default=multiprocessing.cpu_count(),
+        dest='processes',
+        help='number of hashing processes',
+    )
+    parser.add_argument(
+        '-b', type=int, default=CustomAudienceSample.UPLOAD_BATCH_SIZE,
+        dest='batch_size',
+        help='number of emails per batch',
+    )
+    args = parser.parse_args()
+
+    def synthetic_emails():
+        for i in xrange(args.num_rows):
+            yield ' User.%d@Example.com\n' % i
+
+    def single_process():
+        for batch in generate_batches(synthetic_emails(), args.batch_size):
+            hash_users(CustomAudience.Schema.email_hash, batch)
+
+    def process_pool():
+        for batch in CustomAudienceSample().iter_hashed_batches(
+            synthetic_emails(),
+            batch_size=args.batch_size,
+            processes=args.processes,
+        ):
+            pass
+
+    for name, run in (
+        ('hash_users', single_process),
+        ('iter_hashed_batches (%d processes)' % args.processes, process_pool),
+    ):
+        start = time.time()
+        run()
+        elapsed = time.time() - start
+        print '%-36s %10.0f rows/sec' % (name, args.num_rows / elapsed)
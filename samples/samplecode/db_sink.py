@@ -0,0 +1,275 @@
+# Copyright (c) 2016-present, Facebook, Inc. All rights reserved.
+#
+# You are hereby granted a non-exclusive, worldwide, royalty-free license to
+# use, copy, modify, and distribute this software in source code or binary
+# form for use in connection with the web services and APIs provided by
+# Facebook.
+#
+# As with any software that integrates with the Facebook platform, your use of
+# this software is subject to the Facebook Developer Principles and Policies
+# [http://developers.facebook.com/policy/]. This copyright notice shall be
+# included in all copies or substantial portions of the software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+# Database Sinks
+
+## Bulk loading report rows into a database
+
+***
+
+The reporting samples stream rows of insights or orders. The sinks in this
+module persist those rows in batches instead of one `INSERT` per row:
+
+* `SQLiteSink` uses `executemany` inside transactions of configurable size
+  and works with the `sqlite3` module of the standard library.
+* `PostgresSink` streams each batch into a temporary table with `COPY` and
+  upserts it into the target table with a single `INSERT ... SELECT`.
+
+Both sinks upsert on a key, e.g. `(start_date, adset_id,
+impression_device, placement)` for insights or `order_id` for orders, so
+loading the same report twice does not duplicate rows. When a key comes
+back several times, the last row wins. Missing key values are stored as
+empty strings, as NULLs would never match the unique index.
+"""
+import collections
+import cStringIO
+import json
+import time
+from utils import generate_batches
+
+
+class RowSink:
+    """
+    Base class of the sinks. Subclasses implement `write_batch`.
+    """
+
+    def __init__(
+        self,
+        connection,
+        table,
+        columns,
+        key_columns,
+        batch_size=1000,
+        transaction_size=50000
+    ):
+        """
+        Params:
+
+        * `connection` is an open DB-API connection
+        * `table` is the name of the target table
+        * `columns` are the column names, in the order of the row values
+        * `key_columns` are the columns that identify a row for upserts
+        * `batch_size` is the number of rows sent per statement
+        * `transaction_size` is the number of rows per transaction
+        """
+        for column in key_columns:
+            if column not in columns:
+                raise ValueError('Key column not in columns: ' + column)
+
+        self.connection = connection
+        self.table = table
+        self.columns = tuple(columns)
+        self.key_columns = tuple(key_columns)
+        self.key_indexes = tuple(
+            self.columns.index(column) for column in self.key_columns
+        )
+        self.batch_size = batch_size
+        self.transaction_size = transaction_size
+        self.num_rows = 0
+        self.elapsed = 0.0
+
+    def write(self, rows):
+        """
+        Upsert an iterable of row tuples into the table, committing every
+        `transaction_size` rows and once more at the end. Returns the
+        number of rows written.
+        """
+        start_time = time.time()
+        num_rows = 0
+        uncommitted = 0
+        try:
+            for batch in generate_batches(rows, self.batch_size):
+                self.write_batch(self.prepare_batch(batch))
+                num_rows += len(batch)
+                uncommitted += len(batch)
+                if uncommitted >= self.transaction_size:
+                    self.connection.commit()
+                    uncommitted = 0
+            self.connection.commit()
+        except Exception:
+            self.connection.rollback()
+            raise
+        finally:
+            self.num_rows += num_rows
+            self.elapsed += time.time() - start_time
+
+        return num_rows
+
+    def write_dicts(self, dicts):
+        """
+        Same as `write` for rows given as dicts keyed by column name, such
+        as the orders of `OrderLevelReportingSample`
+        """
+        columns = self.columns
+        return self.write(
+            tuple(d.get(column) for column in columns) for d in dicts
+        )
+
+    def prepare_batch(self, rows):
+        """
+        Convert the rows of a batch and keep the last row of every key, in
+        the order of these last rows
+        """
+        unique_rows = collections.OrderedDict()
+        for row in rows:
+            row = self.convert_row(row)
+            key = tuple(row[index] for index in self.key_indexes)
+            unique_rows.pop(key, None)
+            unique_rows[key] = row
+        return unique_rows.values()
+
+    def convert_row(self, row):
+        """
+        Convert nested values such as the `attributions` list of an order
+        to JSON so every value fits in a text column, and missing key values
+        to empty strings
+        """
+        row = [
+            json.dumps(value) if isinstance(value, (list, dict)) else value
+            for value in row
+        ]
+        for index in self.key_indexes:
+            if row[index] is None:
+                row[index] = ''
+        return tuple(row)
+
+    def get_stats(self):
+        """
+        Return the number of rows written, the seconds spent writing them
+        and the resulting rows per second
+        """
+        return {
+            'rows': self.num_rows,
+            'elapsed': self.elapsed,
+            'rows_per_sec': (
+                self.num_rows / self.elapsed if self.elapsed > 0 else None
+            ),
+        }
+
+    def quote(self, name):
+        return '"' + name.replace('"', '""') + '"'
+
+    def create_table(self):
+        """
+        Create the table and its unique key index if they do not exist.
+        Every column is stored as text.
+        """
+        cursor = self.connection.cursor()
+        cursor.execute('CREATE TABLE IF NOT EXISTS %s (%s)' % (
+            self.quote(self.table),
+            ', '.join(self.quote(c) + ' TEXT' for c in self.columns),
+        ))
+        cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS %s ON %s (%s)' % (
+            self.quote(self.table + '_key'),
+            self.quote(self.table),
+            ', '.join(self.quote(c) for c in self.key_columns),
+        ))
+        self.connection.commit()
+
+    def write_batch(self, rows):
+        raise NotImplementedError()
+
+
+class SQLiteSink(RowSink):
+    """
+    Sink for a `sqlite3` connection. Rows are upserted with
+    `INSERT OR REPLACE` on a unique index over the key columns.
+    """
+
+    def write_batch(self, rows):
+        self.connection.executemany(
+            'INSERT OR REPLACE INTO %s (%s) VALUES (%s)' % (
+                self.quote(self.table),
+                ', '.join(self.quote(c) for c in self.columns),
+                ', '.join('?' for c in self.columns),
+            ),
+            rows,
+        )
+
+
+class PostgresSink(RowSink):
+    """
+    Sink for a `psycopg2` connection. Every batch is copied into a
+    temporary staging table with `COPY ... FROM STDIN` and then upserted
+    with `INSERT ... ON CONFLICT DO UPDATE`, which needs PostgreSQL 9.5 or
+    later.
+    """
+
+    def write_batch(self, rows):
+        staging = self.quote(self.table + '_staging')
+        columns = ', '.join(self.quote(c) for c in self.columns)
+        keys = ', '.join(self.quote(c) for c in self.key_columns)
+        updates = ', '.join(
+            '%s = EXCLUDED.%s' % (self.quote(c), self.quote(c))
+            for c in self.columns if c not in self.key_columns
+        )
+
+        cursor = self.connection.cursor()
+        cursor.execute(
+            'CREATE TEMPORARY TABLE IF NOT EXISTS %s (LIKE %s)' % (
+                staging,
+                self.quote(self.table),
+            )
+        )
+        cursor.copy_expert(
+            'COPY %s (%s) FROM STDIN' % (staging, columns),
+            self.to_copy_file(rows),
+        )
+        # a key may only be upserted once per statement, which
+        # `prepare_batch` ensures
+        cursor.execute(
+            'INSERT INTO %s (%s) SELECT %s FROM %s '
+            'ON CONFLICT (%s) DO %s' % (
+                self.quote(self.table),
+                columns,
+                columns,
+                staging,
+                keys,
+                'UPDATE SET ' + updates if updates else 'NOTHING',
+            )
+        )
+        cursor.execute('TRUNCATE %s' % staging)
+
+    def to_copy_file(self, rows):
+        """
+        Encode rows in the text format of `COPY`: tab separated, `\\N` for
+        NULL and backslash escapes for special characters
+        """
+        buffer = cStringIO.StringIO()
+        for row in rows:
+            buffer.write('\t'.join(self.to_copy_value(v) for v in row))
+            buffer.write('\n')
+        buffer.seek(0)
+        return buffer
+
+    def to_copy_value(self, value):
+        if value is None:
+            return '\\N'
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        elif not isinstance(value, str):
+            value = str(value)
+        return (
+            value.replace('\\', '\\\\')
+            .replace('\t', '\\t')
+            .replace('\n', '\\n')
+            .replace('\r', '\\r')
+        )
@@ -0,0 +1,335 @@
+# Copyright (c) 2016-present, Facebook, Inc. All rights reserved.
+#
+# You are hereby granted a non-exclusive, worldwide, royalty-free license to
+# use, copy, modify, and distribute this software in source code or binary
+# form for use in connection with the web services and APIs provided by
+# Facebook.
+#
+# As with any software that integrates with the Facebook platform, your use of
+# this software is subject to the Facebook Developer Principles and Policies
+# [http://developers.facebook.com/policy/]. This copyright notice shall be
+# included in all copies or substantial portions of the software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+# Insights Frame
+
+## Columnar roll-ups of Ads Reporting rows
+
+***
+
+This module keeps the rows streamed by `AdsReportingSample` in columns
+instead of dicts: one typed NumPy array per metric, and one array of
+integer codes plus a list of distinct values per categorical column such as
+`campaign` or `placement`. Roll-ups by campaign, ad set, device or
+placement then run as vectorized operations over whole columns.
+
+NumPy is an optional dependency of the samples: install it with
+`pip install numpy` to use this module.
+"""
+import array
+import csv
+import os
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def check_numpy():
+    if numpy is None:
+        raise ImportError(
+            'InsightsFrame requires numpy, install it with '
+            '`pip install numpy`'
+        )
+
+
+class InsightsFrame:
+    """
+    A column oriented table of insight rows.
+
+    `categories[column]` is the list of distinct values of a categorical
+    column and `codes[column]` an int32 array of indexes into it, one per
+    row. `metrics[column]` is an int64 or float64 array, one value per row.
+    """
+
+    # columns that are dictionary encoded
+    CATEGORY_COLUMNS = (
+        'campaign',
+        'adset',
+        'adset_id',
+        'impression_device',
+        'placement',
+    )
+
+    # columns that are neither categories nor metrics
+    IGNORED_COLUMNS = ('start_date', 'end_date', 'action_device')
+
+    # metrics that are whole numbers, every other metric is a float
+    INTEGER_COLUMNS = ('impressions', 'reach')
+
+    def __init__(self, categories, codes, metrics, num_rows):
+        check_numpy()
+        self.categories = categories
+        self.codes = codes
+        self.metrics = metrics
+        self.num_rows = num_rows
+
+    @classmethod
+    def from_rows(
+        cls,
+        rows,
+        category_columns=None,
+        metric_columns=None
+    ):
+        """
+        Build a frame from a header tuple followed by row tuples, as
+        yielded by `AdsReportingSample.stream_ads_insight`. Rows are
+        consumed one at a time and appended to compact typed buffers, so
+        the whole report never exists as Python objects.
+
+        Params:
+
+        * `rows` is an iterable of a header tuple and value tuples
+        * `category_columns` are the columns to dictionary encode,
+          defaults to `CATEGORY_COLUMNS`
+        * `metric_columns` are the columns to keep as numbers, defaults to
+          every other column that is not in `IGNORED_COLUMNS`
+        """
+        check_numpy()
+        rows = iter(rows)
+        header = next(rows, ())
+        if category_columns is None:
+            category_columns = cls.CATEGORY_COLUMNS
+        category_columns = [c for c in category_columns if c in header]
+        if metric_columns is None:
+            metric_columns = [
+                c for c in header
+                if c not in category_columns and c not in cls.IGNORED_COLUMNS
+            ]
+
+        categories = dict((c, []) for c in category_columns)
+        lookups = dict((c, {}) for c in category_columns)
+        code_buffers = dict((c, array.array('i')) for c in category_columns)
+        metric_buffers = dict(
+            (c, array.array('l' if c in cls.INTEGER_COLUMNS else 'd'))
+            for c in metric_columns
+        )
+
+        category_indexes = [
+            (header.index(c), lookups[c], categories[c], code_buffers[c])
+            for c in category_columns
+        ]
+        metric_indexes = [
+            (header.index(c), c in cls.INTEGER_COLUMNS, metric_buffers[c])
+            for c in metric_columns
+        ]
+
+        num_rows = 0
+        for row in rows:
+            num_rows += 1
+            for index, lookup, values, buffer in category_indexes:
+                value = row[index]
+                code = lookup.get(value)
+                if code is None:
+                    code = lookup[value] = len(values)
+                    values.append(value)
+                buffer.append(code)
+            for index, is_integer, buffer in metric_indexes:
+                value = row[index]
+                if value is None:
+                    buffer.append(0)
+                elif is_integer:
+                    buffer.append(int(value))
+                else:
+                    buffer.append(float(value))
+
+        # numpy reads the array buffers in place, nothing is copied
+        codes = dict(
+            (c, numpy.frombuffer(b, dtype=numpy.int32))
+            for c, b in code_buffers.items()
+        )
+        metrics = dict(
+            (c, numpy.frombuffer(
+                b,
+                dtype=numpy.int_ if b.typecode == 'l' else numpy.float64,
+            ))
+            for c, b in metric_buffers.items()
+        )
+        return cls(categories, codes, metrics, num_rows)
+
+    def get_column(self, column):
+        """
+        Return the values of a column as an array, decoding categorical
+        columns into an object array of their values
+        """
+        if column in self.codes:
+            values = numpy.array(self.categories[column], dtype=object)
+            return values[self.codes[column]]
+        return self.metrics[column]
+
+    def group_by(
+        self,
+        columns,
+        metric_columns=None,
+        how='sum'
+    ):
+        """
+        Aggregate the metrics over every distinct combination of values of
+        the categorical `columns` and return the result as a new frame
+        with one row per combination.
+
+        Params:
+
+        * `columns` is a list of categorical columns, e.g.
+          `['campaign', 'placement']`
+        * `metric_columns` are the metrics to aggregate, defaults to all
+        * `how` is `sum` or `mean`
+        """
+        if how not in ('sum', 'mean'):
+            raise ValueError('how should be sum or mean, got ' + repr(how))
+        if metric_columns is None:
+            metric_columns = self.metrics.keys()
+
+        # fold the codes of all key columns into a single int64 key
+        shape = [max(len(self.categories[c]), 1) for c in columns]
+        key = numpy.zeros(self.num_rows, dtype=numpy.int64)
+        for column, size in zip(columns, shape):
+            key *= size
+            key += self.codes[column]
+
+        group_keys, group_of_row = numpy.unique(key, return_inverse=True)
+        num_groups = len(group_keys)
+        counts = numpy.bincount(group_of_row, minlength=num_groups)
+
+        metrics = {}
+        for column in metric_columns:
+            values = numpy.bincount(
+                group_of_row,
+                weights=self.metrics[column],
+                minlength=num_groups,
+            )
+            if how == 'mean':
+                values = values / counts
+            elif self.metrics[column].dtype.kind == 'i':
+                values = values.astype(self.metrics[column].dtype)
+            metrics[column] = values
+
+        codes = {}
+        if num_groups:
+            group_codes = numpy.unravel_index(group_keys, shape)
+            for column, column_codes in zip(columns, group_codes):
+                codes[column] = column_codes.astype(numpy.int32)
+        else:
+            for column in columns:
+                codes[column] = numpy.zeros(0, dtype=numpy.int32)
+
+        categories = dict((c, self.categories[c]) for c in columns)
+        return InsightsFrame(categories, codes, metrics, num_groups)
+
+    def sum(self, columns, metric_columns=None):
+        return self.group_by(columns, metric_columns, how='sum')
+
+    def mean(self, columns, metric_columns=None):
+        return self.group_by(columns, metric_columns, how='mean')
+
+    def add_derived_metrics(self):
+        """
+        Add `cpm`, `cpc`, `ctr` and `roas` metric columns computed from
+        `spend`, `impressions`, `website_clicks` and the purchase value
+        columns. Ratios with a zero denominator are NaN. Call this after
+        `group_by` to get the ratios of the sums.
+
+        Returns the frame itself.
+        """
+        def ratio(numerator, denominator, scale=1.0):
+            numerator = numpy.asarray(numerator, dtype=numpy.float64)
+            denominator = numpy.asarray(denominator, dtype=numpy.float64)
+            result = numpy.full(self.num_rows, numpy.nan)
+            numpy.divide(
+                numerator * scale,
+                denominator,
+                out=result,
+                where=denominator != 0,
+            )
+            return result
+
+        zeros = numpy.zeros(self.num_rows)
+        spend = self.metrics.get('spend', zeros)
+        impressions = self.metrics.get('impressions', zeros)
+        clicks = self.metrics.get('website_clicks', zeros)
+        purchase_value = (
+            self.metrics.get('website_action_value', zeros) +
+            self.metrics.get('mobile_purchase_value', zeros)
+        )
+
+        self.metrics['cpm'] = ratio(spend, impressions, 1000.0)
+        self.metrics['cpc'] = ratio(spend, clicks)
+        self.metrics['ctr'] = ratio(clicks, impressions)
+        self.metrics['roas'] = ratio(purchase_value, spend)
+        return self
+
+    def get_columns(self):
+        """
+        Return the column names, categorical columns first
+        """
+        return sorted(self.codes.keys()) + sorted(self.metrics.keys())
+
+    def to_csv(self, path_or_file, chunk_size=10000):
+        """
+        Write the frame as CSV with a header row. Rows are decoded and
+        written `chunk_size` at a time.
+
+        Params:
+
+        * `path_or_file` is a file path or an open file object
+        """
+        if isinstance(path_or_file, basestring):
+            with open(path_or_file, 'wb') as f:
+                return self.to_csv(f, chunk_size)
+
+        columns = self.get_columns()
+        writer = csv.writer(path_or_file)
+        writer.writerow(columns)
+        for start in xrange(0, self.num_rows, chunk_size):
+            end = start + chunk_size
+            chunk = []
+            for column in columns:
+                if column in self.codes:
+                    values = self.categories[column]
+                    chunk.append([
+                        values[code] for code in self.codes[column][start:end]
+                    ])
+                else:
+                    chunk.append(self.metrics[column][start:end].tolist())
+            writer.writerows(zip(*chunk))
+
+    def to_npy(self, directory):
+        """
+        Save every column as a `.npy` file in `directory`: metrics as
+        `<column>.npy`, categorical columns as `<column>.codes.npy` and
+        `<column>.categories.npy`. The arrays are written directly from
+        their buffers.
+        """
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        def path(name):
+            return os.path.join(directory, name + '.npy')
+
+        for column, values in self.metrics.items():
+            numpy.save(path(column), values)
+        for column, codes in self.codes.items():
+            numpy.save(path(column + '.codes'), codes)
+            numpy.save(
+                path(column + '.categories'),
+                numpy.array(self.categories[column], dtype=object),
+            )
@@ -45,11 +45,17 @@ from facebookads.objects import (
 from facebookads import FacebookAdsApi
 from facebookads.exceptions import FacebookRequestError
 import logging
+from reach_estimate_cache import default_cache
+from utils import BoundedExecutor
 logger = logging.getLogger(__name__)
 
 
 class InstagramAdsPotential:
-    def get_ad_sets(self, account_id, include_archived, limit):
+    # worker threads shared by every instance, which caps the number of
+    # Graph API calls in flight across all callers
+    executor = BoundedExecutor(max_workers=8, name='instagram_potential')
+
+    def get_ad_sets(self, account_id, include_archived, limit, api=None):
         """
         Retrieves and displays a list of ad sets of a given account,
         and analyze how likely a similar ad for Instagram can be created.
@@ -64,11 +70,21 @@ class InstagramAdsPotential:
           use Instagram placement already. The more this limit is, the longer
           it takes to run. If you run the script directly and are willing
           to wait for a while, you can drop the lines of code around it.
+        * `api` is the Ads API session to use, the default one if omitted.
+
+        The reach estimates, campaign reads and creative checks of all the
+        ad sets are independent calls, which run concurrently on the shared
+        `executor`.
 
         For more information see the [Instagram Ads document](
         https://developers.facebook.com/docs/marketing-api/guides/instagramads/)
         """
         locale.setlocale(locale.LC_ALL, '')
+        if not api:
+            # keep a copy of the Ads API session as we're going to be using
+            # it across new threads
+            api = FacebookAdsApi.get_default_api()
+
         if include_archived:
             params = {
                 'limit': limit,
@@ -80,7 +96,7 @@ class InstagramAdsPotential:
             }
         else:
             params = {'limit': limit}
-        account = AdAccount(account_id)
+        account = AdAccount(account_id, api=api)
         ad_sets = account.get_ad_sets(
             fields=[
                 AdSet.Field.id,
@@ -91,170 +107,239 @@ class InstagramAdsPotential:
             ],
             params=params
         )
-        cache = {}
-        count = 0
-        results = []
+
+        # pick the first `limit` ad sets not on Instagram yet
+        selected = []
         for ad_set in ad_sets:
-            if count >= limit:
+            if len(selected) >= limit:
                 break
-            count += 1
-
-            result = {}
-            result['id'] = ad_set['id']
-            result['name'] = ad_set['name']
             logger.error(ad_set)
 
-            # Get targeting from ad set
             targeting = ad_set.get(AdSet.Field.targeting, None)
             logger.error(targeting)
             if targeting is not None:
                 publisher_platforms = targeting.get('publisher_platforms', None)
-                pp_str = ''
-                if publisher_platforms is None:
-                    result['publisher_platforms'] = '<li>DEFAULT</li>'
-                else:
-                    for pp in publisher_platforms:
-                        pp_str += ('<li>' +
-                                   self.translate_placement_publisher(str(pp)) +
-                                   '</li>')
-                    result['publisher_platforms'] = pp_str
-
-                params = {
-                    'currency': 'USD',
-                    'targeting_spec': targeting,
-                    'optimize_for': AdSet.OptimizationGoal.impressions,
-                }
-
                 if publisher_platforms is not None and "instagram" in \
                         publisher_platforms:
-                    count -= 1
                     continue
+            selected.append(ad_set)
 
-                reach_fb = account.get_reach_estimate(
-                    params=params)[0].get('users', 0)
+        # every ad set needs its reach on Facebook and on Instagram and a
+        # look at its campaign and creative
+        tasks = []
+        for index, ad_set in enumerate(selected):
+            if ad_set.get(AdSet.Field.targeting, None) is not None:
+                tasks.append((index, 'reach_fb'))
+                tasks.append((index, 'reach_ig'))
+            tasks.append((index, 'creative'))
 
-                targeting['publisher_platforms'] = ["instagram"]
-                targeting['facebook_positions'] = None
-                params = {
-                    'currency': 'USD',
-                    'targeting_spec': targeting,
-                    'optimize_for': AdSet.OptimizationGoal.impressions,
-                }
-                reach_ig = account.get_reach_estimate(
-                    params=params)[0].get('users', 0)
-
-                self.add_check_result(
-                    result,
-                    self.check_audience(reach_fb, reach_ig))
-                result["audience"] = reach_ig * 100 / reach_fb
-                result["ig_audience"] = locale.format(
-                    "%d", reach_ig, grouping=True)
-            # Get objective and status from Campaign
-            campaign_id = ad_set[AdSet.Field.campaign_id]
-            campaign = self.get_ad_campaign(cache, campaign_id)
-            result["c_objective"] = \
-                campaign[Campaign.Field.objective].replace("_", " ")
-            result["c_status"] = campaign[Campaign.Field.configured_status]
-            check = self.check_objective(result["c_objective"])
-            if check['eligibility'] == 5:
-                result['objective_supported'] = 1
-            elif check['eligibility'] == 1:
-                result['objective_supported'] = 0
-            else:
-                result['objective_supported'] = 2
+        cache = {}
 
-            self.add_check_result(result, check)
+        def run(task):
+            index, name = task
+            ad_set = selected[index]
+            if name == 'creative':
+                return task, self.check_creative(api, account, cache, ad_set)
+            return task, self.get_reach_estimate(
+                api,
+                account_id,
+                ad_set[AdSet.Field.targeting],
+                name == 'reach_ig',
+            )
 
-            # Get creative and check the media
-            if campaign[Campaign.Field.objective] == 'PRODUCT_CATALOG_SALES':
-                result['preview_url'] = \
-                    'Images from product catalog are not supported.'
-                results.append(result)
-                result['creative_ready'] = False
-                continue
+        answers = dict(self.executor.map_unordered(run, tasks))
 
-            creatives = ad_set.get_ad_creatives([
-                AdCreative.Field.object_story_id,
-            ])
-            result['creative_ready'] = False
-            if not creatives:
-                comment = 'No creative found in this ad set.'
-                self.add_check_result(
-                    result,
-                    {
-                        "eligibility": 3,
-                    }
-                )
-                result['preview_url'] = comment
-                results.append(result)
-                continue
-            creative = creatives[0]
-            story_id = creative.get(AdCreative.Field.object_story_id, 0)
-            if story_id == 0:
-                comment = 'No post fround in the first creative of this ad set.'
-                self.add_check_result(
-                    result,
-                    {
-                        "eligibility": 3,
-                    }
-                )
-                result['preview_url'] = comment
-                results.append(result)
-                continue
-
-            # Check whether the creative's post is IG ready
-            try:
-                # This Graph API call is not a part of Ads API thus no SDK
-                post = FacebookAdsApi.get_default_api().call(
-                    'GET',
-                    (story_id,),
-                    params={
-                        'fields': 'is_instagram_eligible,child_attachments'
-                    },
-                )
-                post_ig_eligible = post.json()['is_instagram_eligible']
-            except FacebookRequestError:
-                post_ig_eligible = False
-            result['creative_ready'] = post_ig_eligible
-            if post_ig_eligible:
-                self.add_check_result(
-                    result,
-                    {
-                        "eligibility": 5,
-                    }
-                )
-
-                # Generate preview
-                # As we do not know which IG account you will use,
-                # just use a hardcoded one for preview.
-                jasper_ig_account = "1023317097692584"
-                ad_format = 'INSTAGRAM_STANDARD'
-                creative_spec = {
-                    'instagram_actor_id': jasper_ig_account,
-                    'object_story_id': story_id,
-                }
-                params = {
-                    AdPreview.Field.creative: creative_spec,
-                    AdPreview.Field.ad_format: ad_format,
-                }
-                preview = account.get_generate_previews(params=params)
-                result['preview_url'] = preview[0].get_html() \
-                    .replace('width="320"', 'width="340"', 1)
-            else:
-                comment = 'The creative needs to be modified for Instagram.'
-                self.add_check_result(
-                    result,
-                    {
-                        "eligibility": 3,
-                    }
-                )
-                result['preview_url'] = comment
-            results.append(result)
+        results = []
+        for index, ad_set in enumerate(selected):
+            campaign, media = answers[(index, 'creative')]
+            results.append(self.get_result(
+                ad_set,
+                answers.get((index, 'reach_fb')),
+                answers.get((index, 'reach_ig')),
+                campaign,
+                media,
+            ))
         return list(sorted(
             results,
             key=lambda result: result['eligibility'],
             reverse=True))
 
+    def get_reach_estimate(self, api, account_id, targeting, instagram=False):
+        """
+        Estimate the audience size of a targeting spec. Estimates go through
+        the shared reach estimate cache, as ad sets often share their
+        targeting.
+
+        Params:
+
+        * `api` the Ads API session.
+        * `account_id` the ad account of the ad set.
+        * `targeting` the targeting spec of the ad set.
+        * `instagram` whether to estimate the same targeting on Instagram
+          only.
+        """
+        if instagram:
+            targeting = dict(targeting)
+            targeting['publisher_platforms'] = ["instagram"]
+            targeting['facebook_positions'] = None
+        estimate = default_cache.get_reach_estimate(
+            account_id,
+            targeting,
+            AdSet.OptimizationGoal.impressions,
+            api=api,
+        )
+        return (estimate or {}).get('users', 0)
+
+    def check_creative(self, api, account, cache, ad_set):
+        """
+        Check whether the post of the first creative of an ad set is ready
+        for Instagram and generate its Instagram preview.
+
+        Returns a tuple of the campaign of the ad set and a dict with
+        `creative_ready`, `preview_url` and the `eligibility` of the
+        creative, None when it was not checked.
+
+        Params:
+
+        * `api` the Ads API session.
+        * `account` the ad account of the ad set.
+        * `cache` ad campaigns obtained already.
+        * `ad_set` the ad set to be checked.
+        """
+        campaign_id = ad_set[AdSet.Field.campaign_id]
+        campaign = self.get_ad_campaign(cache, campaign_id, api)
+
+        # Get creative and check the media
+        if campaign[Campaign.Field.objective] == 'PRODUCT_CATALOG_SALES':
+            return campaign, {
+                'creative_ready': False,
+                'preview_url':
+                    'Images from product catalog are not supported.',
+                'eligibility': None,
+            }
+
+        creatives = ad_set.get_ad_creatives([
+            AdCreative.Field.object_story_id,
+        ])
+        if not creatives:
+            return campaign, {
+                'creative_ready': False,
+                'preview_url': 'No creative found in this ad set.',
+                'eligibility': 3,
+            }
+        creative = creatives[0]
+        story_id = creative.get(AdCreative.Field.object_story_id, 0)
+        if story_id == 0:
+            return campaign, {
+                'creative_ready': False,
+                'preview_url':
+                    'No post fround in the first creative of this ad set.',
+                'eligibility': 3,
+            }
+
+        # Check whether the creative's post is IG ready
+        try:
+            # This Graph API call is not a part of Ads API thus no SDK
+            post = api.call(
+                'GET',
+                (story_id,),
+                params={
+                    'fields': 'is_instagram_eligible,child_attachments'
+                },
+            )
+            post_ig_eligible = post.json()['is_instagram_eligible']
+        except FacebookRequestError:
+            post_ig_eligible = False
+        if not post_ig_eligible:
+            return campaign, {
+                'creative_ready': False,
+                'preview_url':
+                    'The creative needs to be modified for Instagram.',
+                'eligibility': 3,
+            }
+
+        # Generate preview
+        # As we do not know which IG account you will use,
+        # just use a hardcoded one for preview.
+        jasper_ig_account = "1023317097692584"
+        ad_format = 'INSTAGRAM_STANDARD'
+        creative_spec = {
+            'instagram_actor_id': jasper_ig_account,
+            'object_story_id': story_id,
+        }
+        params = {
+            AdPreview.Field.creative: creative_spec,
+            AdPreview.Field.ad_format: ad_format,
+        }
+        preview = account.get_generate_previews(params=params)
+        return campaign, {
+            'creative_ready': True,
+            'preview_url': preview[0].get_html()
+            .replace('width="320"', 'width="340"', 1),
+            'eligibility': 5,
+        }
+
+    def get_result(self, ad_set, reach_fb, reach_ig, campaign, media):
+        """
+        Put together the analysis result of an ad set.
+
+        Params:
+
+        * `ad_set` the ad set analyzed.
+        * `reach_fb` and `reach_ig` the estimated audience sizes of the ad
+          set on Facebook and on Instagram only.
+        * `campaign` the ad campaign of the ad set.
+        * `media` the creative check returned by `check_creative`.
+        """
+        result = {}
+        result['id'] = ad_set['id']
+        result['name'] = ad_set['name']
+
+        targeting = ad_set.get(AdSet.Field.targeting, None)
+        if targeting is not None:
+            publisher_platforms = targeting.get('publisher_platforms', None)
+            pp_str = ''
+            if publisher_platforms is None:
+                result['publisher_platforms'] = '<li>DEFAULT</li>'
+            else:
+                for pp in publisher_platforms:
+                    pp_str += ('<li>' +
+                               self.translate_placement_publisher(str(pp)) +
+                               '</li>')
+                result['publisher_platforms'] = pp_str
+
+            self.add_check_result(
+                result,
+                self.check_audience(reach_fb, reach_ig))
+            result["audience"] = reach_ig * 100 / reach_fb
+            result["ig_audience"] = locale.format(
+                "%d", reach_ig, grouping=True)
+
+        # Get objective and status from Campaign
+        result["c_objective"] = \
+            campaign[Campaign.Field.objective].replace("_", " ")
+        result["c_status"] = campaign[Campaign.Field.configured_status]
+        check = self.check_objective(result["c_objective"])
+        if check['eligibility'] == 5:
+            result['objective_supported'] = 1
+        elif check['eligibility'] == 1:
+            result['objective_supported'] = 0
+        else:
+            result['objective_supported'] = 2
+
+        self.add_check_result(result, check)
+
+        result['creative_ready'] = media['creative_ready']
+        result['preview_url'] = media['preview_url']
+        if media['eligibility'] is not None:
+            self.add_check_result(
+                result,
+                {
+                    "eligibility": media['eligibility'],
+                }
+            )
+        return result
+
     def check_audience(self, reach_fb, reach_ig):
         """
         Compare the estimate audience size of the same targeting option on
@@ -309,7 +394,7 @@ class InstagramAdsPotential:
             if check.get('comment', None) is not None:
                 result['suggestion'] += '<li>' + check['comment']
 
-    def get_ad_campaign(self, cache, campaign_id):
+    def get_ad_campaign(self, cache, campaign_id, api=None):
         """
         Get the ad campaign. As some ad sets being analyzed belong to the
         same ad campaign, a caching is used to reduce the API calls.
@@ -318,10 +403,11 @@ class InstagramAdsPotential:
 
         * `cache` ad campaigns obtained already.
         * `campaign_id` the id of the ad campaign to be queried out.
+        * `api` the Ads API session, the default one if omitted.
         """
 
         if (cache.get(campaign_id) is None):
-            campaign = Campaign(fbid=campaign_id)
+            campaign = Campaign(fbid=campaign_id, api=api)
             campaign.remote_read(fields=[
                 Campaign.Field.name,
                 Campaign.Field.configured_status,
@@ -47,6 +47,8 @@ from facebookads.objects import (
     AdImage,
 )
 from facebookads.specs import ObjectStorySpec, LinkData
+from ad_flow import AdFlow
+from adimage_cache import default_uploader
 
 
 class LeadAdSample:
@@ -61,6 +63,10 @@ class LeadAdSample:
     * The ad set's `optimization_goal` must be set to `LEAD_GENERATION`
     * The ad set's `billing_event` should be set to `IMPRESSIONS`
     * The targeting for the ad set can be either `mobilefeed` or `desktopfeed`
+
+    The objects are created by an `AdFlow`: the image is uploaded while the
+    campaign and ad set are created in one batch request, then the creative
+    and ad are created in another.
     """
     def create_lead_ad(
         self,
@@ -80,6 +86,8 @@ class LeadAdSample:
         description,
         cta_type='SIGN_UP',
     ):
+        flow = AdFlow()
+
         """
         Create Campaign
         """
@@ -90,7 +98,7 @@ class LeadAdSample:
         campaign[Campaign.Field.buying_type] = \
             Campaign.BuyingType.auction
 
-        campaign.remote_create(params={
+        flow.add('campaign', campaign, {
             'status': Campaign.Status.paused
         })
 
@@ -98,7 +106,7 @@ class LeadAdSample:
         Create AdSet
         """
         adset = AdSet(parent_id=account_id)
-        adset[AdSet.Field.campaign_id] = campaign.get_id_assured()
+        adset[AdSet.Field.campaign_id] = flow.ref('campaign')
         adset[AdSet.Field.name] = name + ' AdSet'
         adset[AdSet.Field.promoted_object] = {
             'page_id': page_id,
@@ -108,15 +116,18 @@ class LeadAdSample:
         adset[AdSet.Field.bid_amount] = bid_amount
         adset[AdSet.Field.daily_budget] = daily_budget
         adset[AdSet.Field.targeting] = targeting
-        adset.remote_create()
+        flow.add('adset', adset)
 
         """
         Image
         """
-        image = AdImage(parent_id=account_id)
-        image[AdImage.Field.filename] = image_path
-        image.remote_create()
-        image_hash = image[AdImage.Field.hash]
+        flow.add_call('image', lambda: {
+            AdImage.Field.hash: default_uploader.upload_ad_image(
+                account_id,
+                image_path,
+            ),
+        })
+        image_hash = flow.ref('image', AdImage.Field.hash)
 
         """
         Create Creative
@@ -141,21 +152,24 @@ class LeadAdSample:
         creative = AdCreative(parent_id=account_id)
         creative[AdCreative.Field.name] = name + ' Creative'
         creative[AdCreative.Field.object_story_spec] = object_story_spec
-        creative.remote_create()
+        flow.add('creative', creative)
 
         """
         Create Ad
         """
         ad = Ad(parent_id=account_id)
         ad[Ad.Field.name] = name
-        ad[Ad.Field.adset_id] = adset.get_id_assured()
-        ad[Ad.Field.creative] = {'creative_id': str(creative.get_id_assured())}
-        ad.remote_create()
+        ad[Ad.Field.adset_id] = flow.ref('adset')
+        ad[Ad.Field.creative] = {'creative_id': flow.ref('creative')}
+        flow.add('ad', ad)
+
+        objects = flow.execute()
 
         return {
-            'image_hash': image_hash,
+            'image_hash': objects['image'][AdImage.Field.hash],
             'campaign_id': campaign['id'],
             'adset_id': adset['id'],
             'creative_id': creative['id'],
             'ad_id': ad['id'],
+            'timings': flow.timings,
         }
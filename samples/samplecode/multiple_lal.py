@@ -28,17 +28,29 @@
 This sample shows how you can take a custom audience seed and quickly create
 lookalike audiences in multiple countries at multiple similarity ratios.
 
+The lookalike audiences are created with batch requests, several batches at
+a time, so that a grid of 20 countries by 10 ratios takes a few seconds.
+
 ## References:
 
 * [Lookalike Audiences][1]
+* [Batch requests][2]
 
 [1]: https://developers.facebook.com/docs/marketing-api/lookalike-audience-targeting
+[2]: https://developers.facebook.com/docs/marketing-api/batch-requests
 """
 import itertools
+import logging
+import time
+from facebookads.api import FacebookAdsApi
+from facebookads.exceptions import FacebookRequestError
 from facebookads.objects import (
     CustomAudience,
     LookalikeAudience,
 )
+from utils import BoundedExecutor, generate_batches
+
+logger = logging.getLogger(__name__)
 
 
 class MultipleLalSample:
@@ -46,6 +58,14 @@ class MultipleLalSample:
     The sample that creates multiple lookalike audiences in different countries
     at different similarity ratios
     """
+
+    # maximum number of requests in a Graph API batch request
+    BATCH_SIZE_LIMIT = 50
+
+    # worker threads shared by every instance, which caps the number of
+    # batch requests in flight across all callers
+    executor = BoundedExecutor(max_workers=4, name='multiple_lal')
+
     def create_lals(
         self,
         account_id,
@@ -64,12 +84,65 @@ class MultipleLalSample:
         * `countries` array of country codes
         * `ratios` array of integers stating the lookalike ratio, from 1 to 10
            currency is USD, dailybudget=1000 says your budget is 1000 USD
+
+        Raises the error of the first lookalike audience which could not be
+        created, after logging all of them, as `create_lal_grid` returns.
         """
-        lal_created = []
+        lal_created, failures = self.create_lal_grid(
+            account_id,
+            seed_id,
+            base_name,
+            countries,
+            ratios,
+        )
+        for lookalike, error in failures:
+            logger.warning(
+                "Failed to create %s: %s",
+                lookalike[LookalikeAudience.Field.name],
+                error,
+            )
+        if failures:
+            raise failures[0][1]
+        return lal_created
 
+    def create_lal_grid(
+        self,
+        account_id,
+        seed_id,
+        base_name,
+        countries,
+        ratios,
+        batch_size=BATCH_SIZE_LIMIT,
+        max_retries=2,
+        api=None,
+    ):
+        """
+        Function that creates the lookalike audiences of every country and
+        ratio with batch requests of `batch_size` audiences, sent
+        concurrently on the shared `executor`. The audiences which failed
+        with a transient error, or got no response, are sent again, up to
+        `max_retries` times with an exponential backoff. A batch request
+        failing as a whole, e.g. on a network error, only fails its own
+        audiences.
+
+        Params are the same as `create_lals`.
+
+        Returns a tuple of the list of created lookalike audiences, in the
+        order of `itertools.product(countries, ratios)`, and a list of
+        `(lookalike, error)` tuples for the ones which could not be
+        created, where `error` is the `FacebookRequestError` of the
+        audience, the error of its batch request, or a `RuntimeError` if
+        it got no response.
+        """
+        if not api:
+            # keep a copy of the Ads API session as we're going to be using
+            # it across new threads
+            api = FacebookAdsApi.get_default_api()
+
+        lookalikes = []
         for country, ratio in itertools.product(countries, ratios):
             # Create the lookalike audience
-            lookalike = CustomAudience(parent_id=account_id)
+            lookalike = CustomAudience(parent_id=account_id, api=api)
             lookalike[LookalikeAudience.Field.name] = "{0} {1} {2}".format(
                 base_name,
                 country,
@@ -82,6 +155,74 @@ class MultipleLalSample:
             }
             lookalike[CustomAudience.Field.subtype] = \
                 CustomAudience.Subtype.lookalike
-            lookalike.remote_create()
-            lal_created.append(lookalike)
-        return lal_created
+            lookalikes.append(lookalike)
+
+        errors = {}
+        pending = lookalikes
+        for attempt in range(max_retries + 1):
+            retry = []
+            for batch_errors, batch_retry in self.executor.map_unordered(
+                lambda batch: self.execute_lal_batch(api, batch),
+                generate_batches(pending, batch_size),
+            ):
+                errors.update(batch_errors)
+                retry.extend(batch_retry)
+            if not retry or attempt == max_retries:
+                break
+            logger.info(
+                "Retrying %s failed lookalike audiences",
+                len(retry),
+            )
+            for audience in retry:
+                del errors[id(audience)]
+            pending = retry
+            time.sleep(2 ** attempt)
+
+        lal_created = [
+            audience for audience in lookalikes
+            if id(audience) not in errors
+        ]
+        failures = [
+            (audience, errors[id(audience)]) for audience in lookalikes
+            if id(audience) in errors
+        ]
+        return lal_created, failures
+
+    def execute_lal_batch(self, api, lookalikes):
+        """
+        Create the lookalike audiences with one batch request and return a
+        dict of `id(lookalike)` to the error of the failed ones, and the
+        list of those worth retrying.
+        """
+        api_batch = api.new_batch()
+        errors = {}
+        retry = []
+
+        def callback_failure(lookalike):
+            def callback(response):
+                error = response.error()
+                errors[id(lookalike)] = error
+                if error.api_transient_error():
+                    retry.append(lookalike)
+            return callback
+
+        for lookalike in lookalikes:
+            lookalike.remote_create(
+                batch=api_batch,
+                failure=callback_failure(lookalike),
+            )
+        batch_error = RuntimeError('No response')
+        try:
+            api_batch.execute()
+        except (FacebookRequestError, IOError, ValueError) as e:
+            # network errors, server errors or a response that is not JSON
+            logger.warning("Lookalike audience batch failed: %s", e)
+            batch_error = e
+
+        # lookalike audiences of a batch which failed as a whole have no id
+        for lookalike in lookalikes:
+            if id(lookalike) not in errors and \
+                    CustomAudience.Field.id not in lookalike:
+                errors[id(lookalike)] = batch_error
+                retry.append(lookalike)
+        return errors, retry
@@ -31,26 +31,117 @@ and/or app ID within one of your business managers.
 Downloads here will timeout after 5 mins and should only be used for small
 data-sets.
 """
+import calendar
 import itertools
+import json
 import logging
-import Queue
+import sqlite3
 import sys
-import threading
+import urllib
+import urlparse
 from datetime import date, datetime, time, timedelta
 from facebookads.api import FacebookAdsApi
+from utils import BoundedExecutor, buffer_iterable_async
 
 logger = logging.getLogger(__name__)
 
+# the year, month, day, hour, minute and second of an API timestamp
+TIMESTAMP_FIELDS = ((0, 4), (5, 7), (8, 10), (11, 13), (14, 16), (17, 19))
+
 # FacebookAdsApi.init(
 #    app_id = '<SERVER_APP_ID>',
 #    access_token = '<USER_ACCESS_TOKEN>',
 # )
 
+
+class OrderLevelReportCheckpoint:
+    """
+    Durable progress of `retrieve_order_level_report_data_parallel` runs,
+    stored in a SQLite file: for every time partition of a run, either
+    the cursor of the next page to fetch or that it is complete.
+
+    Runs are identified by their arguments, so a restarted run with the
+    same arguments picks up the saved progress.
+    """
+
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS checkpoints ('
+            'run TEXT, since TEXT, until TEXT, next_path TEXT, done INTEGER, '
+            'PRIMARY KEY (run, since, until))'
+        )
+        self.connection.commit()
+        self.run = None
+
+    def start_run(self, business_id, pixel_id, app_id, from_date, to_date,
+                  splits):
+        self.run = json.dumps([
+            str(business_id), str(pixel_id or ''), str(app_id or ''),
+            from_date.isoformat(), to_date.isoformat(), splits,
+        ])
+
+    def get(self, start, end):
+        """
+        Return `(done, next_path)` for a time partition of the run, or
+        `(False, None)` if it was never started
+        """
+        row = self.connection.execute(
+            'SELECT done, next_path FROM checkpoints '
+            'WHERE run = ? AND since = ? AND until = ?',
+            (self.run, start.isoformat(), end.isoformat()),
+        ).fetchone()
+        if row is None:
+            return False, None
+        return bool(row[0]), row[1]
+
+    def save(self, start, end, next_path):
+        """
+        Save the cursor of the next page of a time partition, or mark it
+        complete when `next_path` is None
+        """
+        self.connection.execute(
+            'INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?)',
+            (
+                self.run,
+                start.isoformat(),
+                end.isoformat(),
+                self.strip_access_token(next_path),
+                int(next_path is None),
+            ),
+        )
+        self.connection.commit()
+
+    def strip_access_token(self, path):
+        """
+        Remove the access token from a `paging.next` URL so that it is not
+        written to disk. The API session adds it back to every request.
+        """
+        if not path:
+            return path
+        url = urlparse.urlsplit(path)
+        query = [
+            (k, v) for k, v in urlparse.parse_qsl(url.query, True)
+            if k != 'access_token'
+        ]
+        return urlparse.urlunsplit(url._replace(query=urllib.urlencode(query)))
+
+    def close(self):
+        self.connection.close()
+
+
 class OrderLevelReportingSample:
     """
     The main sample class.
     """
 
+    # columns that identify an order when it is saved to a database
+    ORDER_KEY_COLUMNS = ('order_id', )
+
+    # worker threads shared by every instance, which caps the number of
+    # concurrent page fetches across all requests
+    executor = BoundedExecutor(max_workers=16, name='orderlevelreporting')
+
     def retrieve_order_level_report_data_parallel(
         self,
         from_date,
@@ -59,9 +150,20 @@ class OrderLevelReportingSample:
         pixel_id='',
         app_id='',
         splits=4,
+        ordered=True,
+        checkpoint=None,
     ):
         """
           Parallelise the retrieval of order level reports.
+
+          Time partitions are fetched on the shared `executor`. With
+          `ordered`, pages come out in time order; otherwise they come out
+          as soon as any partition has fetched them.
+
+          With an `OrderLevelReportCheckpoint`, the cursor of every
+          partition is saved once its page has been consumed, and a run
+          with the same arguments skips the completed partitions and
+          resumes the others after their last consumed page.
         """
         d = (to_date - from_date) / splits
 
@@ -81,11 +183,10 @@ class OrderLevelReportingSample:
         # it across new threads
         api = FacebookAdsApi.get_default_api()
 
-        return itertools.chain.from_iterable(
-            map(
-                lambda (start, end): self.zzz_buffer_iterable_async(
-                    # promise fetches time-ranges concurrently
-                    self.retrieve_order_level_report_data(
+        if not checkpoint:
+            return self.executor.buffer_iterables(
+                map(
+                    lambda (start, end): self.retrieve_order_level_report_data(
                         api=api,
                         from_date=start,
                         to_date=end,
@@ -93,11 +194,221 @@ class OrderLevelReportingSample:
                         pixel_id=pixel_id,
                         app_id=app_id,
                     ),
-                    buffer_size=30,
+                    time_partitions,
                 ),
-                time_partitions,
+                buffer_size=30,
+                ordered=ordered,
+            )
+
+        checkpoint.start_run(
+            business_id, pixel_id, app_id, from_date, to_date, splits,
+        )
+
+        def partition_pages(start, end, next_path):
+            pages = self.retrieve_order_level_report_pages(
+                api=api,
+                from_date=start,
+                to_date=end,
+                business_id=business_id,
+                pixel_id=pixel_id,
+                app_id=app_id,
+                next_path=next_path,
+            )
+            for data, next_path in pages:
+                yield (start, end), data, next_path
+            # mark the end of the partition, even after empty pages
+            yield (start, end), None, None
+
+        partitions = []
+        for start, end in time_partitions:
+            done, next_path = checkpoint.get(start, end)
+            if done:
+                logger.info("Skipping completed partition %s -> %s",
+                            start, end)
+                continue
+            partitions.append(partition_pages(start, end, next_path))
+
+        def iterator():
+            for (start, end), data, next_path in \
+                    self.executor.buffer_iterables(
+                        partitions,
+                        buffer_size=30,
+                        ordered=ordered,
+                    ):
+                if data is not None:
+                    yield data
+                # the consumer is back for more, so the page is handled
+                checkpoint.save(start, end, next_path)
+
+        return iterator()
+
+    def retrieve_order_level_report_data_adaptive(
+        self,
+        from_date,
+        to_date,
+        business_id,
+        pixel_id='',
+        app_id='',
+        workers=4,
+        max_pages=10,
+        max_latency=timedelta(seconds=60),
+        min_slice=timedelta(minutes=15),
+        buffer_size=30,
+    ):
+        """
+          Retrieve order level reports on the shared `executor`, splitting
+          busy time ranges into smaller slices as needed.
+
+          The range starts as `workers` equal slices. A slice is read
+          `max_pages` pages ahead of the consumer; if it has more pages
+          than that, or they took longer than `max_latency`, the pages
+          read so far are kept and only the rest of the range is split in
+          two slices. The rest is found from the `order_timestamp` of the
+          orders read, when they come in time order; otherwise, or if the
+          rest is shorter than twice `min_slice`, the slice goes on with
+          its cursor instead. Pages are never fetched twice.
+
+          Pages are yielded slice by slice, in time order of the initial
+          slices, the pages read before a split coming first.
+        """
+        start_time = self.to_datetime(from_date)
+        end_time = self.to_datetime(to_date)
+
+        # keep a copy of the Ads API session as we're going to be using
+        # it across new threads
+        api = FacebookAdsApi.get_default_api()
+
+        PAGE = 0
+        SPLIT = 1
+
+        def slice_pages(start, end, skip_ids):
+            """
+              Yield `(PAGE, data)` for the pages of a slice, and a final
+              `(SPLIT, slices, skip_ids)` if the rest of it must be read as
+              smaller slices.
+            """
+            splittable = end - start >= 2 * min_slice
+            started = datetime.now()
+            probe = []
+            pages = self.retrieve_order_level_report_pages(
+                api=api,
+                from_date=start,
+                to_date=end,
+                business_id=business_id,
+                pixel_id=pixel_id,
+                app_id=app_id,
             )
+            for data, next_path in pages:
+                if skip_ids:
+                    # orders at the boundary with the parent slice
+                    data = [
+                        order for order in data
+                        if order.get('order_id') not in skip_ids
+                    ]
+                if not splittable:
+                    yield PAGE, data
+                    continue
+
+                probe.append(data)
+                if next_path is None or (
+                    len(probe) < max_pages and
+                    datetime.now() - started <= max_latency
+                ):
+                    continue
+
+                rest = self.get_rest_of_slice(start, end, probe)
+                for page in probe:
+                    yield PAGE, page
+                probe = []
+                if rest is None or rest[1] - rest[0] < 2 * min_slice:
+                    # go on with the cursor
+                    splittable = False
+                    continue
+
+                pages.close()
+                rest_start, rest_end, boundary_ids = rest
+                middle = rest_start + (rest_end - rest_start) / 2
+                logger.info(
+                    "Splitting the rest of busy slice %s -> %s at %s",
+                    rest_start, rest_end, middle,
+                )
+                yield SPLIT, [(rest_start, middle), (middle, rest_end)], \
+                    boundary_ids
+                return
+
+            for page in probe:
+                yield PAGE, page
+
+        def drain(time_slices, skip_ids=frozenset()):
+            for signal in self.executor.buffer_iterables(
+                [slice_pages(start, end, skip_ids)
+                 for start, end in time_slices],
+                buffer_size=buffer_size,
+            ):
+                if signal[0] == PAGE:
+                    if signal[1]:
+                        yield signal[1]
+                else:
+                    for page in drain(signal[1], signal[2]):
+                        yield page
+
+        d = (end_time - start_time) / workers
+        return drain([
+            (i * d + start_time, (i + 1) * d + start_time)
+            for i in range(workers)
+        ])
+
+    def get_rest_of_slice(self, start, end, pages):
+        """
+          Return `(rest_start, rest_end, boundary_ids)`: the part of the
+          slice from `start` to `end` not covered by `pages`, the first
+          pages of the slice, and the ids of the orders read at its
+          boundary, which the rest must skip. Return None unless the
+          orders came in time order, as the covered part is then unknown.
+        """
+        orders = [order for page in pages for order in page]
+        try:
+            timestamps = [
+                self.parse_timestamp(order['order_timestamp'])
+                for order in orders
+            ]
+        except (KeyError, ValueError):
+            return None
+        boundary = timestamps[-1]
+        boundary_ids = frozenset(
+            order.get('order_id')
+            for order, timestamp in zip(orders, timestamps)
+            if timestamp == boundary
         )
+        pairs = zip(timestamps, timestamps[1:])
+        if all(a <= b for a, b in pairs) and boundary > start:
+            return boundary, end, boundary_ids
+        if all(a >= b for a, b in pairs) and boundary < end:
+            return start, boundary, boundary_ids
+        return None
+
+    def parse_timestamp(self, timestamp):
+        """
+          Convert an API timestamp, such as `2016-08-01T12:34:56+0000`, to
+          a local naive datetime, as the ranges of the requests are.
+        """
+        # parsed by hand, as strptime is not thread safe in Python 2
+        fields = [timestamp[i:j] for i, j in TIMESTAMP_FIELDS]
+        epoch = calendar.timegm([int(field) for field in fields])
+        offset = timestamp[19:]
+        if offset:
+            minutes = int(offset[1:3]) * 60 + int(offset[3:5])
+            epoch -= (-60 if offset[0] == '-' else 60) * minutes
+        return datetime.fromtimestamp(epoch)
+
+    def to_datetime(self, d):
+        """
+          Convert dates to datetimes so that splitting keeps intra-day
+          resolution.
+        """
+        if not isinstance(d, datetime):
+            d = datetime.combine(d, time())
+        return d
 
     def retrieve_order_level_report_data(
         self,
@@ -112,6 +423,34 @@ class OrderLevelReportingSample:
         """
           Retrieve order level reporting for a given time range.
         """
+        for data, next_path in self.retrieve_order_level_report_pages(
+            from_date=from_date,
+            to_date=to_date,
+            business_id=business_id,
+            pixel_id=pixel_id,
+            app_id=app_id,
+            limit=limit,
+            api=api,
+        ):
+            yield data
+
+    def retrieve_order_level_report_pages(
+        self,
+        from_date,
+        to_date,
+        business_id,
+        pixel_id,
+        app_id,
+        limit=150,
+        api=None,
+        next_path=None,
+    ):
+        """
+          Same as `retrieve_order_level_report_data` but yields a
+          `(data, next_path)` tuple per page, where `next_path` is the
+          cursor of the following page or None after the last page. Pass
+          a `next_path` to start from that page instead of the first one.
+        """
         path = (business_id, "order_id_attributions", )
         params = {
             'since': from_date.strftime('%s'),
@@ -121,6 +460,10 @@ class OrderLevelReportingSample:
             'limit': limit,
         }
 
+        if next_path:
+            path = next_path
+            params = {}
+
         if not api:
             api = FacebookAdsApi.get_default_api()
 
@@ -139,60 +482,25 @@ class OrderLevelReportingSample:
                 params,
             ).json()
 
-            # only emit non-empty pages
-            if response['data']:
-                yield response['data']
-
             if 'paging' in response and 'next' in response['paging']:
                 path = response['paging']['next']
                 params = {}
             else:
-                break
+                path = None
+
+            # only emit non-empty pages
+            if response['data']:
+                yield response['data'], path
 
     def zzz_buffer_iterable_async(self, iterable, buffer_size=100, daemon=True):
         """
           Helper function for buffering blocking iterables on a worker thread.
         """
-
-        YIELD = 0
-        RAISE = 1
-        BREAK = 2
-
-        def iterate(iterable, thread_state, buffer):
-            try:
-                for el in iterable:
-                    buffer.put((YIELD, el,))
-                    if thread_state.get(BREAK):
-                        break
-            except Exception, e:
-                buffer.put((RAISE, e, sys.exc_info()[2],))
-            else:
-                buffer.put((BREAK,))
-
-        buffer = Queue.Queue(maxsize=buffer_size)
-        thread_state = dict()
-
-        t = threading.Thread(
-            target=iterate,
-            args=(iterable, thread_state, buffer),
+        return buffer_iterable_async(
+            iterable,
+            buffer_size=buffer_size,
+            daemon=daemon,
         )
-        t.daemon = daemon
-        t.start()
-
-        def iterator():
-            try:
-                for signal in iter(buffer.get, (BREAK,)):
-                    if signal[0] == YIELD:
-                        yield signal[1]
-                    elif signal[0] == RAISE:
-                        raise signal[1], None, signal[2]
-            finally:
-                thread_state[BREAK] = True
-                while buffer.full():
-                    buffer.get_nowait()
-                t.join()
-
-        return iterator()
 
 if __name__ == '__main__':
     import argparse
@@ -236,6 +544,36 @@ if __name__ == '__main__':
         '-s', action='store_true', dest='skip_header',
         help='omit the very first row containing column headers',
     )
+    parser.add_argument(
+        '--sqlite', dest='sqlite_path',
+        help='upsert the orders into this SQLite database file instead of '
+             'writing them to STDOUT',
+    )
+    parser.add_argument(
+        '--postgres', dest='postgres_dsn',
+        help='upsert the orders into the PostgreSQL database of this DSN '
+             'instead of writing them to STDOUT',
+    )
+    parser.add_argument(
+        '--table', default='order_level_report',
+        help='table to upsert the orders into, keyed on order_id',
+    )
+    parser.add_argument(
+        '-u', '--unordered', action='store_false', dest='ordered',
+        help='write orders as soon as any time period returns them instead '
+             'of in time order',
+    )
+    parser.add_argument(
+        '--resume', dest='checkpoint_path',
+        help='save progress of every time period to this SQLite file and, '
+             'if it holds progress of a previous run with the same '
+             'arguments, skip the orders that run already wrote',
+    )
+    parser.add_argument(
+        '--adaptive', action='store_true',
+        help='keep the -c threads busy by splitting busy time periods into '
+             'smaller ones instead of using equal time periods',
+    )
     parser.add_argument(
         '-c', type=int, default=4, dest='splits',
         help='split time range into this number of time periods and process '
@@ -274,6 +612,19 @@ if __name__ == '__main__':
     format = args.pop('format')
     skip_header = args.pop('skip_header')
     explode = args.pop('explode')
+    sqlite_path = args.pop('sqlite_path')
+    postgres_dsn = args.pop('postgres_dsn')
+    table = args.pop('table')
+
+    checkpoint_path = args.pop('checkpoint_path')
+    if checkpoint_path:
+        if args.get('adaptive'):
+            parser.error('--resume can not be used with --adaptive')
+        args['checkpoint'] = OrderLevelReportCheckpoint(checkpoint_path)
+
+    if explode and (sqlite_path or postgres_dsn):
+        parser.error('-x can not be used with a database, as exploded rows '
+                     'do not have a unique order_id')
 
     logging.basicConfig(
         stream=sys.stderr,
@@ -292,7 +643,12 @@ if __name__ == '__main__':
     sample = OrderLevelReportingSample()
 
     # This iterator will stream pages of results
-    page_cursor = sample.retrieve_order_level_report_data_parallel(**args)
+    if args.pop('adaptive'):
+        args['workers'] = args.pop('splits')
+        args.pop('ordered')
+        page_cursor = sample.retrieve_order_level_report_data_adaptive(**args)
+    else:
+        page_cursor = sample.retrieve_order_level_report_data_parallel(**args)
 
     # OR... we can flatten the results into a single list of records like this
     flattened_cursor = itertools.chain.from_iterable(page_cursor)
@@ -315,7 +671,36 @@ if __name__ == '__main__':
         # attributions will be output for each row as a json-encoded array
         fieldnames.append('attributions')
 
-    # And we can then either sent to a DB or (in this case) print them out
+    # And we can then either send them to a DB...
+    if sqlite_path or postgres_dsn:
+        import db_sink
+
+        if sqlite_path:
+            sink_class = db_sink.SQLiteSink
+            connection = sqlite3.connect(sqlite_path)
+        else:
+            import psycopg2
+            sink_class = db_sink.PostgresSink
+            connection = psycopg2.connect(postgres_dsn)
+
+        try:
+            sink = sink_class(
+                connection,
+                table,
+                fieldnames,
+                OrderLevelReportingSample.ORDER_KEY_COLUMNS,
+            )
+            sink.create_table()
+            sink.write_dicts(flattened_cursor)
+        finally:
+            connection.close()
+
+        logger.info(
+            "Wrote %(rows)s orders in %(elapsed).1fs", sink.get_stats(),
+        )
+        sys.exit(0)
+
+    # ...or (in this case) print them out
     csv_writer = csv.DictWriter(
         sys.stdout,
         dialect=format,
@@ -328,8 +713,3 @@ if __name__ == '__main__':
             skip_header = True
 
         csv_writer.writerow(order_data)
-
-        # cursor.execute(
-        #   'INSERT INTO table VALUES (%s, %s, %s)',
-        #   (order_data.order_id, order_data.pixel_id, ...),
-        # )
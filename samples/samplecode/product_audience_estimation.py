@@ -34,10 +34,8 @@ estimate edge.
 
 [1]: https://developers.facebook.com/docs/marketing-api/reachestimate
 """
-from facebookads.objects import (
-    AdAccount,
-    ReachEstimate
-)
+from facebookads.objects import ReachEstimate
+from reach_estimate_cache import default_cache
 import copy
 
 
@@ -68,17 +66,17 @@ class ProductAudienceEstimation:
           how to define product audience rules
           (https://developers.facebook.com/docs/marketing-api/dynamic-product-ads/product-audiences,
           step 3).
-        """
-        adaccount = AdAccount(account_id)
 
+        Estimates are kept in the shared reach estimate cache, so submitting
+        the same spec again does not call the API.
+        """
         ts = copy.deepcopy(targeting_spec)
         ts['product_set_id'] = product_set_id
         targeting_spec = {'product_audience_specs': [ts]}
 
-        params = {
-            'currency': 'USD',
-            'optimize_for': ReachEstimate.OptimizeFor.link_clicks,
-            'targeting_spec': targeting_spec,
-        }
-        reachestimates = adaccount.get_reach_estimate(params=params)
-        return reachestimates.get_one()
+        return default_cache.get_reach_estimate(
+            account_id,
+            targeting_spec,
+            ReachEstimate.OptimizeFor.link_clicks,
+            'USD',
+        )
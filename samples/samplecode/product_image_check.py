@@ -34,6 +34,12 @@ is not restricted to certain product feeds.
 below and remove the limit checking.
 * It checks "additional images" of each product also, to see whether a simple
 swapping is feasible.
+* `audit_catalog` checks a whole catalog on a pool of processes and writes
+one verdict per product to a JSON lines or CSV file. Run this file as a script
+to audit a catalog from the command line.
+* With an `ImageSizeCache`, image sizes are kept between runs and only
+revalidated with conditional requests, so re-checking a catalog whose
+images did not change costs almost no network traffic.
 
 ## References:
 
@@ -47,13 +53,169 @@ from facebookads.objects import (
     ProductCatalog
 )
 from PIL import ImageFile
-import urllib
+import cStringIO
+import csv
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import requests
+from requests.adapters import HTTPAdapter
+import sqlite3
+import threading
+import time
 import urlparse
+from utils import BoundedExecutor, generate_batches
 # to load the full image, the following libs are needed.
 # from PIL import Image
-# import requests
 # from io import BytesIO
 
+logger = logging.getLogger(__name__)
+
+
+class ImageSizeCache:
+    """
+        Image sizes kept in a SQLite file between runs, keyed by image url,
+        along with the `ETag` and `Last-Modified` headers of the image to
+        revalidate them.
+
+        Entries checked less than `ttl` seconds ago are fresh. Once there
+        are more than `max_entries`, the least recently used ones are
+        evicted. Reading an entry does not write to the file: the times
+        entries were used are kept in memory and written
+        `USED_BATCH_SIZE` at a time, or on `flush`, `evict` and `close`.
+
+        Processes sharing the file need a cache each. A write waits up to
+        `timeout` seconds for the others, then raises `sqlite3.Error`.
+    """
+
+    USED_BATCH_SIZE = 1000
+
+    def __init__(
+        self,
+        path,
+        ttl=7 * 24 * 3600,
+        max_entries=1000000,
+        timeout=30
+    ):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        # url to the time it was last used, not written yet
+        self.used = {}
+        self.connection = sqlite3.connect(
+            path,
+            timeout=timeout,
+            check_same_thread=False,
+        )
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS image_sizes ('
+            'url TEXT PRIMARY KEY, width INTEGER, height INTEGER, '
+            'etag TEXT, last_modified TEXT, checked_at REAL, used_at REAL)'
+        )
+        self.connection.execute(
+            'CREATE INDEX IF NOT EXISTS image_sizes_used_at '
+            'ON image_sizes (used_at)'
+        )
+        self.connection.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, url):
+        """
+            Return a dict with the `size`, `etag`, `last_modified` and
+            whether the entry is `fresh`, or None if the url is not cached.
+        """
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT width, height, etag, last_modified, checked_at '
+                'FROM image_sizes WHERE url = ?',
+                (url, ),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.used[url] = now
+            if len(self.used) >= self.USED_BATCH_SIZE:
+                self.write_used()
+
+        return {
+            'size': (row[0], row[1]),
+            'etag': row[2],
+            'last_modified': row[3],
+            'fresh': now - row[4] < self.ttl,
+        }
+
+    def put(self, url, size, etag=None, last_modified=None):
+        now = time.time()
+        with self.lock:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO image_sizes '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (url, size[0], size[1], etag, last_modified, now, now),
+            )
+            self.connection.commit()
+
+    def touch(self, url):
+        """
+            Mark an entry as checked now, after a successful revalidation.
+        """
+        now = time.time()
+        with self.lock:
+            self.connection.execute(
+                'UPDATE image_sizes SET checked_at = ?, used_at = ? '
+                'WHERE url = ?',
+                (now, now, url),
+            )
+            self.connection.commit()
+
+    def flush(self):
+        """
+            Write the times entries were used.
+        """
+        with self.lock:
+            self.write_used()
+
+    def write_used(self):
+        # called with the lock held
+        used = self.used
+        self.used = {}
+        self.connection.executemany(
+            'UPDATE image_sizes SET used_at = ? WHERE url = ?',
+            ((used_at, url) for url, used_at in used.iteritems()),
+        )
+        self.connection.commit()
+
+    def evict(self):
+        """
+            Delete the least recently used entries above `max_entries`.
+            Returns the number of deleted entries.
+        """
+        with self.lock:
+            self.write_used()
+            count = self.connection.execute(
+                'SELECT COUNT(*) FROM image_sizes'
+            ).fetchone()[0]
+            if count <= self.max_entries:
+                return 0
+            self.connection.execute(
+                'DELETE FROM image_sizes WHERE url IN ('
+                'SELECT url FROM image_sizes ORDER BY used_at LIMIT ?)',
+                (count - self.max_entries, ),
+            )
+            self.connection.commit()
+            return count - self.max_entries
+
+    def close(self):
+        with self.lock:
+            self.write_used()
+            self.connection.close()
+
 
 class DPAImageCheckSample:
     """
@@ -67,13 +229,49 @@ class DPAImageCheckSample:
         image, as well as an array of up to 5 small image samples for the last
         case.
 
-        Set the limit to a number in huandreds or a little more. Only
+        Set the limit to a number in thousands or a little more. Only
         products of that number would be checked. We have this control as
         to check multiple images of each product in a catalog with millions of
         products will take too long. But if you run this script on your own
         machine, you can raise that limit more.
+
+        Images are probed concurrently on the shared `executor`, over a pool
+        of keep-alive connections per host, and only the first few KB of
+        each image are requested.
     """
 
+    # worker threads shared by every instance, which caps the number of
+    # concurrent image probes across all requests
+    executor = BoundedExecutor(max_workers=32, name='product_image_check')
+
+    # columns of the verdicts of `iter_catalog_audit`
+    AUDIT_COLUMNS = (
+        'id',
+        'url',
+        'image_url',
+        'image_ok',
+        'additional_image_ok',
+    )
+
+    # number of bytes requested per image, which is enough for the header
+    # of most images
+    RANGE_SIZE = 4096
+
+    def __init__(self, connections_per_host=32, cache=None):
+        """
+            `connections_per_host` caps the keep-alive connections opened to
+            every image host. `cache` is an optional `ImageSizeCache` that
+            keeps image sizes between runs.
+        """
+        self.cache = cache
+        adapter = HTTPAdapter(
+            pool_maxsize=connections_per_host,
+            pool_block=True,
+        )
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
     def check_product_images(
         self,
         catalog_id,
@@ -82,23 +280,14 @@ class DPAImageCheckSample:
         """
             Check the first "limit" products of a product catalog
         """
-        catalog = ProductCatalog(catalog_id)
-        fields = [
-            'additional_image_urls',
-            'image_url',
-            'url'
-        ]
-        products = catalog.get_products(fields)
         image_ok_count = 0
         additional_image_ok_count = 0
         total_count = 0
         small_images = []
-        for product in products:
+        for product, image_ok, additional_image_ok in \
+                self.iter_product_image_checks(catalog_id, limit):
             total_count += 1
-            if total_count > limit:
-                total_count -= 1
-                break
-            if self.is_size_ok(product['image_url']):
+            if image_ok:
                 image_ok_count += 1
             else:
                 if len(small_images) < 5:
@@ -106,24 +295,228 @@ class DPAImageCheckSample:
                         product['url'],
                         self.extract_from_safe_img(product['image_url'])
                     ))
-                if 'additional_image_urls' in product.keys() and \
-                        product['additional_image_urls']:
-                    image_urls = product['additional_image_urls']
-                    for url in image_urls:
-                        if self.is_size_ok(url):
-                            additional_image_ok_count += 1
-                            break
+                if additional_image_ok:
+                    additional_image_ok_count += 1
+        if self.cache is not None:
+            try:
+                self.cache.evict()
+            except sqlite3.Error as e:
+                logger.warning("Image size cache eviction failed: %s", e)
         res = (total_count, image_ok_count, additional_image_ok_count,
                small_images)
         return res
 
+    def iter_product_image_checks(
+        self,
+        catalog_id,
+        limit
+    ):
+        """
+            Check the first "limit" products of a product catalog
+            concurrently and yield a `(product, image_ok,
+            additional_image_ok)` tuple per product as soon as it is checked.
+            `additional_image_ok` is only computed for products whose main
+            image is too small.
+        """
+        catalog = ProductCatalog(catalog_id)
+        fields = [
+            'additional_image_urls',
+            'image_url',
+            'url'
+        ]
+        products = catalog.get_products(fields)
+
+        def first_products():
+            for count, product in enumerate(products):
+                if count >= limit:
+                    break
+                yield product
+
+        return self.executor.map_unordered(
+            self.check_product,
+            first_products(),
+        )
+
+    def check_product(self, product):
+        """
+            Check the main image of a product and, if it is too small, its
+            additional images until one is big enough.
+        """
+        if self.is_size_ok(product['image_url']):
+            return product, True, False
+
+        if 'additional_image_urls' in product.keys() and \
+                product['additional_image_urls']:
+            for url in product['additional_image_urls']:
+                if self.is_size_ok(url):
+                    return product, False, True
+        return product, False, False
+
+    def audit_catalog(
+        self,
+        catalog_id,
+        output_file,
+        format='jsonl',
+        **kwargs
+    ):
+        """
+            Check every product of a catalog with `iter_catalog_audit` and
+            write one verdict per product to `output_file`, as JSON lines
+            or, with `format='csv'`, as CSV with a header row.
+
+            Only running counts are kept in memory. Returns the same tuple
+            as `check_product_images`. Other keyword arguments are passed to
+            `iter_catalog_audit`.
+        """
+        verdicts = self.iter_catalog_audit(catalog_id, **kwargs)
+        counts = {'total': 0, 'image_ok': 0, 'additional_image_ok': 0}
+        small_images = []
+
+        def counted(verdicts):
+            for verdict in verdicts:
+                yield verdict
+                counts['total'] += 1
+                if verdict['image_ok']:
+                    counts['image_ok'] += 1
+                else:
+                    if len(small_images) < 5:
+                        small_images.append((
+                            verdict['url'],
+                            self.extract_from_safe_img(verdict['image_url'])
+                        ))
+                    if verdict['additional_image_ok']:
+                        counts['additional_image_ok'] += 1
+
+        self.write_audit(counted(verdicts), output_file, format)
+
+        return (counts['total'], counts['image_ok'],
+                counts['additional_image_ok'], small_images)
+
+    def write_audit(
+        self,
+        verdicts,
+        output_file,
+        format='jsonl'
+    ):
+        """
+            Write verdicts of `iter_catalog_audit` to a file object as JSON
+            lines or CSV.
+        """
+        for line in self.iter_audit_lines(verdicts, format):
+            output_file.write(line)
+
+    def iter_audit_lines(
+        self,
+        verdicts,
+        format='jsonl'
+    ):
+        """
+            Encode verdicts of `iter_catalog_audit` as JSON lines or, with
+            `format='csv'`, as CSV lines after a header line, one string
+            per verdict.
+        """
+        if format == 'jsonl':
+            for verdict in verdicts:
+                yield json.dumps(verdict) + '\n'
+        elif format == 'csv':
+            buffer = cStringIO.StringIO()
+            writer = csv.writer(buffer)
+
+            def line(values):
+                writer.writerow([
+                    v.encode('utf-8') if isinstance(v, unicode) else v
+                    for v in values
+                ])
+                value = buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+                return value
+
+            yield line(self.AUDIT_COLUMNS)
+            for verdict in verdicts:
+                yield line([verdict[c] for c in self.AUDIT_COLUMNS])
+        else:
+            raise ValueError('format should be jsonl or csv')
+
+    def iter_catalog_audit(
+        self,
+        catalog_id,
+        limit=None,
+        processes=4,
+        page_size=500,
+        chunk_size=100,
+        threads_per_process=16,
+        cache_path=None
+    ):
+        """
+            Check the products of a whole catalog, or of its first `limit`
+            products, and yield a verdict dict per product as soon as it is
+            checked, with the keys of `AUDIT_COLUMNS`.
+
+            Products are read `page_size` at a time and sent in chunks of
+            `chunk_size` to a pool of `processes` processes, each probing
+            images on `threads_per_process` threads. At most two chunks per
+            process are in flight, so memory stays flat however big the
+            catalog is. `cache_path` is the file of an `ImageSizeCache`
+            shared by the processes, each with its own connection, whose
+            least recently used entries are evicted at the end.
+
+            This forks processes, so it is meant for scripts, such as this
+            file run as one, rather than for web requests.
+        """
+        catalog = ProductCatalog(catalog_id)
+        fields = [
+            'id',
+            'additional_image_urls',
+            'image_url',
+            'url'
+        ]
+        products = catalog.get_products(fields, params={'limit': page_size})
+        if limit:
+            products = itertools.islice(products, limit)
+
+        max_chunks = 2 * processes
+        slots = threading.Semaphore(max_chunks)
+        state = dict()
+
+        def chunks():
+            for batch in generate_batches(products, chunk_size):
+                slots.acquire()
+                if state.get('closed'):
+                    return
+                # send plain dicts to the processes
+                yield [
+                    dict((field, product.get(field)) for field in fields)
+                    for product in batch
+                ]
+
+        pool = multiprocessing.Pool(
+            processes,
+            init_audit_process,
+            (cache_path, threads_per_process),
+        )
+        try:
+            for verdicts in pool.imap_unordered(audit_products, chunks()):
+                slots.release()
+                for verdict in verdicts:
+                    yield verdict
+            if cache_path:
+                evict_image_sizes(cache_path)
+        finally:
+            # unblock the chunk feeder so that the pool can shut down
+            state['closed'] = True
+            for i in range(max_chunks + 1):
+                slots.release()
+            pool.terminate()
+            pool.join()
+
     def extract_from_safe_img(self, image_url):
         """
             Get the original image url from the "safe image url" returned by
             API.
         """
         parsed = urlparse.urlparse(image_url)
-        url = urlparse.parse_qs(parsed.query)['url']
+        url = urlparse.parse_qs(parsed.query).get('url')
         if url is not None:
             return url[0]
         else:
@@ -136,28 +529,137 @@ class DPAImageCheckSample:
         """
             Check whether the dimension of an image is 600px or more.
         """
+        (width, height) = self.get_image_size(image_url)
+
+        if width >= 600 and height >= 600:
+            return True
+        return False
+
+    def get_image_size(
+        self,
+        image_url
+    ):
+        """
+            Return the `(width, height)` of an image, or `(0, 0)` if it can
+            not be read.
+
+            With a `cache`, sizes checked less than `cache.ttl` seconds ago
+            are returned without any request, and older ones are
+            revalidated with a conditional request that returns no data if
+            the image has not changed. Cache errors, such as a database
+            locked for too long, are not fatal: a failed read is a miss
+            and a failed write is skipped.
+        """
+        if self.cache is None:
+            return self.probe_image_size(image_url)[0]
+
+        key = self.normalize_image_url(image_url)
+        try:
+            cached = self.cache.get(key)
+        except sqlite3.Error as e:
+            logger.warning("Image size cache read failed: %s", e)
+            cached = None
+        validators = {}
+        if cached is not None:
+            if cached['fresh']:
+                return cached['size']
+            if cached['etag']:
+                validators['If-None-Match'] = cached['etag']
+            if cached['last_modified']:
+                validators['If-Modified-Since'] = cached['last_modified']
+
+        size, headers = self.probe_image_size(image_url, validators)
+        try:
+            if size is None:
+                # not modified since it was cached
+                self.cache.touch(key)
+            elif size != (0, 0):
+                self.cache.put(
+                    key,
+                    size,
+                    headers.get('ETag'),
+                    headers.get('Last-Modified'),
+                )
+        except sqlite3.Error as e:
+            logger.warning("Image size cache write failed: %s", e)
+        if size is None:
+            return cached['size']
+        return size
+
+    def normalize_image_url(self, image_url):
+        """
+            Key of an image in the cache: its original url, without
+            fragment and with a lower case scheme and host.
+        """
+        parsed = urlparse.urlsplit(self.extract_from_safe_img(image_url))
+        return urlparse.urlunsplit((
+            parsed.scheme.lower(),
+            parsed.netloc.lower(),
+            parsed.path,
+            parsed.query,
+            '',
+        ))
+
+    def probe_image_size(
+        self,
+        image_url,
+        validators=None
+    ):
+        """
+            Read the header of an image and return its `(width, height)`,
+            or `(0, 0)` if it can not be read, along with the headers of the
+            first response. The size is None if `validators` are given and
+            the server answers that the image has not been modified.
+        """
         # This method reads in the whole image
         # img_resp = requests.get(image_url)
         # im = Image.open(BytesIO(img_resp.content))
         # width, height = im.size
 
-        # This method reads in only usuallly 1k of data per image
-        file = urllib.urlopen(image_url)
-        (width, height) = (0, 0)
+        # This method reads in only usuallly 1k of data per image: it asks
+        # for the first RANGE_SIZE bytes, and for the rest of the image only
+        # if the header is not in them.
         p = ImageFile.Parser()
-        while 1:
-            data = file.read(1024)
-            if not data:
-                break
-            p.feed(data)
-            if p.image:
-                (width, height) = p.image.size
-                break
-        file.close()
-
-        if width >= 600 and height >= 600:
-            return True
-        return False
+        first_headers = {}
+        try:
+            for byte_range in (
+                'bytes=0-%d' % (self.RANGE_SIZE - 1),
+                'bytes=%d-' % self.RANGE_SIZE,
+            ):
+                headers = {'Range': byte_range}
+                if not first_headers and validators:
+                    headers.update(validators)
+                response = self.session.get(
+                    image_url,
+                    headers=headers,
+                    stream=True,
+                )
+                try:
+                    if not first_headers:
+                        first_headers = response.headers
+                    if response.status_code == 304:
+                        return None, first_headers
+                    if response.status_code == 200:
+                        # the server ignored the range and sends it all
+                        p = ImageFile.Parser()
+                    elif response.status_code != 206:
+                        break
+                    for data in response.iter_content(1024):
+                        p.feed(data)
+                        if p.image:
+                            if response.status_code == 206:
+                                # read the end of the range so that the
+                                # connection can be kept alive
+                                for data in response.iter_content(1024):
+                                    pass
+                            return p.image.size, first_headers
+                    if response.status_code == 200:
+                        break
+                finally:
+                    response.close()
+        except (requests.RequestException, IOError):
+            pass
+        return (0, 0), first_headers
 
     def get_businesses(self):
         """
@@ -177,3 +679,134 @@ class DPAImageCheckSample:
         business = Business(business_id)
         catalogs = business.get_product_catalogs()
         return catalogs
+
+
+# the sample of an audit process, created by `init_audit_process`
+audit_sample = None
+
+
+def init_audit_process(cache_path, threads):
+    """
+        Set up a process of `iter_catalog_audit` with its own sample, image
+        size cache and threads, as none of them survive a fork.
+    """
+    global audit_sample
+    cache = ImageSizeCache(cache_path) if cache_path else None
+    audit_sample = DPAImageCheckSample(connections_per_host=threads,
+                                       cache=cache)
+    audit_sample.executor = BoundedExecutor(
+        max_workers=threads,
+        name='product_image_audit',
+    )
+
+
+def audit_products(products):
+    """
+        Check a chunk of products in an audit process and return their
+        verdicts.
+    """
+    verdicts = []
+    for product, image_ok, additional_image_ok in \
+            audit_sample.executor.map_unordered(
+                audit_sample.check_product,
+                products,
+            ):
+        verdicts.append({
+            'id': product['id'],
+            'url': product['url'],
+            'image_url': product['image_url'],
+            'image_ok': image_ok,
+            'additional_image_ok': additional_image_ok,
+        })
+    if audit_sample.cache is not None:
+        try:
+            audit_sample.cache.flush()
+        except sqlite3.Error as e:
+            logger.warning("Image size cache write failed: %s", e)
+    return verdicts
+
+
+def evict_image_sizes(cache_path):
+    """
+        Evict the least recently used entries of the `ImageSizeCache` at
+        `cache_path`, if it can be written.
+    """
+    cache = ImageSizeCache(cache_path)
+    try:
+        cache.evict()
+    except sqlite3.Error as e:
+        logger.warning("Image size cache eviction failed: %s", e)
+    finally:
+        cache.close()
+
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+    from facebookads.api import FacebookAdsApi
+
+    parser = argparse.ArgumentParser(
+        description='Check the image sizes of every product of a catalog '
+                    'and write one verdict per product. The access token '
+                    'is read from the FB_ACCESS_TOKEN environment variable.',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        '-o', dest='output_path',
+        help='write the verdicts to this file, created once the audit is '
+             'complete, instead of STDOUT',
+    )
+    parser.add_argument(
+        '-f', default='jsonl', dest='format', choices=['jsonl', 'csv'],
+        help='output format',
+    )
+    parser.add_argument(
+        '-n', type=int, dest='limit',
+        help='check only this number of products',
+    )
+    parser.add_argument(
+        '-p', type=int, default=4, dest='processes',
+        help='number of processes probing images',
+    )
+    parser.add_argument(
+        '--cache', dest='cache_path',
+        help='keep image sizes between runs in this SQLite file',
+    )
+    parser.add_argument(
+        'catalog_id',
+        help='the id of the product catalog to check',
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(stream=sys.stderr, level=logging.INFO)
+    FacebookAdsApi.init(access_token=os.environ['FB_ACCESS_TOKEN'])
+
+    sample = DPAImageCheckSample()
+    if args.output_path:
+        # write to a temporary file first, so that a complete file is never
+        # mistaken for a partial one
+        partial_path = args.output_path + '.part'
+        try:
+            with open(partial_path, 'wb') as output_file:
+                sample.audit_catalog(
+                    args.catalog_id,
+                    output_file,
+                    args.format,
+                    limit=args.limit,
+                    processes=args.processes,
+                    cache_path=args.cache_path,
+                )
+        except BaseException:
+            # never leave a partial file behind for a failed audit
+            os.remove(partial_path)
+            raise
+        os.rename(partial_path, args.output_path)
+    else:
+        sample.audit_catalog(
+            args.catalog_id,
+            sys.stdout,
+            args.format,
+            limit=args.limit,
+            processes=args.processes,
+            cache_path=args.cache_path,
+        )
@@ -36,11 +36,168 @@ This sample shows how to update individual products for Dynamic Product Ads.
 
 [1]: https://developers.facebook.com/docs/marketing-api/dynamic-product-ads/
 """
+from facebookads.api import FacebookAdsApi
+from facebookads.exceptions import FacebookRequestError
 from facebookads.objects import (
     AdUser,
     Business,
     ProductCatalog
 )
+import base64
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from utils import BoundedExecutor, generate_batches
+
+logger = logging.getLogger(__name__)
+
+
+def encode_retailer_id(retailer_id):
+    """
+        Return a retailer id as a UTF-8 encoded str, the form it is stored
+        and compared in. The API returns retailer ids as unicode, which
+        `str` can not encode unless they are ASCII.
+    """
+    if isinstance(retailer_id, unicode):
+        return retailer_id.encode('utf8')
+    return str(retailer_id)
+
+
+class ProductCatalogSnapshot:
+    """
+        The last known state of the products of catalogs, kept in a SQLite
+        file to skip the updates that would not change anything.
+
+        Each product is stored as one compact row: the first 8 bytes of
+        the SHA-1 of every field in `fields`, in order, so comparing a
+        product with the snapshot only needs its hashes. A field made of
+        zero bytes is unknown and always counts as changed.
+
+        Rows hold the values in the format they are written in, as the
+        params of `update_product_item_by_retailer_id`.
+    """
+
+    DIGEST_SIZE = 8
+    UNKNOWN_DIGEST = '\0' * DIGEST_SIZE
+
+    def __init__(self, path, fields):
+        self.fields = tuple(fields)
+        self.field_indexes = dict(
+            (field, index) for index, field in enumerate(self.fields)
+        )
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.text_factory = str
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS product_snapshots ('
+            'catalog_id TEXT, retailer_id TEXT, digests BLOB, '
+            'PRIMARY KEY (catalog_id, retailer_id))'
+        )
+        self.connection.commit()
+
+    def get_many(self, catalog_id, retailer_ids):
+        """
+            Return a dict of retailer id to the stored row of the products
+            in the snapshot.
+        """
+        rows = {}
+        with self.lock:
+            # stay below the SQLite limit of 999 query parameters
+            for batch in generate_batches(retailer_ids, 500):
+                query = (
+                    'SELECT retailer_id, digests FROM product_snapshots '
+                    'WHERE catalog_id = ? AND retailer_id IN (%s)' %
+                    ', '.join('?' * len(batch))
+                )
+                for retailer_id, digests in self.connection.execute(
+                    query,
+                    [catalog_id] + [encode_retailer_id(r) for r in batch],
+                ):
+                    rows[retailer_id] = str(digests)
+        return rows
+
+    def put_many(self, catalog_id, rows):
+        """
+            Store `(retailer_id, row)` tuples, replacing the previous rows.
+        """
+        with self.lock:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO product_snapshots VALUES (?, ?, ?)',
+                (
+                    (
+                        catalog_id,
+                        encode_retailer_id(retailer_id),
+                        sqlite3.Binary(row),
+                    )
+                    for retailer_id, row in rows
+                ),
+            )
+            self.connection.commit()
+
+    def digest(self, value):
+        return hashlib.sha1(
+            json.dumps(value, sort_keys=True)
+        ).digest()[:self.DIGEST_SIZE]
+
+    def get_row(self, product, fields=None):
+        """
+            Build the row of a product, such as returned by
+            `get_products_by_product_catalog_id`, from its `fields`, all of
+            them by default. The other fields are unknown.
+        """
+        if fields is None:
+            fields = self.fields
+        return ''.join(
+            self.digest(product[field])
+            if field in product and field in fields else self.UNKNOWN_DIGEST
+            for field in self.fields
+        )
+
+    def diff(self, row, params):
+        """
+            Return the fields of `params` which differ from the stored `row`,
+            or all of them if `row` is None. Fields missing from the
+            snapshot are always included.
+        """
+        changed = {}
+        for field, value in params.iteritems():
+            index = self.field_indexes.get(field)
+            if row is None or index is None:
+                changed[field] = value
+                continue
+            start = index * self.DIGEST_SIZE
+            stored = row[start:start + self.DIGEST_SIZE]
+            if stored != self.digest(value):
+                changed[field] = value
+        return changed
+
+    def merge(self, row, params):
+        """
+            Return `row` with the hashes of the fields of `params`.
+        """
+        digests = [
+            row[start:start + self.DIGEST_SIZE] if row is not None
+            else self.UNKNOWN_DIGEST
+            for start in range(
+                0,
+                len(self.fields) * self.DIGEST_SIZE,
+                self.DIGEST_SIZE,
+            )
+        ]
+        for field, value in params.iteritems():
+            index = self.field_indexes.get(field)
+            if index is not None:
+                digests[index] = self.digest(value)
+        return ''.join(digests)
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
 
 
 class ProductUpdateSample:
@@ -53,8 +210,70 @@ class ProductUpdateSample:
         For example
 
         params={'availability': Product.Availability.out_of_stock}
+
+        To update many products, `update_product_items_by_retailer_id`
+        sends the updates in batch requests, several at a time.
+
+        To keep a catalog in sync with a feed, `sync_product_items` only
+        sends the fields that changed since the last sync, using a
+        `ProductCatalogSnapshot`:
+
+        snapshot = ProductCatalogSnapshot(
+            'products.db',
+            ProductUpdateSample.SNAPSHOT_FIELDS,
+        )
+        sample.refresh_catalog_snapshot(catalog_id, snapshot)
+        results, stats = sample.sync_product_items(catalog_id, items, snapshot)
     """
 
+    PRODUCT_FIELDS = [
+        'availability',
+        'brand',
+        'category',
+        'condition',
+        'description',
+        'id',
+        'image_url',
+        'name',
+        'price',
+        'retailer_id',
+        'url'
+    ]
+
+    # fields compared by `sync_product_items`
+    SNAPSHOT_FIELDS = [
+        field for field in PRODUCT_FIELDS if field not in ('id', 'retailer_id')
+    ] + ['currency']
+
+    # fields read back in the format they are written in, the only ones
+    # `refresh_catalog_snapshot` can store: prices are read as formatted
+    # strings like "$10.00" and image urls as safe image urls
+    READ_AS_WRITTEN_FIELDS = [
+        'availability',
+        'brand',
+        'category',
+        'condition',
+        'description',
+        'name',
+        'url',
+    ]
+
+    # fields which are sent together when any of them changed
+    SENT_TOGETHER_FIELDS = [
+        ('price', 'currency'),
+    ]
+
+    # number of feed items whose updates are sent before their rows are
+    # written to the snapshot
+    SYNC_CHUNK_SIZE = 1000
+
+    # maximum number of requests in a Graph API batch request
+    BATCH_SIZE_LIMIT = 50
+
+    # worker threads shared by every instance, which caps the number of
+    # batch requests in flight across all callers
+    executor = BoundedExecutor(max_workers=8, name='product_update')
+
     def update_product_item_by_retailer_id(
         self,
         catalog_id,
@@ -71,6 +290,225 @@ class ProductUpdateSample:
         )
         return result
 
+    def update_product_items_by_retailer_id(
+        self,
+        catalog_id,
+        items,
+        batch_size=BATCH_SIZE_LIMIT,
+        max_retries=2,
+        api=None
+    ):
+        """
+            Update many product items of a catalog with batch requests.
+
+            `items` is an iterable of `(retailer_id, params)` tuples, where
+            `params` is the same dict as for
+            `update_product_item_by_retailer_id`. It is read lazily and
+            packed into batch requests of `batch_size` updates, which are
+            sent concurrently on the shared `executor`. Updates that fail
+            with a transient error, or get no response, are retried up to
+            `max_retries` times with an exponential backoff; the others are
+            not sent again. A batch request failing as a whole, e.g. on a
+            network error, only retries its own updates.
+
+            Returns a tuple of
+            * a dict of retailer id to `{'status': 1}` on success or
+              `{'status': 0, 'message': '<error message>'}` on failure
+            * a dict with the number of `items`, the `elapsed` seconds and
+              the `items_per_sec` throughput
+        """
+        if not api:
+            # keep a copy of the Ads API session as we're going to be using
+            # it across new threads
+            api = FacebookAdsApi.get_default_api()
+
+        start_time = time.time()
+        results = {}
+        pending = items
+        for attempt in range(max_retries + 1):
+            retry = []
+            for failed in self.executor.map_unordered(
+                lambda batch: self.execute_update_batch(
+                    api,
+                    catalog_id,
+                    batch,
+                    results,
+                ),
+                generate_batches(pending, batch_size),
+            ):
+                retry.extend(failed)
+
+            if not retry or attempt == max_retries:
+                break
+            logger.info("Retrying %s failed product updates", len(retry))
+            pending = retry
+            time.sleep(2 ** attempt)
+
+        elapsed = time.time() - start_time
+        stats = {
+            'items': len(results),
+            'elapsed': elapsed,
+            'items_per_sec': len(results) / elapsed if elapsed > 0 else None,
+        }
+        return results, stats
+
+    def execute_update_batch(
+        self,
+        api,
+        catalog_id,
+        batch,
+        results
+    ):
+        """
+            Send one batch request updating the `(retailer_id, params)`
+            items of `batch`, record the status of every item in `results`
+            and return the items worth retrying.
+        """
+        api_batch = api.new_batch()
+        retry = []
+
+        def callback_success(item):
+            def callback(response):
+                results[item[0]] = {'status': 1}
+            return callback
+
+        def callback_failure(item):
+            def callback(response):
+                error = response.error()
+                results[item[0]] = {
+                    'status': 0,
+                    'message': error.api_error_message(),
+                }
+                if error.api_transient_error():
+                    retry.append(item)
+            return callback
+
+        for item in batch:
+            retailer_id, params = item
+            # the product node of a retailer id, as used by
+            # ProductCatalog.update_product, with the UTF-8 bytes of the id
+            node_id = 'catalog:%s:%s' % (
+                catalog_id,
+                base64.urlsafe_b64encode(encode_retailer_id(retailer_id)),
+            )
+            results.pop(item[0], None)
+            api_batch.add(
+                FacebookAdsApi.HTTP_METHOD_POST,
+                (node_id, ),
+                params=params,
+                success=callback_success(item),
+                failure=callback_failure(item),
+            )
+
+        message = 'No response'
+        try:
+            api_batch.execute()
+        except (FacebookRequestError, IOError, ValueError) as e:
+            # network errors, server errors or a response that is not JSON
+            logger.warning("Product update batch failed: %s", e)
+            message = str(e)
+
+        # items of a batch that failed as a whole have no result
+        for item in batch:
+            if item[0] not in results:
+                results[item[0]] = {'status': 0, 'message': message}
+                retry.append(item)
+
+        return retry
+
+    def refresh_catalog_snapshot(self, catalog_id, snapshot):
+        """
+            Store the current state of every product of the catalog in the
+            snapshot, for the `READ_AS_WRITTEN_FIELDS` only. Returns the
+            number of products.
+        """
+        count = 0
+        products = self.get_products_by_product_catalog_id(catalog_id)
+        for batch in generate_batches(products, 1000):
+            snapshot.put_many(
+                catalog_id,
+                (
+                    (
+                        product['retailer_id'],
+                        snapshot.get_row(product, self.READ_AS_WRITTEN_FIELDS),
+                    )
+                    for product in batch
+                ),
+            )
+            count += len(batch)
+        return count
+
+    def sync_product_items(
+        self,
+        catalog_id,
+        items,
+        snapshot,
+        **kwargs
+    ):
+        """
+            Update the product items of a catalog from a feed of
+            `(retailer_id, params)` tuples, sending only the fields that
+            differ from the snapshot. Products that are not in the snapshot
+            get all their fields.
+
+            The feed is read `SYNC_CHUNK_SIZE` items at a time. The updates
+            of a chunk are sent, then the snapshot is updated for the
+            successful ones only, so the failed ones are sent again on the
+            next sync. Other keyword arguments are passed to
+            `update_product_items_by_retailer_id`.
+
+            Returns the per product results of the sent updates and a dict
+            of stats with the number of `items` in the feed and how many
+            were `unchanged`, `updated` or `failed`.
+        """
+        stats = {'items': 0, 'unchanged': 0, 'elapsed': 0}
+        results = {}
+
+        for chunk in generate_batches(items, self.SYNC_CHUNK_SIZE):
+            rows = snapshot.get_many(
+                catalog_id,
+                [retailer_id for retailer_id, params in chunk],
+            )
+            changes = []
+            new_rows = {}
+            for retailer_id, params in chunk:
+                stats['items'] += 1
+                row = rows.get(encode_retailer_id(retailer_id))
+                changed = snapshot.diff(row, params)
+                if not changed:
+                    stats['unchanged'] += 1
+                    continue
+                for fields in self.SENT_TOGETHER_FIELDS:
+                    if any(field in changed for field in fields):
+                        for field in fields:
+                            if field in params:
+                                changed[field] = params[field]
+                new_rows[retailer_id] = snapshot.merge(row, changed)
+                changes.append((retailer_id, changed))
+
+            if not changes:
+                continue
+            chunk_results, update_stats = \
+                self.update_product_items_by_retailer_id(
+                    catalog_id,
+                    changes,
+                    **kwargs
+                )
+            snapshot.put_many(
+                catalog_id,
+                (
+                    (retailer_id, new_rows[retailer_id])
+                    for retailer_id, result in chunk_results.iteritems()
+                    if result['status']
+                ),
+            )
+            results.update(chunk_results)
+            stats['elapsed'] += update_stats['elapsed']
+
+        stats['updated'] = sum(r['status'] for r in results.itervalues())
+        stats['failed'] = len(results) - stats['updated']
+        return results, stats
+
     def get_businesses(self):
         """
             Retrieves business account of the user's ad accounts.
@@ -98,18 +536,5 @@ class ProductUpdateSample:
             Retrieves products that belong to the specified product feed.
         """
         catalog = ProductCatalog(product_catalog_id)
-        fields = [
-            'availability',
-            'brand',
-            'category',
-            'condition',
-            'description',
-            'id',
-            'image_url',
-            'name',
-            'price',
-            'retailer_id',
-            'url'
-        ]
-        result = catalog.get_products(fields, params)
+        result = catalog.get_products(self.PRODUCT_FIELDS, params)
         return result
@@ -0,0 +1,295 @@
+# Copyright (c) 2016-present, Facebook, Inc. All rights reserved.
+#
+# You are hereby granted a non-exclusive, worldwide, royalty-free license to
+# use, copy, modify, and distribute this software in source code or binary
+# form for use in connection with the web services and APIs provided by
+# Facebook.
+#
+# As with any software that integrates with the Facebook platform, your use of
+# this software is subject to the Facebook Developer Principles and Policies
+# [http://developers.facebook.com/policy/]. This copyright notice shall be
+# included in all copies or substantial portions of the software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+# Reach Estimate Cache
+
+## Estimating the reach of each targeting spec once
+
+***
+
+The reach estimate samples call the ad account reach estimate edge every
+time they need an audience size, although the same targeting spec keeps
+coming back: ad sets sharing their targeting, or the same form submitted
+again. Every call counts against the rate limit of the ad account.
+
+`ReachEstimateCache` keeps the estimates for `ttl` seconds, keyed by access
+token, ad account, targeting spec, optimization goal and currency. Keying
+by access token means a user is only ever served estimates fetched with
+their own token, for accounts they can read; only a hash of the token is
+kept. The targeting spec is serialized as canonical JSON, with sorted keys
+and sorted lists, so specs that only differ in the order of their keys or
+of the values of a list, such as countries, share an entry. Estimates the
+API has not finished computing, with `estimate_ready` false, are not
+cached. The most recently used estimates are kept in memory, in front of an
+optional SQLite file shared between processes, and callers asking for an
+estimate which is being fetched wait for it instead of fetching it again.
+
+## References:
+
+* [Reach estimate][1]
+
+[1]: https://developers.facebook.com/docs/marketing-api/reachestimate
+"""
+from facebookads.api import FacebookAdsApi
+from facebookads.objects import AdAccount
+from collections import OrderedDict
+import copy
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+
+class ReachEstimateCache:
+    """
+        Reach estimates kept in an in-process LRU of `max_entries`, and in
+        the SQLite file at `path` if one is given. Estimates older than
+        `ttl` seconds are fetched again.
+
+        For example
+
+        estimate = cache.get_reach_estimate(
+            account_id,
+            targeting_spec,
+            'IMPRESSIONS',
+        )
+    """
+
+    def __init__(self, path=None, ttl=3600, max_entries=1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        # events of the estimates being fetched, by key
+        self.pending = {}
+        self.connection = None
+        if path:
+            self.connection = sqlite3.connect(path, check_same_thread=False)
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute('PRAGMA synchronous=NORMAL')
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS reach_estimates ('
+                'key TEXT PRIMARY KEY, estimate TEXT, estimated_at REAL)'
+            )
+            self.connection.commit()
+        self.hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+
+    def get_key(
+        self,
+        account_id,
+        targeting_spec,
+        optimize_for,
+        currency,
+        api=None,
+    ):
+        if not api:
+            api = FacebookAdsApi.get_default_api()
+        # the SDK has no public accessor for the token of a session
+        access_token = api._session.access_token or ''
+        account_id = str(account_id)
+        if not account_id.startswith('act_'):
+            account_id = 'act_' + account_id
+        return json.dumps(
+            [
+                hashlib.sha256(access_token.encode('utf-8')).hexdigest(),
+                account_id,
+                self.canonicalize(targeting_spec),
+                optimize_for,
+                currency,
+            ],
+            sort_keys=True,
+            separators=(',', ':'),
+        )
+
+    def canonicalize(self, value):
+        """
+            Return `value` with the items of its lists sorted, recursively.
+            The lists of a targeting spec are sets of values.
+        """
+        if isinstance(value, dict):
+            return dict(
+                (key, self.canonicalize(item))
+                for key, item in value.iteritems()
+            )
+        if isinstance(value, (list, tuple)):
+            return sorted(
+                (self.canonicalize(item) for item in value),
+                key=lambda item: json.dumps(item, sort_keys=True),
+            )
+        return value
+
+    def get_reach_estimate(
+        self,
+        account_id,
+        targeting_spec,
+        optimize_for,
+        currency='USD',
+        api=None
+    ):
+        """
+            Return the reach estimate of the targeting spec in the account,
+            as a dict, fetching it unless it is in the cache. Return None
+            if the API returned no estimate.
+        """
+        if not api:
+            api = FacebookAdsApi.get_default_api()
+
+        def estimate():
+            account = AdAccount(account_id, api=api)
+            params = {
+                'currency': currency,
+                'optimize_for': optimize_for,
+                'targeting_spec': targeting_spec,
+            }
+            reachestimate = account.get_reach_estimate(params=params).get_one()
+            if reachestimate is None:
+                return None
+            return reachestimate.export_all_data()
+
+        return self.get_or_fetch(
+            self.get_key(
+                account_id,
+                targeting_spec,
+                optimize_for,
+                currency,
+                api,
+            ),
+            estimate,
+        )
+
+    def get_or_fetch(self, key, fetch):
+        """
+            Return a copy of the estimate of `key`, calling `fetch` for it
+            on a miss. Only one caller fetches a given key at a time, the
+            others wait for its estimate. Failed fetches, None and estimates
+            which are not ready yet are not cached.
+        """
+        while True:
+            with self.lock:
+                estimate = self.lookup(key)
+                if estimate is not None:
+                    self.hits += 1
+                    return copy.deepcopy(estimate)
+                event = self.pending.get(key)
+                if event is None:
+                    event = self.pending[key] = threading.Event()
+                    self.misses += 1
+                    break
+            event.wait()
+
+        try:
+            estimate = fetch()
+            if estimate is not None and \
+                    estimate.get('estimate_ready', True):
+                self.put(key, estimate)
+            return copy.deepcopy(estimate)
+        finally:
+            with self.lock:
+                del self.pending[key]
+            event.set()
+
+    def get(self, key):
+        """
+            Return a copy of the cached estimate of `key`, or None.
+        """
+        with self.lock:
+            estimate = self.lookup(key)
+            if estimate is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return copy.deepcopy(estimate)
+
+    def lookup(self, key):
+        # called with the lock held
+        now = time.time()
+        entry = self.entries.pop(key, None)
+        if entry is not None and entry[0] > now - self.ttl:
+            # most recently used last
+            self.entries[key] = entry
+            return entry[1]
+
+        if self.connection is None:
+            return None
+        row = self.connection.execute(
+            'SELECT estimate, estimated_at FROM reach_estimates '
+            'WHERE key = ? AND estimated_at > ?',
+            (key, now - self.ttl),
+        ).fetchone()
+        if row is None:
+            return None
+        self.persistent_hits += 1
+        estimate = json.loads(row[0])
+        self.remember(key, row[1], estimate)
+        return estimate
+
+    def put(self, key, estimate):
+        now = time.time()
+        # the caller may change its estimate afterwards
+        estimate = copy.deepcopy(estimate)
+        with self.lock:
+            self.remember(key, now, estimate)
+            if self.connection is not None:
+                self.connection.execute(
+                    'INSERT OR REPLACE INTO reach_estimates VALUES (?, ?, ?)',
+                    (key, json.dumps(estimate), now),
+                )
+                self.connection.commit()
+
+    def remember(self, key, estimated_at, estimate):
+        # called with the lock held
+        self.entries.pop(key, None)
+        self.entries[key] = (estimated_at, estimate)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def get_stats(self):
+        """
+            Return the number of `hits`, of which `persistent_hits` were
+            read from the SQLite file, `misses` and in-memory `entries`.
+        """
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'persistent_hits': self.persistent_hits,
+                'misses': self.misses,
+                'entries': len(self.entries),
+            }
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            if self.connection is not None:
+                self.connection.execute('DELETE FROM reach_estimates')
+                self.connection.commit()
+
+    def close(self):
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+
+# shared by the samples
+default_cache = ReachEstimateCache()
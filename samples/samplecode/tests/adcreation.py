@@ -61,6 +61,55 @@ class AdCreationTestCase(SampleTestCase):
         self.assertTrue(len(ads_created) > 0)
         self.campaign = campaign
 
+    def test_dry_run(self):
+        result = self.sample.launch_link_clicks_ads(
+            self.account_id,
+            self.page_id,
+            "sample_test",
+            ["title1", "title2"],
+            ["body1", ""],
+            ["http://www.gaishen.org", "http://www.example.com"],
+            self.images[:2],
+            self.basic_targeting,
+            AdSet.OptimizationGoal.link_clicks,
+            AdSet.BillingEvent.link_clicks,
+            100,    # bid
+            1000,   # daily budget
+            dry_run=True,
+        )
+        self.assertEqual(result['combinations'], 16)
+        # the combinations with an empty body
+        self.assertEqual(len(result['failures']), 8)
+        self.assertIsNone(result['campaign'])
+
+    def test_missing_image(self):
+        result = self.sample.launch_link_clicks_ads(
+            self.account_id,
+            self.page_id,
+            "sample_test",
+            ["title1"],
+            ["body1"],
+            ["http://www.gaishen.org"],
+            [self.images[0], '/nonexistent/image.png'],
+            self.basic_targeting,
+            AdSet.OptimizationGoal.link_clicks,
+            AdSet.BillingEvent.link_clicks,
+            100,    # bid
+            1000,   # daily budget
+        )
+        self.campaign = result['campaign']
+        # the other image still makes an ad
+        self.assertEqual(result['combinations'], 2)
+        self.assertEqual(len(result['ads']), 1)
+        self.assertEqual(
+            result['failures'],
+            [(
+                ("title1", "body1", "http://www.gaishen.org",
+                 '/nonexistent/image.png'),
+                'Missing image /nonexistent/image.png',
+            )],
+        )
+
     def tearDown(self):
         super(AdCreationTestCase, self).tearDown()
         if hasattr(self, 'campaign'):
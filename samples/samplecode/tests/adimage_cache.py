@@ -0,0 +1,47 @@
+# Copyright (c) 2016-present, Facebook, Inc. All rights reserved.
+#
+# You are hereby granted a non-exclusive, worldwide, royalty-free license to
+# use, copy, modify, and distribute this software in source code or binary
+# form for use in connection with the web services and APIs provided by
+# Facebook.
+#
+# As with any software that integrates with the Facebook platform, your use of
+# this software is subject to the Facebook Developer Principles and Policies
+# [http://developers.facebook.com/policy/]. This copyright notice shall be
+# included in all copies or substantial portions of the software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from samples.samplecode.tests.sampletestcase import SampleTestCase
+from samples.samplecode.adimage_cache import AdImageUploader
+import os
+import tempfile
+
+
+class AdImageUploaderTestCase(SampleTestCase):
+
+    def setUp(self):
+        super(AdImageUploaderTestCase, self).setUp()
+        self.uploader = AdImageUploader(
+            os.path.join(tempfile.mkdtemp(), 'adimage_cache.db'),
+        )
+
+    def test_normal(self):
+        image_paths = self.images[:2] + self.images[:1]
+        hashes = self.uploader.upload_ad_images(self.account_id, image_paths)
+        self.assertEqual(len(hashes), 3)
+        self.assertEqual(hashes[0], hashes[2])
+        self.assertEqual(self.uploader.cache.misses, 2)
+
+        # nothing is uploaded again
+        self.assertEqual(
+            self.uploader.upload_ad_images(self.account_id, image_paths),
+            hashes,
+        )
+        self.assertEqual(self.uploader.cache.hits, 2)
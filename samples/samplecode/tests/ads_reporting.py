@@ -0,0 +1,180 @@
+# Copyright (c) 2016-present, Facebook, Inc. All rights reserved.
+#
+# You are hereby granted a non-exclusive, worldwide, royalty-free license to
+# use, copy, modify, and distribute this software in source code or binary
+# form for use in connection with the web services and APIs provided by
+# Facebook.
+#
+# As with any software that integrates with the Facebook platform, your use of
+# this software is subject to the Facebook Developer Principles and Policies
+# [http://developers.facebook.com/policy/]. This copyright notice shall be
+# included in all copies or substantial portions of the software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from samples.samplecode.ads_reporting import (
+    AdsReportingSample,
+    AdsReportingJobManager,
+)
+from samples.samplecode.db_sink import SQLiteSink
+from samples.samplecode.insights_frame import InsightsFrame
+from samples.samplecode.tests.sampletestcase import SampleTestCase
+from datetime import date, timedelta
+import sqlite3
+
+
+class AdsReportingTestCase(SampleTestCase):
+
+    def setUp(self):
+        super(AdsReportingTestCase, self).setUp()
+        self.sample = AdsReportingSample()
+        self.report_date = (
+            date.today() - timedelta(days=1)
+        ).strftime('%Y-%m-%d')
+
+    def test_stream(self):
+        rows = list(self.sample.stream_ads_insight(
+            self.account_id,
+            self.report_date,
+            page_size=5,
+        ))
+
+        # the streamed report is never shorter than the capped one
+        capped = self.sample.get_ads_insight(
+            self.account_id,
+            self.report_date,
+        )
+        self.assertGreaterEqual(len(rows), len(capped))
+
+    def test_stream_rows(self):
+        # pages of known insights, as the test account may have none
+        pages = [
+            [
+                {'adset_id': '6034234313285', 'spend': '1.50'},
+                {'adset_id': '6034234313286', 'spend': '2.50'},
+            ],
+            [{'adset_id': '6034234313287', 'spend': '3.50'}],
+        ]
+        self.sample.get_insights_pages = \
+            lambda account_id, report_date, page_size, api: iter(pages)
+
+        rows = list(self.sample.stream_ads_insight(
+            self.account_id,
+            self.report_date,
+            page_size=2,
+        ))
+
+        # the streamed report has a header row followed by rows that all
+        # share the same schema
+        self.assertEqual(len(rows), 4)
+        columns = rows[0]
+        self.assertIn('adset_id', columns)
+        for row in rows[1:]:
+            self.assertEqual(len(row), len(columns))
+        self.assertListEqual(
+            [row[columns.index('adset_id')] for row in rows[1:]],
+            ['6034234313285', '6034234313286', '6034234313287'],
+        )
+
+    def test_jobs(self):
+        report_dates = [
+            (date.today() - timedelta(days=i)).strftime('%Y-%m-%d')
+            for i in range(1, 4)
+        ]
+        manager = AdsReportingJobManager(self.sample, max_jobs=2)
+
+        finished = []
+        num_rows = 0
+        for job, rows in manager.run([self.account_id], report_dates):
+            self.assertTrue(job.is_done())
+            # the rows after the header
+            num_rows += max(len(list(rows)) - 1, 0)
+            finished.append(job.report_date)
+
+        # every day was reported exactly once
+        self.assertItemsEqual(finished, report_dates)
+
+        stats = manager.get_stats()
+        self.assertEqual(stats['jobs'], len(report_dates))
+        self.assertEqual(stats['jobs_done'], len(report_dates))
+        self.assertEqual(stats['rows'], num_rows)
+
+    def test_row_projector(self):
+        sample = AdsReportingSample('1d_view')
+        insight = {
+            'campaign_name': "Spring's sale",
+            'adset_id': '6034234313285',
+            'website_clicks': '12',
+            'spend': '3.50',
+            'actions': [
+                {'action_type': 'link_click', '1d_view': '7'},
+                {'action_type': 'like', '1d_view': '1'},
+            ],
+            'action_values': [
+                {'action_type': 'offsite_conversion', '28d_click': '9'},
+            ],
+        }
+
+        projector = sample.get_row_projector()
+        self.assertIs(projector, sample.get_row_projector())
+
+        row = projector.project(insight, self.report_date)
+        self.assertEqual(len(row), len(projector.columns))
+        self.assertDictEqual(
+            dict(zip(projector.columns, row)),
+            sample.get_values(insight, self.report_date),
+        )
+
+    def test_frame(self):
+        insights = [
+            {
+                'campaign_name': 'Campaign %d' % (i % 2),
+                'impression_device': 'iphone',
+                'placement': 'mobile_feed',
+                'impressions': '1000',
+                'spend': '2.50',
+                'actions': [{'action_type': 'link_click', '28d_click': '5'}],
+            }
+            for i in range(4)
+        ]
+        frame = InsightsFrame.from_rows(
+            self.sample.get_insights_rows([insights], self.report_date),
+        )
+        self.assertEqual(frame.num_rows, 4)
+
+        rollup = frame.sum(['campaign', 'placement']).add_derived_metrics()
+        self.assertEqual(rollup.num_rows, 2)
+        self.assertListEqual(
+            list(rollup.get_column('campaign')),
+            ['Campaign 0', 'Campaign 1'],
+        )
+        self.assertListEqual(list(rollup.metrics['impressions']), [2000] * 2)
+        self.assertListEqual(list(rollup.metrics['cpm']), [2.5] * 2)
+        self.assertListEqual(list(rollup.metrics['cpc']), [0.5] * 2)
+
+    def test_sqlite_sink(self):
+        connection = sqlite3.connect(':memory:')
+        sink = self.sample.get_insights_sink(SQLiteSink, connection)
+        sink.batch_size = 2
+
+        insights = [
+            {'adset_id': '6034234313285', 'impression_device': 'iphone',
+             'placement': 'mobile_feed', 'spend': str(i)}
+            for i in range(5)
+        ]
+        rows = self.sample.get_insights_rows([insights], self.report_date)
+        next(rows)
+
+        # rows sharing a key are upserted into a single row
+        self.assertEqual(sink.write(rows), 5)
+        self.assertEqual(sink.get_stats()['rows'], 5)
+        self.assertListEqual(
+            connection.execute('SELECT spend FROM ads_insights').fetchall(),
+            [('4', )],
+        )
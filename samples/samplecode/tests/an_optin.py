@@ -106,6 +106,40 @@ class AudienceNetworkOptinTestCase(SampleTestCase):
                       "network flag for our sample ad set with id %s"
                       % SAMPLE_ADSET_ID)
 
+    def test_iter(self):
+        SAMPLE_ADSET_ID = "6035543090685"
+
+        streamed = self.sample.iter_eligible_adsets_for_an(
+            self.account_id,
+            True,
+        )
+        ids = [adset[AdSet.Field.id] for adset in streamed]
+
+        # the scanner yields the same ad sets the list version returns
+        self.assertIn(SAMPLE_ADSET_ID, ids)
+        self.assertEqual(
+            sorted(ids),
+            sorted(
+                adset[AdSet.Field.id]
+                for adset in self.sample.retrieve_eligible_adsets_for_an(
+                    self.account_id,
+                    True,
+                )
+            ),
+        )
+
+    def test_bulk(self):
+        SAMPLE_ADSET_ID = "6035543090685"
+
+        result, stats = self.sample.enable_an_on_adsets_bulk(
+            [SAMPLE_ADSET_ID],
+        )
+
+        # same format as enable_an_on_adsets, plus a throughput report
+        self.assertEqual(result, [{SAMPLE_ADSET_ID: {'status': 1}}])
+        self.assertEqual(stats['adsets'], 1)
+        self.assertGreaterEqual(stats['requests'], 1)
+
     def tearDown(self):
         if hasattr(self, 'campaign'):
             self.campaign.remote_delete()
@@ -119,7 +153,9 @@ class AudienceNetworkOptinTestCase(SampleTestCase):
 
         # edit targeting spec info for placements
         targetinginfo = copy.deepcopy(adsetobj[AdSet.Field.targeting])
-        targetinginfo[TargetingSpecsField.publisher_platforms].remove('audience_network')
+        platforms = targetinginfo[TargetingSpecsField.publisher_platforms]
+        if 'audience_network' in platforms:
+            platforms.remove('audience_network')
 
         # update ad set info
         adset.update({
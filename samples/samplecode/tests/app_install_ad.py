@@ -54,6 +54,11 @@ class AppInstallAdTestCase(SampleTestCase):
         self.assertIn('adset_id', result)
         self.assertIn('creative_id', result)
         self.assertIn('ad_id', result)
+        self.assertIn('total', result['timings'])
+        self.assertLessEqual(
+            result['timings']['image'],
+            result['timings']['total'],
+        )
 
         self.campaign = Campaign()
         self.campaign[Campaign.Field.id] = result['campaign_id']
@@ -20,8 +20,14 @@
 
 from facebookads.objects import CustomAudience
 from samples.samplecode.tests.sampletestcase import SampleTestCase
-from samples.samplecode.customaudience import CustomAudienceSample
+from samples.samplecode.customaudience import (
+    AudienceMembershipStore,
+    CustomAudienceSample,
+    hash_users,
+)
 import json
+import os
+import tempfile
 
 
 class CustomAudienceTestCase(SampleTestCase):
@@ -70,6 +76,170 @@ class CustomAudienceTestCase(SampleTestCase):
             "Failed to receive right number of data entries",
         )
 
+    def test_streaming(self):
+        self.caid = self.ca_sample.create_audience(
+            self.account_id,
+            "Testing custom audiences",  # ca name
+            "Custom audience from MUSE test",  # description
+            "https://www.facebookmarketingdevelopers.com",  # optout_link
+        )
+        progress = []
+        stats = self.ca_sample.upload_users_streaming(
+            self.caid,
+            iter(self.SAMPLE_EMAILS * 3),
+            batch_size=4,
+            progress=progress.append,
+        )
+        self.assertEqual(stats['batches'], 4)
+        self.assertEqual(stats['users'], len(self.SAMPLE_EMAILS) * 3)
+        self.assertEqual(stats['num_received'], stats['users'])
+        self.assertEqual(len(progress), stats['batches'])
+
+    def test_hashing(self):
+        emails = self.SAMPLE_EMAILS * 3
+        batches = list(self.ca_sample.iter_hashed_batches(
+            iter(emails),
+            batch_size=4,
+            processes=2,
+        ))
+        self.assertEqual(len(batches), 4)
+        self.assertEqual(
+            sum(batches, []),
+            hash_users(CustomAudience.Schema.email_hash, emails),
+        )
+
+    def test_pre_hashed_phone(self):
+        digest = hash_users(
+            CustomAudience.Schema.phone_hash,
+            ['+1 (650) 555-0100'],
+        )[0]
+
+        # a digest is only trimmed and lowercased, not normalized as a
+        # phone number
+        self.assertEqual(
+            hash_users(
+                CustomAudience.Schema.phone_hash,
+                [' %s\n' % digest.upper()],
+                pre_hashed=True,
+            ),
+            [digest],
+        )
+
+        self.caid = self.ca_sample.create_audience(
+            self.account_id,
+            "Testing custom audiences",  # ca name
+            "Custom audience from MUSE test",  # description
+            "https://www.facebookmarketingdevelopers.com",  # optout_link
+        )
+        stats = self.ca_sample.upload_users_streaming(
+            self.caid,
+            [digest],
+            CustomAudience.Schema.phone_hash,
+            pre_hashed=True,
+        )
+        self.assertEqual(stats['num_received'], 1)
+        self.assertEqual(stats['num_invalid_entries'], 0)
+
+    def test_uid_requires_app_ids(self):
+        with self.assertRaises(ValueError):
+            self.ca_sample.upload_users_streaming(
+                'unused',
+                ['1234'],
+                CustomAudience.Schema.uid,
+            )
+
+    def test_refresh(self):
+        self.caid = self.ca_sample.create_audience(
+            self.account_id,
+            "Testing custom audiences",  # ca name
+            "Custom audience from MUSE test",  # description
+            "https://www.facebookmarketingdevelopers.com",  # optout_link
+        )
+        store = AudienceMembershipStore(
+            os.path.join(tempfile.mkdtemp(), 'members.db'),
+        )
+        result = self.ca_sample.refresh_audience(
+            self.caid,
+            self.SAMPLE_EMAILS[:4],
+            store,
+        )
+        self.assertEqual(result['added']['users'], 4)
+        self.assertEqual(result['removed']['users'], 0)
+
+        # only the changes are sent
+        result = self.ca_sample.refresh_audience(
+            self.caid,
+            self.SAMPLE_EMAILS[1:],
+            store,
+        )
+        self.assertEqual(result['added']['users'], 1)
+        self.assertEqual(result['removed']['users'], 1)
+        self.assertEqual(result['members'], 4)
+        store.close()
+
+    def test_refresh_phones(self):
+        self.caid = self.ca_sample.create_audience(
+            self.account_id,
+            "Testing custom audiences",  # ca name
+            "Custom audience from MUSE test",  # description
+            "https://www.facebookmarketingdevelopers.com",  # optout_link
+        )
+        store = AudienceMembershipStore(
+            os.path.join(tempfile.mkdtemp(), 'members.db'),
+        )
+        phones = ['+1 (650) 555-01%02d' % i for i in range(4)]
+        result = self.ca_sample.refresh_audience(
+            self.caid,
+            phones[:3],
+            store,
+            schema=CustomAudience.Schema.phone_hash,
+        )
+        self.assertEqual(result['added']['users'], 3)
+        self.assertEqual(result['added']['num_invalid_entries'], 0)
+
+        # the digests of the phone numbers are stored and sent unchanged
+        self.assertItemsEqual(
+            [row[0] for row in store.connection.execute(
+                'SELECT hash FROM audience_members WHERE audience_id = ?',
+                (self.caid, ),
+            )],
+            hash_users(CustomAudience.Schema.phone_hash, phones[:3]),
+        )
+
+        result = self.ca_sample.refresh_audience(
+            self.caid,
+            phones[1:],
+            store,
+            schema=CustomAudience.Schema.phone_hash,
+        )
+        self.assertEqual(result['added']['users'], 1)
+        self.assertEqual(result['added']['num_invalid_entries'], 0)
+        self.assertEqual(result['removed']['users'], 1)
+        self.assertEqual(result['removed']['num_invalid_entries'], 0)
+        self.assertEqual(result['members'], 3)
+        store.close()
+
+    def test_remove_many(self):
+        self.caid = self.ca_sample.create_audience(
+            self.account_id,
+            "Testing custom audiences",  # ca name
+            "Custom audience from MUSE test",  # description
+            "https://www.facebookmarketingdevelopers.com",  # optout_link
+        )
+        store = AudienceMembershipStore(
+            os.path.join(tempfile.mkdtemp(), 'members.db'),
+        )
+        emails = ['user%d@example.com' % i for i in range(1500)]
+        self.ca_sample.refresh_audience(self.caid, emails, store)
+
+        # all of them are removed in one batch, too big for a URL
+        result = self.ca_sample.refresh_audience(self.caid, [], store)
+        self.assertEqual(result['removed']['batches'], 1)
+        self.assertEqual(result['removed']['users'], len(emails))
+        self.assertEqual(result['removed']['num_received'], len(emails))
+        self.assertEqual(result['members'], 0)
+        store.close()
+
     def tearDown(self):
         super(CustomAudienceTestCase, self).tearDown()
         if hasattr(self, 'caid'):
@@ -36,5 +36,17 @@ class InstagramAdsPotentialTestCase(SampleTestCase):
         )
         self.assertTrue(len(self.adsets) <= 5)
 
+    def test_sorted(self):
+        self.adsets = self.sample.get_ad_sets(
+            self.account_id,
+            True,
+            10  # limit
+        )
+        self.assertTrue(len(self.adsets) <= 10)
+
+        # the concurrent analysis keeps the most eligible ad sets first
+        eligibility = [adset['eligibility'] for adset in self.adsets]
+        self.assertEqual(eligibility, sorted(eligibility, reverse=True))
+
     def tearDown(self):
         pass
@@ -20,6 +20,7 @@
 
 from samples.samplecode.tests.sampletestcase import SampleTestCase
 from samples.samplecode.multiple_lal import MultipleLalSample
+from facebookads.exceptions import FacebookRequestError
 
 
 class MultipleLalTestCase(SampleTestCase):
@@ -38,6 +39,33 @@ class MultipleLalTestCase(SampleTestCase):
         )
         self.assertEqual(len(self.created_lals), 2)
 
+    def test_grid(self):
+        self.created_lals, failures = self.sample.create_lal_grid(
+            self.account_id,
+            self.ca_id,
+            "Multiple LAL Test",  # lookalike_name
+            ["US", "GB"],  # country
+            [1, 2, 3],  # ratio
+            batch_size=2,
+        )
+        self.assertEqual(failures, [])
+        self.assertEqual(len(self.created_lals), 6)
+        self.assertEqual(
+            self.created_lals[0]['name'],
+            "Multiple LAL Test US 1",
+        )
+
+    def test_invalid_ratio(self):
+        # a ratio above 20% is rejected, and not retried
+        with self.assertRaises(FacebookRequestError):
+            self.sample.create_lals(
+                self.account_id,
+                self.ca_id,
+                "Multiple LAL Test",  # lookalike_name
+                ["US"],  # country
+                [50],  # ratio
+            )
+
     def tearDown(self):
         super(MultipleLalTestCase, self).tearDown()
         if hasattr(self, 'created_lals'):
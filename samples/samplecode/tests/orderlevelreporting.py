@@ -18,7 +18,10 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-from samples.samplecode.orderlevelreporting import OrderLevelReportingSample
+from samples.samplecode.orderlevelreporting import (
+    OrderLevelReportCheckpoint,
+    OrderLevelReportingSample,
+)
 from samples.samplecode.tests.sampletestcase import SampleTestCase
 from datetime import date, timedelta
 
@@ -43,3 +46,64 @@ class OrderLevelReportingTestCase(SampleTestCase):
 
         # enumerate and make sure that we don't throw any errors
         self.assertListEqual(list(generator), [])
+
+    def test_adaptive(self):
+        # get generator
+        generator = self.sample.retrieve_order_level_report_data_adaptive(
+            from_date=date.today() - timedelta(days=8),
+            to_date=date.today() - timedelta(days=7),
+            business_id=self.TEST_BUSINESS,
+            app_id='743337925789686',
+            workers=3,
+            max_pages=1,
+        )
+
+        # enumerate and make sure that we don't throw any errors
+        self.assertListEqual(list(generator), [])
+
+    def test_unordered(self):
+        # get generator
+        generator = self.sample.retrieve_order_level_report_data_parallel(
+            from_date=date.today() - timedelta(days=8),
+            to_date=date.today() - timedelta(days=7),
+            business_id=self.TEST_BUSINESS,
+            app_id='743337925789686',
+            splits=3,
+            ordered=False,
+        )
+
+        # enumerate and make sure that we don't throw any errors
+        self.assertListEqual(list(generator), [])
+
+        # every partition ran on the shared executor
+        stats = self.sample.executor.get_stats()
+        self.assertGreaterEqual(
+            sum(worker['tasks'] for worker in stats['workers']),
+            3,
+        )
+        # the consumer got the end of every partition
+        self.assertGreaterEqual(stats['gets'], 3)
+
+    def test_resume(self):
+        checkpoint = OrderLevelReportCheckpoint(':memory:')
+        args = dict(
+            from_date=date.today() - timedelta(days=8),
+            to_date=date.today() - timedelta(days=7),
+            business_id=self.TEST_BUSINESS,
+            app_id='743337925789686',
+            splits=3,
+            checkpoint=checkpoint,
+        )
+
+        generator = self.sample.retrieve_order_level_report_data_parallel(
+            **args
+        )
+        self.assertListEqual(list(generator), [])
+
+        # every partition is complete, so a second run fetches nothing
+        generator = self.sample.retrieve_order_level_report_data_parallel(
+            **args
+        )
+        self.assertListEqual(list(generator), [])
+        stats = self.sample.executor.get_stats()
+        self.assertEqual(stats['pending'], 0)
@@ -18,8 +18,13 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-from samples.samplecode.product_image_check import DPAImageCheckSample
+from samples.samplecode.product_image_check import (
+    DPAImageCheckSample,
+    ImageSizeCache,
+)
 from samples.samplecode.tests.sampletestcase import SampleTestCase
+import json
+import StringIO
 
 
 class ProductImageCheckTestCase(SampleTestCase):
@@ -54,3 +59,49 @@ class ProductImageCheckTestCase(SampleTestCase):
         self.assertEqual(check_result[0], 5)
         self.assertEqual(check_result[1], 2)
         self.assertEqual(check_result[2], 0)
+
+    def test_streaming(self):
+        # every product is yielded once, in whatever order it completes
+        checks = list(self.sample.iter_product_image_checks(
+            self.TEST_CATALOG,
+            5
+        ))
+        self.assertEqual(len(checks), 5)
+        self.assertEqual(len([c for c in checks if c[1]]), 2)
+
+    def test_cache(self):
+        cache = ImageSizeCache(':memory:')
+        sample = DPAImageCheckSample(cache=cache)
+
+        # the second check is answered from the cache
+        first_result = sample.check_product_images(self.TEST_CATALOG, 5)
+        misses = cache.misses
+        second_result = sample.check_product_images(self.TEST_CATALOG, 5)
+        self.assertEqual(first_result[:3], second_result[:3])
+        self.assertEqual(cache.misses, misses)
+        self.assertGreater(cache.hits, 0)
+
+    def test_cache_errors(self):
+        # a cache that can not be used is the same as no cache
+        cache = ImageSizeCache(':memory:')
+        cache.close()
+        sample = DPAImageCheckSample(cache=cache)
+        check_result = sample.check_product_images(self.TEST_CATALOG, 5)
+        self.assertEqual(check_result[0], 5)
+        self.assertEqual(check_result[1], 2)
+
+    def test_audit(self):
+        output = StringIO.StringIO()
+        audit_result = self.sample.audit_catalog(
+            self.TEST_CATALOG,
+            output,
+            limit=5,
+            processes=2,
+        )
+        self.assertEqual(audit_result[0], 5)
+        self.assertEqual(audit_result[1], 2)
+
+        # one JSON verdict per product
+        verdicts = [json.loads(l) for l in output.getvalue().splitlines()]
+        self.assertEqual(len(verdicts), 5)
+        self.assertEqual(len([v for v in verdicts if v['image_ok']]), 2)
@@ -18,9 +18,14 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-from samples.samplecode.product_update import ProductUpdateSample
+from samples.samplecode.product_update import (
+    ProductCatalogSnapshot,
+    ProductUpdateSample,
+)
 from samples.samplecode.tests.sampletestcase import SampleTestCase
 from facebookads.objects import Product
+import os
+import tempfile
 
 
 class ProductUpdateTestCase(SampleTestCase):
@@ -67,3 +72,113 @@ class ProductUpdateTestCase(SampleTestCase):
             }
         )
         self.assertTrue(result.json())
+
+    def test_batch(self):
+        results, stats = self.sample.update_product_items_by_retailer_id(
+            self.TEST_CATALOG,
+            [
+                (
+                    self.TEST_RETAILER,
+                    {"availability": Product.Availability.in_stock},
+                ),
+            ],
+        )
+        self.assertEqual(results[self.TEST_RETAILER]['status'], 1)
+        self.assertEqual(stats['items'], 1)
+
+    def test_batch_unicode(self):
+        # a product that does not exist fails on its own, whatever its id
+        retailer_id = u'caf\xe9-does-not-exist'
+        results, stats = self.sample.update_product_items_by_retailer_id(
+            self.TEST_CATALOG,
+            [
+                (retailer_id, {"availability": Product.Availability.in_stock}),
+                (
+                    self.TEST_RETAILER,
+                    {"availability": Product.Availability.in_stock},
+                ),
+            ],
+        )
+        self.assertEqual(results[retailer_id]['status'], 0)
+        self.assertEqual(results[self.TEST_RETAILER]['status'], 1)
+
+    def test_sync(self):
+        path = os.path.join(tempfile.mkdtemp(), 'products.db')
+        snapshot = ProductCatalogSnapshot(
+            path,
+            ProductUpdateSample.SNAPSHOT_FIELDS,
+        )
+        count = self.sample.refresh_catalog_snapshot(
+            self.TEST_CATALOG,
+            snapshot,
+        )
+        self.assertGreater(count, 0, 'refresh snapshot')
+
+        items = [
+            (
+                self.TEST_RETAILER,
+                {"availability": Product.Availability.in_stock},
+            ),
+        ]
+        results, stats = self.sample.sync_product_items(
+            self.TEST_CATALOG,
+            items,
+            snapshot,
+        )
+        self.assertEqual(stats['failed'], 0)
+
+        # nothing changed since the previous sync
+        results, stats = self.sample.sync_product_items(
+            self.TEST_CATALOG,
+            items,
+            snapshot,
+        )
+        self.assertEqual(stats['unchanged'], 1)
+        self.assertEqual(results, {})
+        snapshot.close()
+
+    def test_snapshot_unicode(self):
+        snapshot = ProductCatalogSnapshot(
+            ':memory:',
+            ProductUpdateSample.SNAPSHOT_FIELDS,
+        )
+        row = snapshot.get_row({'name': 'Coffee'})
+
+        # retailer ids read from the API are unicode, those of a feed may
+        # be UTF-8 encoded
+        snapshot.put_many(self.TEST_CATALOG, [(u'caf\xe9-1', row)])
+        self.assertEqual(
+            snapshot.get_many(
+                self.TEST_CATALOG,
+                [u'caf\xe9-1', 'caf\xc3\xa9-1'],
+            ),
+            {'caf\xc3\xa9-1': row},
+        )
+        snapshot.close()
+
+    def test_sync_price(self):
+        path = os.path.join(tempfile.mkdtemp(), 'products.db')
+        snapshot = ProductCatalogSnapshot(
+            path,
+            ProductUpdateSample.SNAPSHOT_FIELDS,
+        )
+        self.sample.refresh_catalog_snapshot(self.TEST_CATALOG, snapshot)
+
+        # prices are written in cents, unlike the formatted prices read
+        # by the refresh, so the first sync sends them with their currency
+        items = [
+            (self.TEST_RETAILER, {"price": 19999, "currency": "USD"}),
+        ]
+        results, stats = self.sample.sync_product_items(
+            self.TEST_CATALOG,
+            items,
+            snapshot,
+        )
+        self.assertEqual(stats['updated'], 1)
+
+        results, stats = self.sample.sync_product_items(
+            self.TEST_CATALOG,
+            items,
+            snapshot,
+        )
+        self.assertEqual(stats['unchanged'], 1)
@@ -0,0 +1,105 @@
+# Copyright (c) 2016-present, Facebook, Inc. All rights reserved.
+#
+# You are hereby granted a non-exclusive, worldwide, royalty-free license to
+# use, copy, modify, and distribute this software in source code or binary
+# form for use in connection with the web services and APIs provided by
+# Facebook.
+#
+# As with any software that integrates with the Facebook platform, your use of
+# this software is subject to the Facebook Developer Principles and Policies
+# [http://developers.facebook.com/policy/]. This copyright notice shall be
+# included in all copies or substantial portions of the software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from samples.samplecode.tests.sampletestcase import SampleTestCase
+from samples.samplecode.reach_estimate_cache import ReachEstimateCache
+import os
+import tempfile
+
+
+class ReachEstimateCacheTestCase(SampleTestCase):
+
+    def setUp(self):
+        super(ReachEstimateCacheTestCase, self).setUp()
+        self.path = os.path.join(tempfile.mkdtemp(), 'reach_estimates.db')
+        self.cache = ReachEstimateCache(self.path)
+
+    def test_normal(self):
+        targeting_spec = {
+            'geo_locations': {'countries': ['US']},
+            'age_min': 20,
+        }
+        estimate = self.cache.get_reach_estimate(
+            self.account_id,
+            targeting_spec,
+            'IMPRESSIONS',
+        )
+        self.assertIn('users', estimate)
+
+        # the same spec with its keys in another order is not fetched again
+        self.assertEqual(
+            self.cache.get_reach_estimate(
+                self.account_id,
+                {'age_min': 20, 'geo_locations': {'countries': ['US']}},
+                'IMPRESSIONS',
+            ),
+            estimate,
+        )
+        self.assertEqual(self.cache.misses, 1)
+        self.assertEqual(self.cache.hits, 1)
+
+        # another cache on the same file reads it from there
+        cache = ReachEstimateCache(self.path)
+        self.assertEqual(
+            cache.get_reach_estimate(
+                self.account_id,
+                targeting_spec,
+                'IMPRESSIONS',
+            )['users'],
+            estimate['users'],
+        )
+        self.assertEqual(cache.get_stats()['persistent_hits'], 1)
+        cache.close()
+
+    def test_copy(self):
+        key = self.cache.get_key(self.account_id, {}, 'IMPRESSIONS', 'USD')
+        estimate = self.cache.get_or_fetch(key, lambda: {'users': 1000})
+
+        # changing a returned estimate does not change the cached one
+        estimate['users'] = 0
+        self.assertEqual(self.cache.get(key), {'users': 1000})
+
+    def test_not_ready(self):
+        key = self.cache.get_key(self.account_id, {}, 'IMPRESSIONS', 'USD')
+        self.cache.get_or_fetch(
+            key,
+            lambda: {'users': 1000, 'estimate_ready': False},
+        )
+        # an estimate still being computed is fetched again
+        self.assertIsNone(self.cache.get(key))
+
+    def test_list_order(self):
+        self.assertEqual(
+            self.cache.get_key(
+                self.account_id,
+                {'geo_locations': {'countries': ['US', 'GB']}},
+                'IMPRESSIONS',
+                'USD',
+            ),
+            self.cache.get_key(
+                self.account_id,
+                {'geo_locations': {'countries': ['GB', 'US']}},
+                'IMPRESSIONS',
+                'USD',
+            ),
+        )
+
+    def tearDown(self):
+        self.cache.close()
@@ -60,6 +60,32 @@ class TieredLookalikeTestCase(SampleTestCase):
         self.assertEqual(len(self.results['adsets']), 2)
         self.assertEqual(len(self.results['ads']), 2)
 
+    def test_pipeline(self):
+        self.results = self.tiered_sample.create_tiered_campaign(
+            self.account_id,
+            "tiered_adset_test",  # adset_name
+            "tiered_lookalike_test",  # lookalike_name
+            self.ca_id,  # ca_id
+            "US",  # country
+            'IMPRESSIONS',  # optimization_goal
+            'IMPRESSIONS',  # billing_event
+            [
+                200,
+                100,
+            ],  # tiered_bid_amounts
+            "test title",  # title
+            "test body",  # body
+            "https://www.facebookmarketingdevelopers.com",  # url
+            self.images[0],
+            1000,  # daily_budget,
+        )
+        self.tiered_lookalikes = self.results['lookalikes']
+        self.assertEqual(len(self.tiered_lookalikes), 2)
+        self.assertEqual(len(self.results['adsets']), 2)
+        self.assertEqual(len(self.results['ads']), 2)
+        for ad_set, ad in zip(self.results['adsets'], self.results['ads']):
+            self.assertEqual(ad['adset_id'], ad_set['id'])
+
     def tearDown(self):
         super(TieredLookalikeTestCase, self).tearDown()
         if hasattr(self, 'results'):
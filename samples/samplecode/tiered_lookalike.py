@@ -33,14 +33,21 @@ ID as the seed audience. Then, it creates 5 ad sets that target to the tiered
 lookalike audiences with different bidding settings: bid more on higher
 similarity and less with lower similarity level.
 
+All the tiers are created with one batch request, while the campaign is
+created and the image uploaded. The ad sets and ads of all the tiers are then
+created with another batch request, each ad referring to the id of its ad set
+in the same batch.
+
 ## References:
 
 * [Lookalike audiences doc][1]
+* [Batch requests][2]
 
 [1]: https://developers.facebook.com/docs/marketing-api/lookalike-audience-targeting
+[2]: https://developers.facebook.com/docs/graph-api/making-multiple-requests
 """
+from facebookads.api import FacebookAdsApi
 from facebookads.objects import (
-    AdImage,
     AdCreative,
     Ad,
     AdSet,
@@ -49,6 +56,8 @@ from facebookads.objects import (
     CustomAudience,
     LookalikeAudience,
 )
+from adimage_cache import default_uploader
+from utils import BoundedExecutor, generate_batches
 
 
 class TieredLookalikeSample:
@@ -59,21 +68,36 @@ class TieredLookalikeSample:
     [Lookalike Audiences doc](
     https://developers.facebook.com/docs/
     marketing-api/lookalike-audience-targeting/).
+
+    `create_tiered_campaign` does both in about two round trips.
     """
+
+    # maximum number of requests in a Graph API batch request
+    BATCH_SIZE_LIMIT = 50
+
+    # worker threads shared by every instance, to send independent requests
+    # at the same time
+    executor = BoundedExecutor(max_workers=8, name='tiered_lookalike')
+
     def create_tiered_lookalikes(
         self,
         account_id,
         name,
         seed_id,
         tiers,
-        country
+        country,
+        api=None
     ):
         """
         Take a seed custom audiences ID and create tiered lookalike audiences
+        with one batch request per `BATCH_SIZE_LIMIT` tiers.
         """
+        if not api:
+            api = FacebookAdsApi.get_default_api()
+
         tiered_audiences = []
         for tier in range(1, tiers + 1):
-            lookalike = CustomAudience(parent_id=account_id)
+            lookalike = CustomAudience(parent_id=account_id, api=api)
             lookalike[LookalikeAudience.Field.name] = \
                 '{0} LAL {1}'.format(name, tier)
             lookalike[LookalikeAudience.Field.origin_audience_id] = seed_id
@@ -91,10 +115,18 @@ class TieredLookalikeSample:
             lookalike[LookalikeAudience.Field.lookalike_spec] = lal_spec
             lookalike[CustomAudience.Field.subtype] = \
                 CustomAudience.Subtype.lookalike
-            lookalike.remote_create()
-
             tiered_audiences.append(lookalike)
 
+        for batch in generate_batches(tiered_audiences, self.BATCH_SIZE_LIMIT):
+            api_batch = api.new_batch()
+            errors = []
+            for lookalike in batch:
+                lookalike.remote_create(
+                    batch=api_batch,
+                    failure=lambda response: errors.append(response.error()),
+                )
+            self.execute_batch(api_batch, errors)
+
         return tiered_audiences
 
     def create_lookalike_ads(
@@ -118,35 +150,171 @@ class TieredLookalikeSample:
         end_time=None,
 
         campaign=None,
+        api=None,
     ):
         """
-        Take the tiered lookalike audiences and create the ads
+        Take the tiered lookalike audiences and create the ads.
+
+        The campaign is created while the image is uploaded, then the ad sets
+        and ads of all the tiers are created with one batch request per
+        `BATCH_SIZE_LIMIT / 2` tiers.
         """
-        results = {
-            'adsets': [],
-            'ads': [],
-        }
+        if not api:
+            # keep a copy of the Ads API session as we're going to be using
+            # it across new threads
+            api = FacebookAdsApi.get_default_api()
 
-        tiers = len(tiered_lookalikes)
-        if tiers != len(tiered_bid_amounts):
+        if len(tiered_lookalikes) != len(tiered_bid_amounts):
             raise TypeError('Audience and bid amount number mismatch.')
 
-        # Create campaign
+        tasks = {
+            'image_hash': lambda: self.upload_image(
+                api,
+                account_id,
+                image_path,
+            ),
+        }
         if not campaign:
-            campaign = Campaign(parent_id=account_id)
-            campaign[Campaign.Field.name] = '{} Campaign'.format(name)
-            campaign[Campaign.Field.objective] = \
-                Campaign.Objective.link_clicks
+            tasks['campaign'] = lambda: self.create_campaign(
+                api,
+                account_id,
+                name,
+            )
+        results = self.run_tasks(tasks)
+
+        return self.create_tiered_ads(
+            api,
+            account_id,
+            name,
+            results.get('campaign', campaign),
+            tiered_lookalikes,
+            optimization_goal,
+            billing_event,
+            tiered_bid_amounts,
+            title,
+            body,
+            url,
+            results['image_hash'],
+            daily_budget,
+            lifetime_budget,
+            start_time,
+            end_time,
+        )
+
+    def create_tiered_campaign(
+        self,
+        account_id,
+        name,
+        lookalike_name,
+        seed_id,
+        country,
+
+        optimization_goal,
+        billing_event,
+        tiered_bid_amounts,
+
+        title,
+        body,
+        url,
+        image_path,
+
+        daily_budget=None,
+        lifetime_budget=None,
+        start_time=None,
+        end_time=None,
+
+        campaign=None,
+        api=None,
+    ):
+        """
+        Create one tier of lookalike audience per bid amount of
+        `tiered_bid_amounts`, and their ad sets and ads.
 
-            campaign.remote_create(params={
-                'status': Campaign.Status.paused,
-            })
+        The lookalike audiences, the campaign and the image are created at
+        the same time, then the ad sets and ads with one batch request, so
+        the whole setup takes about two round trips instead of three per
+        tier.
 
-        # Upload image
-        img = AdImage(parent_id=account_id)
-        img[AdImage.Field.filename] = image_path
-        img.remote_create()
-        image_hash = img.get_hash()
+        Returns the results of `create_lookalike_ads` with the
+        `lookalikes`.
+        """
+        if not api:
+            # keep a copy of the Ads API session as we're going to be using
+            # it across new threads
+            api = FacebookAdsApi.get_default_api()
+
+        tasks = {
+            'lookalikes': lambda: self.create_tiered_lookalikes(
+                account_id,
+                lookalike_name,
+                seed_id,
+                len(tiered_bid_amounts),
+                country,
+                api=api,
+            ),
+            'image_hash': lambda: self.upload_image(
+                api,
+                account_id,
+                image_path,
+            ),
+        }
+        if not campaign:
+            tasks['campaign'] = lambda: self.create_campaign(
+                api,
+                account_id,
+                name,
+            )
+        results = self.run_tasks(tasks)
+
+        ads = self.create_tiered_ads(
+            api,
+            account_id,
+            name,
+            results.get('campaign', campaign),
+            results['lookalikes'],
+            optimization_goal,
+            billing_event,
+            tiered_bid_amounts,
+            title,
+            body,
+            url,
+            results['image_hash'],
+            daily_budget,
+            lifetime_budget,
+            start_time,
+            end_time,
+        )
+        ads['lookalikes'] = results['lookalikes']
+        return ads
+
+    def create_tiered_ads(
+        self,
+        api,
+        account_id,
+        name,
+        campaign,
+        tiered_lookalikes,
+        optimization_goal,
+        billing_event,
+        tiered_bid_amounts,
+        title,
+        body,
+        url,
+        image_hash,
+        daily_budget,
+        lifetime_budget,
+        start_time,
+        end_time,
+    ):
+        """
+        Create the ad set and ad of every tier. The ad of a tier is in the
+        same batch request as its ad set, and refers to its id with a
+        `{result=...}` reference.
+        """
+        results = {
+            'adsets': [],
+            'ads': [],
+        }
 
         # Inline creative for ads
         inline_creative = {
@@ -156,49 +324,145 @@ class TieredLookalikeSample:
             AdCreative.Field.image_hash: image_hash,
         }
 
-        for tier in range(1, tiers + 1):
-            # Create ad set
-            ad_set = AdSet(parent_id=account_id)
-            ad_set[AdSet.Field.campaign_id] = campaign.get_id_assured()
-            ad_set[AdSet.Field.name] = '{0} AdSet tier {1}'.format(name, tier)
-            ad_set[AdSet.Field.optimization_goal] = optimization_goal
-            ad_set[AdSet.Field.billing_event] = billing_event
-            ad_set[AdSet.Field.bid_amount] = tiered_bid_amounts[tier - 1]
-            if daily_budget:
-                ad_set[AdSet.Field.daily_budget] = daily_budget
-            else:
-                ad_set[AdSet.Field.lifetime_budget] = lifetime_budget
-            if end_time:
-                ad_set[AdSet.Field.end_time] = end_time
-            if start_time:
-                ad_set[AdSet.Field.start_time] = start_time
-
-            audience = tiered_lookalikes[tier - 1]
-
-            targeting = {
-                TargetingSpecsField.custom_audiences: [{
-                    'id': audience[CustomAudience.Field.id],
-                    'name': audience[CustomAudience.Field.name],
-                }]
-            }
-
-            ad_set[AdSet.Field.targeting] = targeting
-
-            ad_set.remote_create(params={
-                'status': AdSet.Status.paused,
-            })
+        tiers = range(1, len(tiered_lookalikes) + 1)
+        for batch in generate_batches(tiers, self.BATCH_SIZE_LIMIT / 2):
+            pairs = []
+            for tier in batch:
+                # Create ad set
+                ad_set = AdSet(parent_id=account_id, api=api)
+                ad_set[AdSet.Field.campaign_id] = campaign.get_id_assured()
+                ad_set[AdSet.Field.name] = \
+                    '{0} AdSet tier {1}'.format(name, tier)
+                ad_set[AdSet.Field.optimization_goal] = optimization_goal
+                ad_set[AdSet.Field.billing_event] = billing_event
+                ad_set[AdSet.Field.bid_amount] = tiered_bid_amounts[tier - 1]
+                if daily_budget:
+                    ad_set[AdSet.Field.daily_budget] = daily_budget
+                else:
+                    ad_set[AdSet.Field.lifetime_budget] = lifetime_budget
+                if end_time:
+                    ad_set[AdSet.Field.end_time] = end_time
+                if start_time:
+                    ad_set[AdSet.Field.start_time] = start_time
+
+                audience = tiered_lookalikes[tier - 1]
+
+                targeting = {
+                    TargetingSpecsField.custom_audiences: [{
+                        'id': audience[CustomAudience.Field.id],
+                        'name': audience[CustomAudience.Field.name],
+                    }]
+                }
+
+                ad_set[AdSet.Field.targeting] = targeting
+
+                # Create ad
+                ad = Ad(parent_id=account_id, api=api)
+                ad[Ad.Field.name] = '{0} Ad tier {1}'.format(name, tier)
+                ad[Ad.Field.creative] = inline_creative
+                pairs.append((tier, ad_set, ad))
+
+            self.execute_tier_batches(api, pairs)
+
+            for tier, ad_set, ad in pairs:
+                results['adsets'].append(ad_set)
+                results['ads'].append(ad)
 
-            # Create ad
-            ad = Ad(parent_id=account_id)
-            ad[Ad.Field.name] = '{0} Ad tier {1}'.format(name, tier)
-            ad[Ad.Field.adset_id] = ad_set['id']
-            ad[Ad.Field.creative] = inline_creative
+        return results
 
-            ad.remote_create(params={
-                'status': Ad.Status.paused,
-            })
+    def execute_tier_batches(self, api, pairs, max_retries=2):
+        """
+        Create the `(tier, ad_set, ad)` pairs with one batch request, and
+        raise the first error. The pairs which got no response are sent
+        again, up to `max_retries` times: the whole pair if the ad set was
+        not created, or else the ad alone, with the id of its ad set.
+        """
+        pending = pairs
+        for attempt in range(max_retries + 1):
+            api_batch = api.new_batch()
+            errors = []
+
+            def callback_failure(response):
+                errors.append(response.error())
+
+            for tier, ad_set, ad in pending:
+                if AdSet.Field.id in ad_set:
+                    ad[Ad.Field.adset_id] = ad_set[AdSet.Field.id]
+                else:
+                    call = ad_set.remote_create(
+                        batch=api_batch,
+                        failure=callback_failure,
+                        params={
+                            'status': AdSet.Status.paused,
+                        },
+                    )
+                    # name the request so that the ad can refer to its
+                    # result, which the batch only returns when asked to
+                    call['name'] = 'adset_{0}'.format(tier)
+                    call['omit_response_on_success'] = False
+                    ad[Ad.Field.adset_id] = \
+                        '{{result=adset_{0}:$.id}}'.format(tier)
+
+                ad.remote_create(
+                    batch=api_batch,
+                    failure=callback_failure,
+                    params={
+                        'status': Ad.Status.paused,
+                    },
+                )
+
+            api_batch.execute()
+            if errors:
+                raise errors[0]
+
+            pending = [pair for pair in pending if Ad.Field.id not in pair[2]]
+            if not pending:
+                break
+
+        for tier, ad_set, ad in pairs:
+            if AdSet.Field.id in ad_set:
+                ad[Ad.Field.adset_id] = ad_set[AdSet.Field.id]
+        if pending:
+            raise RuntimeError(
+                'No response for the ads of tiers %s' %
+                ', '.join(str(pair[0]) for pair in pending)
+            )
+
+    def create_campaign(self, api, account_id, name):
+        campaign = Campaign(parent_id=account_id, api=api)
+        campaign[Campaign.Field.name] = '{} Campaign'.format(name)
+        campaign[Campaign.Field.objective] = \
+            Campaign.Objective.link_clicks
+
+        campaign.remote_create(params={
+            'status': Campaign.Status.paused,
+        })
+        return campaign
+
+    def upload_image(self, api, account_id, image_path):
+        return default_uploader.upload_ad_image(account_id, image_path, api)
+
+    def run_tasks(self, tasks):
+        """
+        Call the functions of the `tasks` dict at the same time on the
+        `executor` and return a dict of their results by key.
+        """
+        def run(task):
+            key, func = task
+            return key, func()
 
-            results['adsets'].append(ad_set)
-            results['ads'].append(ad)
+        return dict(self.executor.map_unordered(run, tasks.items()))
 
-        return results
+    def execute_batch(self, api_batch, errors, max_retries=2):
+        """
+        Execute a batch request and raise the first error that the failure
+        callbacks appended to `errors`. The requests which got no response
+        are sent again, up to `max_retries` times, so they must not refer
+        to the results of other requests.
+        """
+        for attempt in range(max_retries + 1):
+            api_batch = api_batch.execute()
+            if not api_batch or errors:
+                break
+        if errors:
+            raise errors[0]
@@ -18,6 +18,12 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import Queue
+import sys
+import threading
+import time
+import weakref
+
 
 def generate_batches(iterable, batch_size_limit):
     """
@@ -34,3 +40,275 @@ def generate_batches(iterable, batch_size_limit):
 
     if len(batch):
         yield batch
+
+
+def buffer_iterable_async(iterable, buffer_size=100, daemon=True):
+    """
+    Helper function for buffering blocking iterables on a worker thread.
+
+    The worker thread keeps at most `buffer_size` items ahead of the
+    consumer, so a slow consumer never causes unbounded memory growth.
+    """
+
+    YIELD = 0
+    RAISE = 1
+    BREAK = 2
+
+    def iterate(iterable, thread_state, buffer):
+        try:
+            for el in iterable:
+                buffer.put((YIELD, el,))
+                if thread_state.get(BREAK):
+                    break
+        except Exception, e:
+            buffer.put((RAISE, e, sys.exc_info()[2],))
+        else:
+            buffer.put((BREAK,))
+
+    buffer = Queue.Queue(maxsize=buffer_size)
+    thread_state = dict()
+
+    t = threading.Thread(
+        target=iterate,
+        args=(iterable, thread_state, buffer),
+    )
+    t.daemon = daemon
+    t.start()
+
+    def iterator():
+        try:
+            for signal in iter(buffer.get, (BREAK,)):
+                if signal[0] == YIELD:
+                    yield signal[1]
+                elif signal[0] == RAISE:
+                    raise signal[1], None, signal[2]
+        finally:
+            thread_state[BREAK] = True
+            while buffer.full():
+                buffer.get_nowait()
+            t.join()
+
+    return iterator()
+
+
+class BoundedExecutor:
+    """
+    A fixed pool of worker threads that drain blocking iterables into
+    bounded buffers.
+
+    Unlike `buffer_iterable_async`, which starts one thread per iterable,
+    every iterable submitted to the same executor shares its
+    `max_workers` threads, so concurrency stays capped no matter how many
+    callers use it at once. Threads are started on first use.
+
+    A consumer which stops iterating early should `close()` the iterator it
+    got, or drop it: until then the workers draining its iterables block
+    on its full buffer and are not available to other callers.
+    """
+
+    YIELD = 0
+    RAISE = 1
+    BREAK = 2
+
+    def __init__(self, max_workers=8, name='executor'):
+        self.max_workers = max_workers
+        self.name = name
+        self.tasks = Queue.Queue()
+        self.worker_stats = []
+        self.consumer_stats = {'gets': 0, 'get_wait': 0.0}
+        self.lock = threading.Lock()
+
+    def start(self):
+        with self.lock:
+            while len(self.worker_stats) < self.max_workers:
+                stats = {
+                    'name': '%s-%d' % (self.name, len(self.worker_stats)),
+                    'tasks': 0,
+                    'items': 0,
+                    'idle_wait': 0.0,
+                    'put_wait': 0.0,
+                    'max_depth': 0,
+                }
+                t = threading.Thread(
+                    target=self.work,
+                    args=(stats, ),
+                    name=stats['name'],
+                )
+                t.daemon = True
+                t.start()
+                self.worker_stats.append(stats)
+
+    def work(self, stats):
+        while True:
+            start_time = time.time()
+            iterable, buffer, state = self.tasks.get()
+            stats['idle_wait'] += time.time() - start_time
+
+            if self.is_abandoned(state):
+                # the consumer has gone away before the task started
+                continue
+
+            stats['tasks'] += 1
+            try:
+                for el in iterable:
+                    if not self.put(buffer, (self.YIELD, el,), state, stats):
+                        break
+                    stats['items'] += 1
+            except Exception, e:
+                self.put(
+                    buffer,
+                    (self.RAISE, e, sys.exc_info()[2],),
+                    state,
+                    stats,
+                )
+            else:
+                self.put(buffer, (self.BREAK,), state, stats)
+
+    def put(self, buffer, signal, state, stats):
+        """
+        Put a signal in a buffer, giving up once the consumer has gone away
+        """
+        stats['max_depth'] = max(stats['max_depth'], buffer.qsize())
+        start_time = time.time()
+        try:
+            while not self.is_abandoned(state):
+                try:
+                    buffer.put(signal, timeout=1)
+                    return True
+                except Queue.Full:
+                    pass
+            return False
+        finally:
+            stats['put_wait'] += time.time() - start_time
+
+    def is_abandoned(self, state):
+        """
+        Whether the consumer was closed, or garbage collected without ever
+        being iterated, in which case it never gets to set `BREAK`
+        """
+        return state.get(self.BREAK) or state['consumer']() is None
+
+    def get(self, buffer):
+        """
+        Get a signal from a buffer, counting the time the consumer blocks
+        """
+        start_time = time.time()
+        signal = buffer.get()
+        with self.lock:
+            self.consumer_stats['gets'] += 1
+            self.consumer_stats['get_wait'] += time.time() - start_time
+        return signal
+
+    def buffer_iterables(self, iterables, buffer_size=30, ordered=True):
+        """
+        Drain `iterables` concurrently on the worker threads and return an
+        iterator over their items.
+
+        With `ordered`, items come out iterable by iterable in the order
+        given, each iterable being buffered `buffer_size` items ahead.
+        Otherwise items come out as soon as any iterable produces them,
+        through a single buffer shared by all iterables.
+        """
+        self.start()
+
+        iterables = list(iterables)
+        state = dict()
+        if ordered:
+            buffers = [Queue.Queue(maxsize=buffer_size) for i in iterables]
+        else:
+            shared = Queue.Queue(maxsize=buffer_size * max(len(iterables), 1))
+            buffers = [shared] * len(iterables)
+
+        def drain(buffer, num_iterables):
+            while num_iterables:
+                signal = self.get(buffer)
+                if signal[0] == self.YIELD:
+                    yield signal[1]
+                elif signal[0] == self.RAISE:
+                    raise signal[1], None, signal[2]
+                else:
+                    num_iterables -= 1
+
+        def iterator():
+            try:
+                if ordered:
+                    for buffer in buffers:
+                        for el in drain(buffer, 1):
+                            yield el
+                elif iterables:
+                    for el in drain(shared, len(iterables)):
+                        yield el
+            finally:
+                state[self.BREAK] = True
+
+        consumer = iterator()
+        state['consumer'] = weakref.ref(consumer)
+        for iterable, buffer in zip(iterables, buffers):
+            self.tasks.put((iterable, buffer, state))
+        return consumer
+
+    def map_unordered(self, func, items, max_pending=None):
+        """
+        Call `func` on every item on the worker threads and yield the
+        results as they complete. Items are read lazily and at most
+        `max_pending` calls are queued or running at once, so `items` can
+        be a generator over more items than fit in memory.
+        """
+        self.start()
+        if not max_pending:
+            max_pending = 2 * self.max_workers
+
+        state = dict()
+        results = Queue.Queue()
+
+        def call(item):
+            yield func(item)
+
+        def iterator():
+            items_iterator = iter(items)
+            pending = 0
+            exhausted = False
+            try:
+                while True:
+                    while not exhausted and pending < max_pending:
+                        try:
+                            item = next(items_iterator)
+                        except StopIteration:
+                            exhausted = True
+                            break
+                        self.tasks.put((call(item), results, state))
+                        pending += 1
+
+                    if not pending:
+                        break
+
+                    signal = self.get(results)
+                    if signal[0] == self.YIELD:
+                        yield signal[1]
+                    elif signal[0] == self.RAISE:
+                        raise signal[1], None, signal[2]
+                    else:
+                        pending -= 1
+            finally:
+                state[self.BREAK] = True
+
+        consumer = iterator()
+        state['consumer'] = weakref.ref(consumer)
+        return consumer
+
+    def get_stats(self):
+        """
+        Return the number of tasks waiting for a worker, the number of
+        items consumers got and the seconds they spent blocked waiting for
+        them and, per worker, the tasks and items it processed, the seconds
+        it spent idle waiting for a task and blocked putting items, and the
+        deepest buffer it saw
+        """
+        with self.lock:
+            consumer_stats = dict(self.consumer_stats)
+        return {
+            'pending': self.tasks.qsize(),
+            'gets': consumer_stats['gets'],
+            'get_wait': consumer_stats['get_wait'],
+            'workers': [dict(stats) for stats in self.worker_stats],
+        }
@@ -19,6 +19,7 @@
 # SOFTWARE.
 
 from django import forms
+import json
 from samples.samplecode import customaudience
 from samples.views.sample import SampleBaseView
 from components.component_form import ComponentForm
@@ -62,11 +63,12 @@ class CustomAudienceView(SampleBaseView):
             form.cleaned_data['name'],
             form.cleaned_data['description'],
             form.cleaned_data['optout_link'])
-        cadata = []
-        for line in form.cleaned_data['data_file']:
-            cadata.append(line)
-
-        result = casample.upload_users_to_audience(caid, cadata, schema)
-        status = result.body()
+        # stream the file instead of reading it all into memory
+        stats = casample.upload_users_streaming(
+            caid,
+            form.cleaned_data['data_file'],
+            schema,
+        )
+        status = json.dumps(stats)
 
         return self.render_form_with_status(request, form, status)
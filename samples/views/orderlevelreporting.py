@@ -111,12 +111,14 @@ class OrderLevelReportingView(SampleBaseView):
         ))
 
         # And if we didn't raise an exception, start to stream it out
+        # in whatever order the time partitions come back
         rowsets_generator = sample.retrieve_order_level_report_data_parallel(
             from_date=from_date,
             to_date=to_date,
             business_id=business_id,
             pixel_id=pixel_id,
             app_id=app_id,
+            ordered=False,
         )
 
         stream = self.stream_rowsets_to_templates(
@@ -173,29 +175,34 @@ class OrderLevelReportingView(SampleBaseView):
             'samples/order_level_report.row.' + format,
         )
 
-        for rowset in rowsets:
+        # close the rowsets if the client goes away, which frees the shared
+        # workers fetching them
+        try:
+            for rowset in rowsets:
 
-            total_num_rows = context['cumulative_num_rows']
+                total_num_rows = context['cumulative_num_rows']
 
-            rows_left_in_preview = max(preview_limit - total_num_rows, 0)
-            context['preview_slice'] = ':' + str(rows_left_in_preview)
+                rows_left_in_preview = max(preview_limit - total_num_rows, 0)
+                context['preview_slice'] = ':' + str(rows_left_in_preview)
 
-            num_rows = len(rowset)
+                num_rows = len(rowset)
 
-            context['data'] = rowset
-            context['num_rows'] = num_rows
-            context['cumulative_num_rows'] += num_rows
+                context['data'] = rowset
+                context['num_rows'] = num_rows
+                context['cumulative_num_rows'] += num_rows
 
-            num_outline_rows = reduce(
-                lambda accum, x: accum + max(len(x['attributions']), 1),
-                rowset,
-                0,
-            )
+                num_outline_rows = reduce(
+                    lambda accum, x: accum + max(len(x['attributions']), 1),
+                    rowset,
+                    0,
+                )
 
-            context['num_outline_rows'] = num_outline_rows
-            context['cumulative_num_outline_rows'] += num_outline_rows
+                context['num_outline_rows'] = num_outline_rows
+                context['cumulative_num_outline_rows'] += num_outline_rows
 
-            yield rows_template.render(context)
+                yield rows_template.render(context)
+        finally:
+            rowsets.close()
 
         footer_template = loader.get_template(
             'samples/order_level_report.footer.' + format,
@@ -18,17 +18,170 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import re
 from django import forms
+from django.conf import settings
+from django.http import StreamingHttpResponse
 from samples.views.sample import SampleBaseView
-from samples.samplecode.product_image_check import DPAImageCheckSample
+from samples.samplecode import product_image_check
+from samples.samplecode.product_image_check import (
+    DPAImageCheckSample,
+    ImageSizeCache,
+)
 from security.fbsample import fbads_sample
 from components.component_form import ComponentForm
 from components.business_manager_select import BusinessManagerSelect
 from components.product_catalog_select import ProductCatalogSelect
 import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+import uuid
 
 logger = logging.getLogger(__name__)
 
+# image sizes are public data, so one cache is shared by all users
+IMAGE_SIZE_CACHE_PATH = os.path.join(
+    settings.SAMPLE_CACHE_DIR,
+    'product_image_check.sqlite3',
+)
+
+# CSV files of the full catalog audits
+AUDIT_DIR = os.path.join(settings.SAMPLE_CACHE_DIR, 'image_audits')
+
+# full catalog audits running at once, across the processes of the site
+MAX_RUNNING_AUDITS = 2
+
+# an audit whose partial file was not written to for this long is dead
+AUDIT_STALE_SECONDS = 30 * 60
+
+# the audit processes started by this process, by audit id
+running_audits = {}
+running_audits_lock = threading.Lock()
+
+# opened once per process, by get_image_size_cache
+image_size_cache = None
+image_size_cache_lock = threading.Lock()
+
+
+def get_image_size_cache():
+    global image_size_cache
+    with image_size_cache_lock:
+        if image_size_cache is None:
+            if not os.path.isdir(settings.SAMPLE_CACHE_DIR):
+                os.makedirs(settings.SAMPLE_CACHE_DIR, 0700)
+            image_size_cache = ImageSizeCache(IMAGE_SIZE_CACHE_PATH)
+        return image_size_cache
+
+
+def get_audit_path(audit_id, extension):
+    return os.path.join(AUDIT_DIR, audit_id + extension)
+
+
+def reap_audits():
+    """
+    Forget the audit processes of this process which exited, recording the
+    ones which failed in a `.failed` file, and return the ids of the audits
+    still running in any process of the site.
+    """
+    with running_audits_lock:
+        for audit_id, process in running_audits.items():
+            if process.poll() is None:
+                continue
+            del running_audits[audit_id]
+            if process.returncode != 0:
+                logger.warning(
+                    "Image audit %s exited with status %s, see %s",
+                    audit_id,
+                    process.returncode,
+                    get_audit_path(audit_id, '.log'),
+                )
+                mark_audit_failed(
+                    audit_id,
+                    'exit status %s' % process.returncode,
+                )
+        running = set(running_audits)
+
+    # the partial files of the audits of the other processes
+    if os.path.isdir(AUDIT_DIR):
+        for file_name in os.listdir(AUDIT_DIR):
+            if not file_name.endswith('.csv.part'):
+                continue
+            audit_id = file_name[:-len('.csv.part')]
+            if not is_audit_stale(audit_id):
+                running.add(audit_id)
+    return running
+
+
+def mark_audit_failed(audit_id, message):
+    failed_path = get_audit_path(audit_id, '.failed')
+    if not os.path.exists(failed_path):
+        with open(failed_path, 'w') as failed_file:
+            failed_file.write(message)
+    if os.path.exists(get_audit_path(audit_id, '.csv.part')):
+        os.remove(get_audit_path(audit_id, '.csv.part'))
+
+
+def is_audit_stale(audit_id):
+    """
+    Whether the partial file of an audit, or the audit itself if it has
+    none yet, was not written to for `AUDIT_STALE_SECONDS`
+    """
+    for extension in ('.csv.part', '.owner'):
+        try:
+            modified = os.path.getmtime(get_audit_path(audit_id, extension))
+        except OSError:
+            continue
+        return modified < time.time() - AUDIT_STALE_SECONDS
+    return False
+
+
+def start_audit(catalog_id, access_token, owner):
+    """
+    Audit a whole catalog in a new process, which outlives the request, and
+    return the id of the audit, or None if `MAX_RUNNING_AUDITS` are already
+    running. Its CSV file is created in `AUDIT_DIR` once complete, and can
+    only be downloaded by `owner`.
+    """
+    if not os.path.isdir(AUDIT_DIR):
+        os.makedirs(AUDIT_DIR, 0700)
+    if len(reap_audits()) >= MAX_RUNNING_AUDITS:
+        return None
+
+    audit_id = uuid.uuid4().hex
+    with open(get_audit_path(audit_id, '.owner'), 'w') as owner_file:
+        owner_file.write(str(owner))
+    env = dict(os.environ)
+    env['FB_ACCESS_TOKEN'] = access_token
+    with open(get_audit_path(audit_id, '.log'), 'w') as log_file:
+        process = subprocess.Popen(
+            [
+                sys.executable,
+                os.path.splitext(product_image_check.__file__)[0] + '.py',
+                '-f', 'csv',
+                '-o', get_audit_path(audit_id, '.csv'),
+                '--cache', IMAGE_SIZE_CACHE_PATH,
+                catalog_id,
+            ],
+            env=env,
+            stdout=log_file,
+            stderr=subprocess.STDOUT,
+            close_fds=True,
+        )
+    with running_audits_lock:
+        running_audits[audit_id] = process
+    return audit_id
+
+
+def get_audit_owner(audit_id):
+    try:
+        with open(get_audit_path(audit_id, '.owner')) as owner_file:
+            return owner_file.read()
+    except IOError:
+        return None
+
 
 class ProductImageCheckForm(ComponentForm):
 
@@ -42,6 +195,12 @@ class ProductImageCheckForm(ComponentForm):
         required=True,
         initial=10
     )
+    full_catalog = forms.BooleanField(
+        label="Download a CSV file with a verdict for every product of the " +
+        "catalog instead. This ignores the number above. Very large " +
+        "catalogs are better checked with the command line script.",
+        required=False,
+    )
 
 
 class ProductImageCheckView(SampleBaseView):
@@ -51,8 +210,51 @@ class ProductImageCheckView(SampleBaseView):
     @fbads_sample('samples.samplecode.product_image_check')
     def get(self, request, *args, **kwargs):
         form = ProductImageCheckForm(request.last_error_post)
+        audit_id = request.GET.get('audit', '')
+        if re.match('^[0-9a-f]{32}$', audit_id):
+            return self.get_audit(request, form, audit_id)
         return self.render_form(request, form)
 
+    def get_audit(self, request, form, audit_id):
+        # the verdicts of a catalog are only for the user who checked it
+        if get_audit_owner(audit_id) != str(request.session['fbuserid']):
+            return self.render_form_with_error(request, form, 'Unknown audit.')
+
+        running = reap_audits()
+        path = get_audit_path(audit_id, '.csv')
+        if os.path.exists(path):
+            response = StreamingHttpResponse(
+                open(path, 'rb'),
+                content_type='text/csv',
+            )
+            response['Content-Disposition'] = (
+                'attachment; filename="image_check_' + audit_id + '.csv"'
+            )
+            return response
+        if audit_id not in running and is_audit_stale(audit_id):
+            mark_audit_failed(audit_id, 'no progress')
+        if os.path.exists(get_audit_path(audit_id, '.failed')):
+            return self.render_form_with_error(
+                request,
+                form,
+                'The catalog could not be checked. Please try again.',
+            )
+        if audit_id in running:
+            return self.render_form_with_status(
+                request,
+                form,
+                'The catalog is still being checked. <a href="?audit=' +
+                audit_id + '">Try again</a> in a few minutes.',
+            )
+        # started by another process of the site, whose output is not
+        # created yet
+        return self.render_form_with_status(
+            request,
+            form,
+            'The catalog check is starting. <a href="?audit=' +
+            audit_id + '">Try again</a> in a few minutes.',
+        )
+
     @fbads_sample('samples.samplecode.product_image_check')
     def post(self, request, *args, **kwargs):
         form = ProductImageCheckForm(request.POST, request.FILES)
@@ -62,7 +264,30 @@ class ProductImageCheckView(SampleBaseView):
         # Get form parameters
         catalog_id = form.cleaned_data['catalog_id']
         limit = form.cleaned_data['limit']
-        image_check = DPAImageCheckSample()
+        image_check = DPAImageCheckSample(cache=get_image_size_cache())
+
+        if form.cleaned_data['full_catalog']:
+            # the audit forks processes and takes long, so it runs on its
+            # own rather than in this request
+            audit_id = start_audit(
+                re.sub("[^0-9]", "", catalog_id),
+                request.session['token'],
+                request.session['fbuserid'],
+            )
+            if audit_id is None:
+                return self.render_form_with_error(
+                    request,
+                    form,
+                    'Too many catalogs are being checked. Please try again ' +
+                    'later.',
+                )
+            return self.render_form_with_status(
+                request,
+                form,
+                'The catalog is being checked. <a href="?audit=' + audit_id +
+                '">Download the CSV file</a> once it is complete.',
+            )
+
         result = image_check.check_product_images(
             catalog_id,
             limit
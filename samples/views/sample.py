@@ -20,6 +20,7 @@
 
 import os
 import time
+from django.conf import settings
 from django.http import Http404
 from django.views.generic import View, ListView
 from django.shortcuts import render, redirect
@@ -34,6 +35,13 @@ from common.utils import (log_and_return_error,
                           logout_user,
                           add_success_message,
                           add_error_message)
+from samples.samplecode.adimage_cache import default_uploader
+
+# the ad images uploaded by the samples are cached with the other local
+# caches of the site, rather than in the shared temporary directory
+default_uploader.set_cache_path(
+    os.path.join(settings.SAMPLE_CACHE_DIR, 'adimage_cache.sqlite3'),
+)
 
 
 class SampleCatalog(ListView):
@@ -152,22 +152,15 @@ class TieredLookalikeView(SampleBaseView):
             Lookalike audiences are ready, move on to ad creation
         """
         try:
-            # Create lookalike audiences from the source
+            # Create lookalike audiences from the source, and the ads
             tiered_sample = tiered_lookalike.TieredLookalikeSample()
-            tiered_audiences = tiered_sample.create_tiered_lookalikes(
+            results = tiered_sample.create_tiered_campaign(
                 accountid,
+                name,
                 lookalike_audience_name,
                 caid,
-                TIERS,
-                country
-            )
-
-            # Create the ads
-            results = tiered_sample.create_lookalike_ads(
-                accountid,
-                name,
+                country,
 
-                tiered_audiences,
                 optimization_goal,
                 billing_event,
                 bid_amounts,